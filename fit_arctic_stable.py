@@ -16,17 +16,15 @@ from libyana.exputils import argutils
 from libyana.randomutils import setseeds
 
 from homan import getdataset
-from homan.eval import evalviz, pointmetrics, saveresults
+from homan.eval import pointmetrics, saveresults
 from homan.jointopt import optimize_hand_object
 from homan.lib2d import maskutils
 from homan.pointrend import MaskExtractor
 from homan.arctic_pose_optimization import find_optimal_poses
-from homan.prepare.frameinfos import get_frame_infos, get_gt_infos
-from homan.tracking import preprocess
-from homan.utils.bbox import bbox_xy_to_wh, make_bbox_square
-from homan.visualize import visualize_hand_object
-from homan.viz import cliputils
-from homan.viz.viz_gtpred_points import viz_gtpred_points
+from homan.prepare import prefetch
+from homan.prepare.evidencecache import EvidenceCache
+from homan.prepare.frameinfos import get_gt_infos
+from homan.viz import vizqueue
 from homan.datasets.visor_mask_extractor import VisorMaskExtractor
 from handmocap.hand_mocap_api import HandMocap
 import pandas as pd
@@ -76,8 +74,27 @@ def get_args():
     parser.add_argument("--resume_indep", action="store_true")
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--viz_step", default=20, type=int)
+    parser.add_argument("--viz_mode",
+                        default="now",
+                        choices=vizqueue.VIZ_MODES,
+                        help="Render the final visualizations now, in a "
+                        "background process (async), save them for "
+                        "python -m homan.viz.vizqueue (defer), or skip them")
+    parser.add_argument("--viz_every", default=1, type=int,
+                        help="Visualize one sample out of viz_every")
+    parser.add_argument("--viz_workers", default=1, type=int,
+                        help="Rendering processes for --viz_mode async")
     # parser.add_argument("--save_indep", action="store_true")
     parser.add_argument("--only_missing", choices=[0, 1], type=int)
+    parser.add_argument("--prefetch", default=0, type=int,
+                        help="Number of samples prepared ahead of the "
+                        "optimizer in the background (DataLoader workers "
+                        "and a GPU evidence thread), 0 to disable")
+    parser.add_argument("--prefetch_workers", default=1, type=int,
+                        help="Worker processes loading dataset samples")
+    parser.add_argument("--evidence_cache", default=None,
+                        help="Folder caching the frame evidence (masks, hand "
+                        "regressions) across runs, disabled if None")
 
     parser.add_argument("--optimize_mano", choices=[0, 1], default=0, type=int)
     parser.add_argument("--optimize_mano_beta",
@@ -193,79 +210,74 @@ def main(args):
 
     all_metrics = defaultdict(list)
     data_stop = min(len(dataset), args.data_stop)
-    for sample_idx in range(args.data_offset, data_stop, args.data_step):
-        annots = dataset[sample_idx]
+
+    evidence_cache = EvidenceCache(
+        args.evidence_cache,
+        weight_paths=[args.hand_checkpoint, args.smpl_path])
+    viz_queue = vizqueue.VizQueue(args.viz_mode,
+                                  every=args.viz_every,
+                                  num_workers=args.viz_workers)
+
+    def get_sample_folder(annots):
+        return os.path.join(args.result_root, "samples",
+                            annots['annot_full_key'])
+
+    def is_done(annots):
+        """ Whether the sample was already fitted and should be skipped """
+        check_path = os.path.join(get_sample_folder(annots),
+                                  "epichor_metric.csv")
+        return bool(args.only_missing) and os.path.exists(check_path)
+
+    def collect_evidence(sample_idx, annots, prep):
+        """ Collect 2D and 3D evidence, run ahead of the optimizer """
+        if args.resume or is_done(annots):
+            return None
+        sample_folder = get_sample_folder(annots)
+        os.makedirs(sample_folder, exist_ok=True)
+        mask_extractor._mask_hand = annots['masks_hand']
+        mask_extractor._mask_obj = annots['masks_obj']
+        return evidence_cache.get_frame_infos(
+            prep["images_np"],
+            None, # hand_predictor,
+            mask_extractor,
+            sample_folder=sample_folder,
+            hand_bboxes=prep["hand_bboxes"],
+            obj_bboxes=prep["obj_bboxes"],
+            camintr=prep["camintr"],
+            debug=args.debug,
+            image_size=image_size,
+            key_extras=(annots['masks_hand'], annots['masks_obj']),
+        )
+
+    prefetcher = prefetch.SamplePrefetcher(
+        dataset,
+        range(args.data_offset, data_stop, args.data_step),
+        image_size,
+        evidence_fn=collect_evidence,
+        depth=args.prefetch,
+        num_workers=args.prefetch_workers)
+    for sample_idx, annots, prep, evidence in prefetcher:
         vid_start_end = annots['annot_full_key']
 
-        sample_folder = os.path.join(args.result_root, "samples", vid_start_end)
+        sample_folder = get_sample_folder(annots)
         os.makedirs(sample_folder, exist_ok=True)
         save_path = os.path.join(args.result_root, "results.pkl")
         sample_path = os.path.join(sample_folder, "results.pkl")
-        check_path = os.path.join(sample_folder, "epichor_metric.csv")
-        if args.only_missing and os.path.exists(check_path):
+        if is_done(annots):
             print(f"Skipping existing {sample_path}")
             continue
 
-        print("Pre-processing detections")
-        images = annots["images"]
-        right_hands = [
-            hand for hand in annots["hands"] if hand["label"] == "right_hand"
-        ]
-        left_hands = [
-            hand for hand in annots["hands"] if hand["label"] == "left_hand"
-        ]
         setup = annots["setup"]
-        # Get hand detections and make them square
-        hand_bboxes = {}
-        hand_expansion = 0.1
-        if len(left_hands) > 0:
-            hand_bboxes["left_hand"] = make_bbox_square(
-                bbox_xy_to_wh(left_hands[0]['bbox']),
-                bbox_expansion=hand_expansion)
-        else:
-            hand_bboxes["left_hand"] = None
-        if len(right_hands) > 0:
-            hand_bboxes["right_hand"] = make_bbox_square(
-                bbox_xy_to_wh(right_hands[0]['bbox']),
-                bbox_expansion=hand_expansion)
-        else:
-            hand_bboxes["right_hand"] = None
-
-        camintr = annots["camera"]["K"].copy()
-        # Get object bboxes and add padding
-        obj_bboxes = np.array([annots["objects"][0]['bbox']])
-        obj_bbox_padding = 5
-        obj_bboxes = obj_bboxes + np.array([
-            -obj_bbox_padding, -obj_bbox_padding, obj_bbox_padding,
-            obj_bbox_padding
-        ])
-
-        # Preprocess images
-        images_np = [
-            preprocess.get_image(image, image_size) for image in images
-        ]
-        print("Regressing hands")
-
-        camintr_nc = camintr.copy()
-        camintr_nc[:, :2] = camintr_nc[:, :2] / image_size
+        hand_bboxes = prep["hand_bboxes"]
+        obj_bboxes = prep["obj_bboxes"]
+        camintr = prep["camintr"]
+        camintr_nc = prep["camintr_nc"]
+        images_np = prep["images_np"]
 
         # indep_fit_path = os.path.join(sample_folder, "indep_fit.pkl")
         # Collect 2D and 3D evidence
         if not args.resume:
-            mask_extractor._mask_hand = annots['masks_hand']
-            mask_extractor._mask_obj = annots['masks_obj']
-
-            det_person_parameters, obj_mask_infos, super2d_imgs = get_frame_infos(
-                images_np,
-                None, # hand_predictor,
-                mask_extractor,
-                sample_folder=sample_folder,
-                hand_bboxes=hand_bboxes,
-                obj_bboxes=obj_bboxes,
-                camintr=camintr,
-                debug=args.debug,
-                image_size=image_size,
-            )
+            det_person_parameters, obj_mask_infos, super2d_imgs = evidence
             if args.gt_mano:
                 person_parameters = annots['gt_person_parameters']
                 for i in range(len(person_parameters)):
@@ -323,15 +335,12 @@ def main(args):
 
             # Populate person_parameters target_masks and K_roi given
             # object occlusions
-            for person_param, obj_param, cam in zip(person_parameters,
-                                                    object_parameters,
-                                                    camintr):
-                maskutils.add_target_hand_occlusions(
-                    person_param,
-                    obj_param,
-                    cam,
-                    debug=args.debug,
-                    sample_folder=sample_folder)
+            maskutils.add_target_hand_occlusions_batch(
+                person_parameters,
+                object_parameters,
+                camintr,
+                debug=args.debug,
+                sample_folder=sample_folder)
 
             indep_fit_res = {
                 "person_parameters": person_parameters,
@@ -371,43 +380,12 @@ def main(args):
             for key, val in vars(args).items() if "lw_" in key
         }
 
-        # Run step-1 joint optimization
-        model, loss_evolution, imgs = optimize_hand_object(
-            person_parameters=indep_fit_res["person_parameters"],
-            object_parameters=indep_fit_res["object_parameters"],
-            hand_proj_mode=args.hand_proj_mode,
-            objvertices=indep_fit_res["obj_verts_can"],
-            objfaces=indep_fit_res["obj_faces"],
-            optimize_mano=args.optimize_mano,
-            optimize_mano_beta=args.optimize_mano_beta,
-            optimize_object_scale=args.optimize_object_scale,
-            loss_weights=loss_weights,
-            image_size=image_size,
-            num_iterations=args.num_joint_iterations,
-            images=images_np,
-            camintr=camintr_nc,
-            state_dict=state_dict,
-            viz_step=args.viz_step,
-            viz_folder=None, #os.path.join(sample_folder, "jointoptim"),
-            optimize_hand_pose=False,
-        )
-        save_dict = {
-            "state_dict": {
-                key: val.contiguous() # .cpu
-                for key, val in model.state_dict().items()
-                if ("mano_model" not in key)
-            }
-        }
-
-        # Run step-2 joint optimization 
-        # adjust loss_weight
-        args.lw_collision = 0.001 
-        args.lw_contact = 1
-        loss_weights = {
-            key: val
-            for key, val in vars(args).items() if "lw_" in key
-        }
-        state_dict = save_dict
+        # Run the two joint optimization steps on the same model
+        joint_stages = [
+            dict(),
+            # Push the hands out of the object and into contact with it
+            dict(loss_weights=dict(lw_collision=0.001, lw_contact=1)),
+        ]
         model, loss_evolution, imgs = optimize_hand_object(
             person_parameters=indep_fit_res["person_parameters"],
             object_parameters=indep_fit_res["object_parameters"],
@@ -426,6 +404,7 @@ def main(args):
             viz_step=args.viz_step,
             viz_folder=None, #os.path.join(sample_folder, "jointoptim"),
             optimize_hand_pose=False,
+            stages=joint_stages,
         )
         # save_dict = {
         #     "state_dict": {
@@ -465,70 +444,18 @@ def main(args):
         gt_hand_verts = fit_hand_verts.new(gt_hand_verts)
         gt_obj_verts = fit_obj_verts.new(gt_obj_verts)
 
-        # viz_len = min(5, args.frame_nb)
         viz_len = min(5, args.frame_nb)
-        with torch.no_grad():
-            frontal, top_down = visualize_hand_object(model,
-                                                      images_np,
-                                                      dist=4,
-                                                      viz_len=args.frame_nb,
-                                                      image_size=image_size)
-            frontal_gt_only, top_down_gt_only = visualize_hand_object(
-                model,
-                images_np,
-                dist=4,
-                viz_len=args.frame_nb,
-                image_size=image_size,
-                verts_hand_gt=gt_hand_verts,
-                verts_object_gt=gt_obj_verts,
-                gt_only=True)
-
-        with torch.no_grad():
-            # GT + pred overlay renders
-            frontal_gt, top_down_gt = visualize_hand_object(
+        viz_queue.submit(
+            lambda: vizqueue.hand_object_job(
                 model,
                 images_np,
-                dist=4,
-                verts_hand_gt=gt_hand_verts,
-                verts_object_gt=gt_obj_verts,
-                viz_len=args.frame_nb,
-                image_size=image_size,
-            )
-            # GT + init overlay renders
-            frontal_init_gt, top_down_init_gt = visualize_hand_object(
-                model,
-                images_np[:viz_len],
-                dist=4,
+                sample_folder,
+                viz_len=viz_len,
                 verts_hand_gt=gt_hand_verts,
                 verts_object_gt=gt_obj_verts,
-                viz_len=viz_len,
-                init=True,
-                image_size=image_size,
-            )
-        # pred verts need to be brought back from square image space
-        viz_path = os.path.join(sample_folder, "final_points.png")
-        viz_gtpred_points(images=images_np[:viz_len],
-                          pred_images={
-                              "frontal_pred": frontal[:viz_len],
-                              "topdown_pred": top_down[:viz_len],
-                              "frontal_pred+gt": frontal_gt[:viz_len],
-                              "topdown_pred+gt": top_down_gt[:viz_len],
-                              "frontal_init+gt": frontal_init_gt,
-                              "topdown_init+gt": top_down_init_gt
-                          },
-                          save_path=viz_path)
-        # Save predicted video clip
-        top_down = cliputils.add_clip_text(top_down, "Pred")
-        top_down_gt = cliputils.add_clip_text(top_down_gt, "Pred + GT")
-        top_down_gt_only = cliputils.add_clip_text(top_down_gt_only,
-                                                   "Ground Truth")
-
-        clip = np.concatenate([
-            np.concatenate([np.stack(images_np), frontal, frontal_gt_only], 2),
-            np.concatenate([top_down_gt, top_down, top_down_gt_only], 2)
-        ], 1)
-        optim_vid_path = os.path.join(sample_folder, "final_points.mp4")
-        evalviz.make_video_np(clip, optim_vid_path, resize_factor=0.5)
+                video_exts=(".mp4", ),
+                image_size=image_size),
+            sample_folder)
 
         with torch.no_grad():
             sample_obj_metrics = pointmetrics.get_point_metrics(
@@ -635,6 +562,7 @@ def main(args):
             'rotations_object': model.rotations_object.cpu(),
         }
         torch.save(homan_object_poses, os.path.join(sample_folder, "homan_object_poses.pth"))
+    viz_queue.close()
 
 
 if __name__ == "__main__":
@@ -15,17 +15,17 @@ from libyana.exputils import argutils
 from libyana.randomutils import setseeds
 
 from homan import getdataset
-from homan.eval import evalviz, pointmetrics, saveresults
-from homan.jointopt import optimize_hand_object
+from homan.eval import pointmetrics, saveresults
+from homan.jointopt import optimize_hand_object, optimize_hand_object_windowed
 from homan.lib2d import maskutils
 from homan.pointrend import MaskExtractor
 from homan.pose_optimization import find_optimal_poses
-from homan.prepare.frameinfos import get_frame_infos, get_gt_infos
+from homan.prepare.evidencecache import EvidenceCache
+from homan.prepare.frameinfos import get_gt_infos
+from homan.prepare.warmstart import WarmStartCache, get_rotations_init
 from homan.tracking import preprocess
 from homan.utils.bbox import bbox_xy_to_wh, make_bbox_square
-from homan.visualize import visualize_hand_object
-from homan.viz import cliputils
-from homan.viz.viz_gtpred_points import viz_gtpred_points
+from homan.viz import vizqueue
 from homan.datasets.visor_mask_extractor import VisorMaskExtractor
 from handmocap.hand_mocap_api import HandMocap
 
@@ -74,7 +74,51 @@ def get_args():
         help="Path to root folder of previously computed optimization results")
     parser.add_argument("--resume_indep", action="store_true")
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--evidence_cache", default=None,
+                        help="Folder caching the frame evidence (masks, hand "
+                        "regressions) across runs, disabled if None")
+    parser.add_argument("--warm_start_cache", default=None,
+                        help="Folder caching the fitted poses of each video "
+                        "frame, chunks sharing frames with already fitted "
+                        "ones start from them. Disabled if None")
+    parser.add_argument("--warm_num_obj_iterations", default=10, type=int,
+                        help="num_obj_iterations of warm started chunks")
+    parser.add_argument("--warm_num_joint_iterations", default=50, type=int,
+                        help="num_joint_iterations of warm started chunks")
+    parser.add_argument("--window_size", default=0, type=int,
+                        help="Jointly optimize long sequences in overlapping "
+                        "windows of window_size frames, whole sequence if 0")
+    parser.add_argument("--window_overlap", default=8, type=int,
+                        help="Frames shared by consecutive windows")
+    parser.add_argument("--window_boundary_weight", default=1000, type=float,
+                        help="Weight keeping shared frames close to the poses "
+                        "fitted by the previous window")
+    parser.add_argument("--keyframe_step", default=0, type=int,
+                        help="Jointly optimize the poses of one frame every "
+                        "keyframe_step only and interpolate the others, all "
+                        "frames if 0")
+    parser.add_argument("--sample_frame_nb", default=0, type=int,
+                        help="Frames sampled at each joint optimization step "
+                        "for the silhouette and contact losses, all if 0")
+    parser.add_argument("--active_set_check_every", default=0, type=int,
+                        help="Steps between checks freezing the frames whose "
+                        "joint optimization converged, disabled if 0")
+    parser.add_argument("--active_set_tol", default=1e-3, type=float,
+                        help="Relative loss change between checks under "
+                        "which a frame is frozen")
+    parser.add_argument("--active_set_recheck_every", default=5, type=int,
+                        help="Checks between reactivations of frozen frames")
     parser.add_argument("--viz_step", default=20, type=int)
+    parser.add_argument("--viz_mode",
+                        default="now",
+                        choices=vizqueue.VIZ_MODES,
+                        help="Render the final visualizations now, in a "
+                        "background process (async), save them for "
+                        "python -m homan.viz.vizqueue (defer), or skip them")
+    parser.add_argument("--viz_every", default=1, type=int,
+                        help="Visualize one sample out of viz_every")
+    parser.add_argument("--viz_workers", default=1, type=int,
+                        help="Rendering processes for --viz_mode async")
     parser.add_argument("--save_indep", action="store_true")
     parser.add_argument("--only_missing", choices=[0, 1], type=int)
     parser.add_argument("--gt_masks", choices=[0, 1], default=0, type=int)
@@ -197,6 +241,13 @@ def main(args):
     else:
         mask_extractor = MaskExtractor()
     hand_predictor = HandMocap(args.hand_checkpoint, args.smpl_path)
+    evidence_cache = EvidenceCache(
+        args.evidence_cache,
+        weight_paths=[args.hand_checkpoint, args.smpl_path])
+    warm_start_cache = WarmStartCache(args.warm_start_cache)
+    viz_queue = vizqueue.VizQueue(args.viz_mode,
+                                  every=args.viz_every,
+                                  num_workers=args.viz_workers)
 
     all_metrics = defaultdict(list)
     for sample_idx in range(args.data_offset, len(dataset), args.data_step):
@@ -265,7 +316,11 @@ def main(args):
                 mask_extractor._mask_hand = annots['masks_hand']
                 mask_extractor._mask_obj = annots['masks_obj']
 
-            person_parameters, obj_mask_infos, super2d_imgs = get_frame_infos(
+            if use_visor_mask:
+                key_extras = (annots['masks_hand'], annots['masks_obj'])
+            else:
+                key_extras = None
+            person_parameters, obj_mask_infos, super2d_imgs = evidence_cache.get_frame_infos(
                 images_np,
                 hand_predictor,
                 mask_extractor,
@@ -275,6 +330,7 @@ def main(args):
                 camintr=camintr,
                 debug=args.debug,
                 image_size=image_size,
+                key_extras=key_extras,
             )
 
             super2d_img_path = os.path.join(sample_folder,
@@ -300,6 +356,21 @@ def main(args):
             obj_verts_can = annots["objects"][0]['canverts3d']
             obj_faces = annots["objects"][0]['faces']
 
+            # Start from the poses of frames fitted in previous chunks
+            warm_start = None
+            if "frame_idxs" in annots:
+                warm_start = warm_start_cache.get(
+                    annots["seq_idx"], annots["frame_idxs"],
+                    person_parameters[0]["hand_side"])
+            if warm_start is None:
+                rotations_init = None
+                num_obj_iterations = args.num_obj_iterations
+            else:
+                print(f"Warm starting from {len(warm_start['time_idxs'])} "
+                      "fitted frames")
+                rotations_init = get_rotations_init(warm_start)
+                num_obj_iterations = args.warm_num_obj_iterations
+
             # Compute object pose initializations
             object_parameters = find_optimal_poses(
                 images=images_np,
@@ -308,23 +379,21 @@ def main(args):
                 faces=obj_faces[0],
                 annotations=obj_mask_infos,
                 num_initializations=args.num_initializations,
-                num_iterations=args.num_obj_iterations,
+                num_iterations=num_obj_iterations,
                 Ks=camintr,
                 viz_path=os.path.join(sample_folder, "optimal_pose.png"),
                 debug=args.debug,
+                rotations_init=rotations_init,
             )
 
             # Populate person_parameters target_masks and K_roi given
             # object occlusions
-            for person_param, obj_param, cam in zip(person_parameters,
-                                                    object_parameters,
-                                                    camintr):
-                maskutils.add_target_hand_occlusions(
-                    person_param,
-                    obj_param,
-                    cam,
-                    debug=args.debug,
-                    sample_folder=sample_folder)
+            maskutils.add_target_hand_occlusions_batch(
+                person_parameters,
+                object_parameters,
+                camintr,
+                debug=args.debug,
+                sample_folder=sample_folder)
 
             indep_fit_res = {
                 "person_parameters": person_parameters,
@@ -339,6 +408,7 @@ def main(args):
             state_dict = None
 
         else:
+            warm_start = None
             # Load from previous computation
             vid_start_end = annots['seq_idx']
 
@@ -367,8 +437,21 @@ def main(args):
             for key, val in vars(args).items() if "lw_" in key
         }
 
+        if warm_start is None:
+            num_joint_iterations = args.num_joint_iterations
+        else:
+            num_joint_iterations = args.warm_num_joint_iterations
+
         # Run joint optimization
-        model, loss_evolution, imgs = optimize_hand_object(
+        if args.window_size and state_dict is None:
+            optimize_fn = optimize_hand_object_windowed
+            optim_kwargs = dict(window_size=args.window_size,
+                                window_overlap=args.window_overlap,
+                                lw_boundary=args.window_boundary_weight)
+        else:
+            optimize_fn = optimize_hand_object
+            optim_kwargs = dict(state_dict=state_dict)
+        model, loss_evolution, imgs = optimize_fn(
             person_parameters=indep_fit_res["person_parameters"],
             object_parameters=indep_fit_res["object_parameters"],
             hand_proj_mode=args.hand_proj_mode,
@@ -379,13 +462,22 @@ def main(args):
             optimize_object_scale=args.optimize_object_scale,
             loss_weights=loss_weights,
             image_size=image_size,
-            num_iterations=args.num_joint_iterations,
+            num_iterations=num_joint_iterations,
             images=images_np,
             camintr=camintr_nc,
-            state_dict=state_dict,
             viz_step=args.viz_step,
             viz_folder=None, #os.path.join(sample_folder, "jointoptim"),
+            warm_start=warm_start,
+            keyframe_step=args.keyframe_step,
+            sample_frame_nb=args.sample_frame_nb,
+            active_set_check_every=args.active_set_check_every,
+            active_set_tol=args.active_set_tol,
+            active_set_recheck_every=args.active_set_recheck_every,
+            **optim_kwargs,
         )
+        if "frame_idxs" in annots:
+            warm_start_cache.save(annots["seq_idx"], annots["frame_idxs"],
+                                  model)
         save_dict = {
             "state_dict": {
                 key: val.contiguous().cpu()
@@ -423,75 +515,18 @@ def main(args):
         gt_hand_verts = fit_hand_verts.new(gt_hand_verts)
         gt_obj_verts = fit_obj_verts.new(gt_obj_verts)
 
-        # viz_len = min(5, args.frame_nb)
         viz_len = min(5, args.frame_nb)
-        with torch.no_grad():
-            frontal, top_down = visualize_hand_object(model,
-                                                      images_np,
-                                                      dist=4,
-                                                      viz_len=args.frame_nb,
-                                                      image_size=image_size)
-            frontal_gt_only, top_down_gt_only = visualize_hand_object(
+        viz_queue.submit(
+            lambda: vizqueue.hand_object_job(
                 model,
                 images_np,
-                dist=4,
-                viz_len=args.frame_nb,
-                image_size=image_size,
-                verts_hand_gt=gt_hand_verts,
-                verts_object_gt=gt_obj_verts,
-                gt_only=True)
-
-        with torch.no_grad():
-            # GT + pred overlay renders
-            frontal_gt, top_down_gt = visualize_hand_object(
-                model,
-                images_np,
-                dist=4,
-                verts_hand_gt=gt_hand_verts,
-                verts_object_gt=gt_obj_verts,
-                viz_len=args.frame_nb,
-                image_size=image_size,
-            )
-            # GT + init overlay renders
-            frontal_init_gt, top_down_init_gt = visualize_hand_object(
-                model,
-                images_np[:viz_len],
-                dist=4,
+                sample_folder,
+                viz_len=viz_len,
                 verts_hand_gt=gt_hand_verts,
                 verts_object_gt=gt_obj_verts,
-                viz_len=viz_len,
-                init=True,
-                image_size=image_size,
-            )
-        # pred verts need to be brought back from square image space
-        viz_path = os.path.join(sample_folder, "final_points.png")
-        viz_gtpred_points(images=images_np[:viz_len],
-                          pred_images={
-                              "frontal_pred": frontal[:viz_len],
-                              "topdown_pred": top_down[:viz_len],
-                              "frontal_pred+gt": frontal_gt[:viz_len],
-                              "topdown_pred+gt": top_down_gt[:viz_len],
-                              "frontal_init+gt": frontal_init_gt,
-                              "topdown_init+gt": top_down_init_gt
-                          },
-                          save_path=viz_path)
-        # Save predicted video clip
-        top_down = cliputils.add_clip_text(top_down, "Pred")
-        top_down_gt = cliputils.add_clip_text(top_down_gt, "Pred + GT")
-        top_down_gt_only = cliputils.add_clip_text(top_down_gt_only,
-                                                   "Ground Truth")
-
-        clip = np.concatenate([
-            np.concatenate([np.stack(images_np), frontal, frontal_gt_only], 2),
-            np.concatenate([top_down_gt, top_down, top_down_gt_only], 2)
-        ], 1)
-        evalviz.make_video_np(clip,
-                              viz_path.replace(".png", ".webm"),
-                              resize_factor=0.5)
-        optim_vid_path = os.path.join(sample_folder, "final_points.webm")
-        evalviz.make_video_np(clip,
-                              optim_vid_path.replace(".webm", ".mp4"),
-                              resize_factor=0.5)
+                video_exts=(".webm", ".mp4"),
+                image_size=image_size),
+            sample_folder)
 
         with torch.no_grad():
             sample_obj_metrics = pointmetrics.get_point_metrics(
@@ -556,6 +591,7 @@ def main(args):
                     # },
                 }, p_f)
         saveresults.dump(args, all_metrics, save_path)
+    viz_queue.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Active set of frames for the joint hand-object optimization.
+
+Every check_every steps, the per-frame silhouette and 2D vertex losses
+(HOMan.compute_frame_losses) are evaluated on all frames. Frames whose loss
+changed by less than tol (relative) since the previous check are frozen:
+the silhouette, collision and contact losses are not computed on them and
+their pose parameters are not updated. Every recheck_every checks, all
+frozen frames are reactivated, so that frames moved by their neighbours
+(through the smoothness losses) are optimized again.
+"""
+import torch
+
+from homan.prepare.warmstart import HAND_KEYS, OBJECT_KEYS
+
+
+class FrameActiveSet():
+    """
+    Args:
+        frame_nb (int): optimized frames
+        check_every (int): steps between convergence checks
+        tol (float): relative loss change between two checks under which a
+            frame is frozen
+        recheck_every (int): checks between reactivations of all frames
+    """
+    def __init__(self, frame_nb, check_every=20, tol=1e-3, recheck_every=5):
+        self.frame_nb = frame_nb
+        self.check_every = check_every
+        self.tol = tol
+        self.recheck_every = recheck_every
+        self.active = torch.ones(frame_nb, dtype=torch.bool)
+        self._prev_losses = None
+        self._check_nb = 0
+
+    def active_idxs(self):
+        return self.active.nonzero()[:, 0]
+
+    def update(self, step, model, loss_weights=None):
+        """ Checks the per-frame losses of model every check_every steps """
+        if step % self.check_every:
+            return
+        with torch.no_grad():
+            frame_losses = model.compute_frame_losses(
+                loss_weights=loss_weights).cpu()
+        self._check_nb += 1
+        if self._check_nb % self.recheck_every == 0:
+            self.active[:] = True
+        elif self._prev_losses is not None:
+            # Frames whose loss increased are not converged either
+            rel_change = (self._prev_losses - frame_losses).abs() / (
+                self._prev_losses.abs().clamp(min=1e-8))
+            self.active &= rel_change > self.tol
+        self._prev_losses = frame_losses
+
+    def _frozen_rows(self, model):
+        frozen_idxs = (~self.active).nonzero()[:, 0]
+        hand_rows = (frozen_idxs[:, None] * model.hand_nb +
+                     torch.arange(model.hand_nb)[None]).view(-1)
+        params = dict(model.named_parameters(recurse=False))
+        return {
+            key: (params[key], frozen_idxs if key in OBJECT_KEYS else hand_rows)
+            for key in OBJECT_KEYS + HAND_KEYS if key in params
+        }
+
+    def freeze(self, model):
+        """
+        Returns:
+            frozen (dict): pose rows of the frozen frames, to restore() after
+                the optimizer step
+        """
+        if self.active.all():
+            return {}
+        return {
+            key: (param, rows, param[rows.to(param.device)].detach().clone())
+            for key, (param, rows) in self._frozen_rows(model).items()
+        }
+
+    @staticmethod
+    def restore(frozen):
+        """ Undoes the optimizer updates (e.g. Adam momentum) of frozen
+        frames
+        """
+        with torch.no_grad():
+            for param, rows, vals in frozen.values():
+                param[rows.to(param.device)] = vals
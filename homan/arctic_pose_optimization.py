@@ -26,7 +26,7 @@ from homan.lib3d.optitrans import (
     TCO_init_from_boxes_zup_autodepth,
     compute_optimal_translation,
 )
-from homan.utils.nmr_renderer import PerspectiveRenderer
+from homan.utils.nmr_renderer import get_renderer
 from homan.utils.geometry import (
     compute_random_rotations,
     rot6d_to_matrix,
@@ -65,12 +65,11 @@ class PoseOptimizer(nn.Module):
 
         # Load reference mask.
         # Convention for silhouette-aware loss: -1=occlusion, 0=bg, 1=fg.
-        image_ref = torch.from_numpy((ref_image > 0).astype(np.float32))
-        keep_mask = torch.from_numpy((ref_image >= 0).astype(np.float32))
-        self.register_buffer("image_ref",
-                             image_ref.repeat(num_initializations, 1, 1))
-        self.register_buffer("keep_mask",
-                             keep_mask.repeat(num_initializations, 1, 1))
+        # Masks are kept as (1, H, W) bool and broadcast over initializations
+        image_ref = torch.from_numpy(np.asarray(ref_image) > 0)
+        keep_mask = torch.from_numpy(np.asarray(ref_image) >= 0)
+        self.register_buffer("image_ref", image_ref.unsqueeze(0))
+        self.register_buffer("keep_mask", keep_mask.unsqueeze(0))
         self.pool = torch.nn.MaxPool2d(kernel_size=kernel_size,
                                        stride=1,
                                        padding=(kernel_size // 2))
@@ -81,11 +80,10 @@ class PoseOptimizer(nn.Module):
                                                        1)
         self.translations = nn.Parameter(translation_init.clone().float(),
                                          requires_grad=True)
-        mask_edge = self.compute_edges(image_ref.unsqueeze(0)).cpu().numpy()
+        mask_edge = self.compute_edges(
+            image_ref.float().unsqueeze(0)).cpu().numpy()
         edt = distance_transform_edt(1 - (mask_edge > 0))**(power * 2)
-        self.register_buffer(
-            "edt_ref_edge",
-            torch.from_numpy(edt).repeat(num_initializations, 1, 1).float())
+        self.register_buffer("edt_ref_edge", torch.from_numpy(edt).float())
         # Setup renderer.
         if K is None:
             K = torch.cuda.FloatTensor([[[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]]])
@@ -138,13 +136,13 @@ class PoseOptimizer(nn.Module):
 
     def forward(self):
         verts = self.apply_transformation()
-        image = self.keep_mask * self.renderer(
+        image = self.keep_mask.float() * self.renderer(
             verts, self.faces, mode="silhouettes")
+        image_ref = self.image_ref.float().expand_as(image)
         loss_dict = {}
-        loss_dict["mask"] = torch.sum((image - self.image_ref)**2, dim=(1, 2))
+        loss_dict["mask"] = torch.sum((image - image_ref)**2, dim=(1, 2))
         with torch.no_grad():
-            iou = ioumetrics.batch_mask_iou(image.detach(),
-                                            self.image_ref.detach())
+            iou = ioumetrics.batch_mask_iou(image.detach(), image_ref)
         loss_dict["chamfer"] = self.lw_chamfer * torch.sum(
             self.compute_edges(image) * self.edt_ref_edge, dim=(1, 2))
         loss_dict["offscreen"] = 100000 * self.compute_offscreen_loss(verts)
@@ -183,7 +181,7 @@ def visualize_optimal_poses(model,
     losses = sum(loss_dict.values())
     camintr_roi = model.renderer.K
     inds = torch.argsort(losses)[:num_vis]
-    obj_renderer = PerspectiveRenderer()
+    obj_renderer = get_renderer("persp")
 
     fig = plt.figure(figsize=((10, 4)))
     ax1 = fig.add_subplot(2, 5, 1)
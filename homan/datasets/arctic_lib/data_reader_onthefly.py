@@ -10,6 +10,7 @@ from libzhifan.geometry import CameraManager, SimpleMesh, projection, visualize_
 from manopth.manolayer import ManoLayer
 from PIL import Image
 
+from homan.datasets import jpegutils
 from homan.datasets.arctic_lib.arctic_obj_loader import ArcticOBJLoader
 from homan.datasets.arctic_lib.data_reader import (
     ARCTIC_IMAGES_DIR,
@@ -178,10 +179,46 @@ class SeqReaderOnTheFly:
         world2ego[:, 3, 3] = 1
         self.world2ego = world2ego
 
-    def render_image(self, frame_idx) -> np.ndarray:
+        self._mano_tracers = {}
+
+    @staticmethod
+    def _select(x, frame_idxs):
+        """ x[frame_idxs], or x itself (all frames) if frame_idxs is None """
+        if frame_idxs is None:
+            return x
+        return x[np.asarray(frame_idxs)]
+
+    def _mano_inputs(self, side, frame_idxs=None):
+        """ MANO pose, shape, rot and trans of `side` at frame_idxs
+
+        Returns:
+            pose_h: (T, 45), shape_h: (T, 10), rot_h: (T, 3), trans_h: (T, 3)
+        """
+        params = self.mano_params[side]
+        pose_h = torch.from_numpy(self._select(params['pose'], frame_idxs))
+        rot_h = torch.from_numpy(self._select(params['rot'], frame_idxs))
+        trans_h = torch.from_numpy(self._select(params['trans'], frame_idxs))
+        shape_h = torch.from_numpy(params['shape']).view(1, 10).repeat(len(pose_h), 1)
+        return pose_h, shape_h, rot_h, trans_h
+
+    def _mano_tracer(self, side) -> ManoLayerTracer:
+        if side not in self._mano_tracers:
+            self._mano_tracers[side] = ManoLayerTracer(
+                flat_hand_mean=False, ncomps=45, side=side, use_pca=False,
+                mano_root=to_absolute_path('./extra_data/mano/'))
+        return self._mano_tracers[side]
+
+    def render_image(self, frame_idx, size=None) -> np.ndarray:
+        """
+        Args:
+            size: (W, H), if given the ego image (2800x2000) is decoded at
+                reduced JPEG scale and resized to it, as cv2.resize would.
+        """
         frame_idx = frame_idx + self.ioi_offset
         img_path = osp.join(self.images_dir, str(self.view_id), f'{frame_idx:05d}.jpg')
-        return np.asarray(Image.open(img_path))
+        if size is None:
+            return np.asarray(Image.open(img_path))
+        return np.asarray(jpegutils.read_image(img_path, size))
 
     def render_image_mesh(self, frame_idx,
                           with_rend=True,
@@ -274,28 +311,28 @@ class SeqReaderOnTheFly:
         rbox = bbox_from_mask(mask, MASK_RIGHT_ID)
         return lbox, rbox, obox
 
-    def transform_space(self, v, space):
+    def transform_space(self, v, space, frame_idxs=None):
         """
         Transform from World-coor into `space`-coor
 
         Args:
             v: (N, V, 3)
+            frame_idxs: frames of v, (N,). None if v has all frames.
 
         Returns:
             v: (N, V, 3)
         """
         if space == 'ego':
-            T_w2e = self.world2ego
+            T_w2e = self._select(self.world2ego, frame_idxs)
             v = pose_apply(T_w2e, v)
         elif space == 'world':
             # Identity
             pass
         elif space == 'left' or space == 'right':
-            T_h_world = self.pose_hand2world(side=space)
+            T_h_world = self.pose_hand2world(side=space, frame_idxs=frame_idxs)
             v = pose_apply(torch.inverse(T_h_world), v)
         elif space == 'obj':
-            T_o_world = _get_transform(self.obj_rot,
-                                    self.obj_trans/1000)
+            T_o_world = self.pose_obj2world(frame_idxs=frame_idxs)
             v = pose_apply(torch.inverse(T_o_world), v)
         else:
             raise ValueError(f'Unknown space {space}')
@@ -347,41 +384,47 @@ class SeqReaderOnTheFly:
         Returns:
             (N, 778, 3) if frame_idx is None, otherwise (778, 3)
         """
-        def forward_hand_verts(side, zero_rot_trans):
-            """
-            zero_rot_trans: if True, return in hand-space, else world-space
-            """
+        if frame_idx is None:
+            assert as_mesh is False
+            return self.hand_verts_subset(
+                None, side, space=space, zero_rot_trans=zero_rot_trans)
+        v = self.hand_verts_subset(
+            [frame_idx], side, space=space, zero_rot_trans=zero_rot_trans)[0]
+        if as_mesh:
             mano_layer = self.l_mano_layer if side == LEFT else self.r_mano_layer
-            pose_h = torch.from_numpy(self.mano_params[side]['pose'])
-            shape_h = torch.from_numpy(self.mano_params[side]['shape']).view(1, 10).repeat(self.num_frames, 1)
-            rot_h = torch.from_numpy(self.mano_params[side]['rot'])
-            trans_h = torch.from_numpy(self.mano_params[side]['trans'])
-            if zero_rot_trans:
-                rot_h = torch.zeros_like(rot_h)
-                trans_h = None
-            th_pose_coeffs = torch.cat([
-                rot_h,
-                pose_h], axis=-1)
-            v, _, _ = mano_layer.forward(
-                th_pose_coeffs, th_betas=shape_h, th_trans=trans_h)
-            v /= 1000
-            return v, mano_layer.th_faces
+            return SimpleMesh(v, mano_layer.th_faces, tex_color=tex_color)
+        return v
+
+    def hand_verts_subset(self, frame_idxs, side, space='ego',
+                          zero_rot_trans=False):
+        """ Run MANO only on frame_idxs.
+
+        Args:
+            frame_idxs: (T,) absolute frame indices, None for all frames
+
+        Returns:
+            (T, 778, 3)
+        """
+        mano_layer = self.l_mano_layer if side == LEFT else self.r_mano_layer
+        pose_h, shape_h, rot_h, trans_h = self._mano_inputs(side, frame_idxs)
+        if zero_rot_trans:
+            rot_h = torch.zeros_like(rot_h)
+            trans_h = None
+        th_pose_coeffs = torch.cat([
+            rot_h,
+            pose_h], axis=-1)
+        v, _, _ = mano_layer.forward(
+            th_pose_coeffs, th_betas=shape_h, th_trans=trans_h)
+        v /= 1000
 
-        # world space
-        v, f = forward_hand_verts(side, zero_rot_trans=zero_rot_trans)
         if zero_rot_trans:
             # In this case hand is in hand-space
-            T_h2e = self.pose_hand2ego(side=side)
+            T_h2e = self.pose_hand2ego(side=side, frame_idxs=frame_idxs)
             v = pose_apply(T_h2e, v)
-            # v = pose_apply(T_hand2world, v)
-            # v = self.transform_space(v, space=space)
         else:
-            v = self.transform_space(v, space=space)
-
-        if as_mesh:
-            return SimpleMesh(v[frame_idx], f, tex_color=tex_color)
-        else:
-            return v if frame_idx is None else v[frame_idx]
+            # world space
+            v = self.transform_space(v, space=space, frame_idxs=frame_idxs)
+        return v
 
     def obj_verts(self, frame_idx, space='ego', as_mesh=False, with_faces=False,
                   tex_color='red'):
@@ -392,22 +435,17 @@ class SeqReaderOnTheFly:
 
         Returns: (N, V, 3) if frame_idx is None else (V, 3)
         """
-        N = self.num_frames
-        T_o_world = _get_transform(self.obj_rot,
-                                   self.obj_trans/1000)
-        vo, fo = self.obj_loader.batch_articulate(
-            name=self.obj_name, artis=self.obj_arti)  # (N, V, 3)
-        vo = pose_apply(T_o_world, vo)
-        vo = self.transform_space(vo, space)
-
         if frame_idx is None:
             # All frames
             assert as_mesh is False
+            vo, fo = self.obj_verts_subset(None, space=space, with_faces=True)
             if with_faces:
                 return vo, fo
             return vo
         else:
-            vo = vo[frame_idx]
+            vo, fo = self.obj_verts_subset(
+                [frame_idx], space=space, with_faces=True)
+            vo = vo[0]
             if as_mesh:
                 return SimpleMesh(verts=vo, faces=fo, tex_color=tex_color)
             else:
@@ -415,21 +453,42 @@ class SeqReaderOnTheFly:
                     return vo, torch.from_numpy(fo)
                 return vo
 
-    def neutralized_obj_params(self, debug=False):
+    def obj_verts_subset(self, frame_idxs, space='ego', with_faces=False):
+        """ Articulate and transform the object only at frame_idxs.
+
+        Args:
+            frame_idxs: (T,) absolute frame indices, None for all frames
+
+        Returns: (T, V, 3), and (F, 3) faces if with_faces
+        """
+        T_o_world = self.pose_obj2world(frame_idxs=frame_idxs)
+        vo, fo = self.obj_loader.batch_articulate(
+            name=self.obj_name,
+            artis=self._select(self.obj_arti, frame_idxs))  # (T, V, 3)
+        vo = pose_apply(T_o_world, vo)
+        vo = self.transform_space(vo, space, frame_idxs=frame_idxs)
+        if with_faces:
+            return vo, fo
+        return vo
+
+    def neutralized_obj_params(self, debug=False, frame_idxs=None):
         """ Placing the object s.t. z-axis is the symmetric axis, and center is around origin
         return the transformed pose_obj2hand accordingly
         i.e. T_obj2hand_original = T_obj2hand_neutralized @ T_neutral
 
+        Args:
+            frame_idxs: (T,) only evaluate these frames, None for all (N)
+
         Returns:
             vo: (N, V, 3) in neutralized obj space
             fo: (F, 3)
             T_o2l_neutral, T_o2r_neutral: (N, 4, 4)
             T_neutral: (4, 4)
         """
-        vo, fo = self.obj_verts(frame_idx=None, space='obj', with_faces=True)
+        vo, fo = self.obj_verts_subset(frame_idxs, space='obj', with_faces=True)
         T_neutral = torch.as_tensor(NEUTRAL_TRANSFORMS[self.obj_name]).view(1, 4, 4)
         inv_T_neutral = torch.inverse(T_neutral)
-        T_o2l, T_o2r = self.pose_obj2hand()
+        T_o2l, T_o2r = self.pose_obj2hand(frame_idxs=frame_idxs)
         T_o2l_neutral = torch.matmul(T_o2l, inv_T_neutral)
         T_o2r_neutral = torch.matmul(T_o2r, inv_T_neutral)
         vo_neutral = pose_apply(T_neutral.repeat(len(vo), 1, 1), vo)
@@ -442,9 +501,10 @@ class SeqReaderOnTheFly:
             return visualize_mesh(meshes, show_axis=True, viewpoint='nr')
         return vo_neutral, fo, T_o2l_neutral, T_o2r_neutral
 
-    def pose_mano(self, side, is_pca):
+    def pose_mano(self, side, is_pca, frame_idxs=None):
         """ returns (N, 45) """
-        pose_h = torch.from_numpy(self.mano_params[side]['pose']) #.cuda()  # joints
+        pose_h = torch.from_numpy(
+            self._select(self.mano_params[side]['pose'], frame_idxs)) #.cuda()  # joints
         if is_pca:
             from nnutils.handmocap import get_hand_wrapper
             hand_wrapper = get_hand_wrapper('left' if side == LEFT else 'right')
@@ -453,40 +513,37 @@ class SeqReaderOnTheFly:
         else:
             return pose_h
 
-    def pose_hand2ego(self, side):
-        """ returns (N, 4, 4) """
-        T_hand2world = self.pose_hand2world(side=side)
-        T_w2e = self.world2ego
+    def pose_hand2ego(self, side, frame_idxs=None):
+        """ returns (N, 4, 4), or (T, 4, 4) for frame_idxs """
+        T_hand2world = self.pose_hand2world(side=side, frame_idxs=frame_idxs)
+        T_w2e = self._select(self.world2ego, frame_idxs)
         T_h2e = torch.bmm(T_w2e, T_hand2world)
         return T_h2e
 
-    def pose_hand2world(self, side):
+    def pose_hand2world(self, side, frame_idxs=None):
         """
-        Returns: (N, 4, 4)
+        Returns: (N, 4, 4), or (T, 4, 4) for frame_idxs
         """
-        pose_h = torch.from_numpy(self.mano_params[side]['pose'])
-        shape_h = torch.from_numpy(self.mano_params[side]['shape']).view(1, 10).repeat(self.num_frames, 1)
-        rot_h= torch.from_numpy(self.mano_params[side]['rot'])
-        trans_h= torch.from_numpy(self.mano_params[side]['trans'])
-        _, _, T_world = ManoLayerTracer(
-            flat_hand_mean=False, ncomps=45, side=side, use_pca=False,
-            mano_root=to_absolute_path('./extra_data/mano/')).forward_transform(
+        pose_h, shape_h, rot_h, trans_h = self._mano_inputs(side, frame_idxs)
+        _, _, T_world = self._mano_tracer(side).forward_transform(
             torch.cat([rot_h, pose_h], axis=-1),
             th_betas=shape_h, th_trans=trans_h, root_palm=True)
         return T_world
 
-    def pose_obj2world(self):
-        T_o_world = _get_transform(self.obj_rot, self.obj_trans/1000)
+    def pose_obj2world(self, frame_idxs=None):
+        T_o_world = _get_transform(
+            self._select(self.obj_rot, frame_idxs),
+            self._select(self.obj_trans, frame_idxs)/1000)
         return T_o_world
 
-    def pose_obj2hand(self):
+    def pose_obj2hand(self, frame_idxs=None):
         """
         Returns:
             T_obj2left, T_obj2right: (num_frames, 4, 4)
         """
-        T_o_world = self.pose_obj2world()
-        T_l_world = self.pose_hand2world(side='left')
-        T_r_world = self.pose_hand2world(side='right')
+        T_o_world = self.pose_obj2world(frame_idxs=frame_idxs)
+        T_l_world = self.pose_hand2world(side='left', frame_idxs=frame_idxs)
+        T_r_world = self.pose_hand2world(side='right', frame_idxs=frame_idxs)
         T_o2l = torch.bmm(torch.inverse(T_l_world), T_o_world)
         T_o2r = torch.bmm(torch.inverse(T_r_world), T_o_world)
         return T_o2l, T_o2r
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import cv2
+from collections import OrderedDict
+
 import numpy as np
 import torch
 from PIL import Image
@@ -63,10 +64,18 @@ class ArcticStable:
     def __init__(
         self,
         frame_nb=30,
+        max_cached_readers=4,
     ):
+        """
+        Args:
+            max_cached_readers: number of SeqReaderOnTheFly kept alive,
+                consecutive samples of the same sequence share one reader.
+        """
         super().__init__()
         self.name = "arctic_stable"
         self.frame_nb = frame_nb
+        self.max_cached_readers = max_cached_readers
+        self._seq_readers = OrderedDict()
         self.image_size = (640, 360)  # == IMAGE_SIZE
 
         self.box_factor = np.asarray(self.image_size * 2) / (CROPPED_IMAGE_SIZE * 2)
@@ -111,6 +120,18 @@ class ArcticStable:
                                                       [res, res])[0]
         return roi_bbox, affine_trans
 
+    def get_seq_reader(self, sid, seq_name, cat) -> SeqReaderOnTheFly:
+        """ LRU cache of per-sequence readers """
+        key = (sid, seq_name, cat)
+        if key in self._seq_readers:
+            self._seq_readers.move_to_end(key)
+            return self._seq_readers[key]
+        seq_reader = SeqReaderOnTheFly(sid, seq_name, obj_name=cat, obj_version='reduced')
+        self._seq_readers[key] = seq_reader
+        while len(self._seq_readers) > self.max_cached_readers:
+            self._seq_readers.popitem(last=False)
+        return seq_reader
+
     def __getitem__(self, idx, res=640):
         vid_info = self.vid_index.iloc[idx]
 
@@ -120,15 +141,16 @@ class ArcticStable:
         cat = seq_name.split('_')[0]
         side = vid_info['side']
         frame_idxs = np.linspace(start, end, num=self.frame_nb, dtype=int, endpoint=True)  # [S, S+1, ... , E]
-        seq_reader = SeqReaderOnTheFly(sid, seq_name, obj_name=cat, obj_version='reduced')
+        seq_reader = self.get_seq_reader(sid, seq_name, cat)
 
-        v_obj, f_obj, T_o2l, T_o2r = seq_reader.neutralized_obj_params()  # (N, V, 3) (F, 3), (N, 4, 4), (N, 4, 4) GT
-        v_obj = v_obj[start]  # (V, 3)
-        T_o2h = T_o2l if side == LEFT else T_o2r
-        T_o2h = T_o2h[frame_idxs]  # (T, 4, 4)
+        # Only evaluate kinematics on frame_idxs, note frame_idxs[0] == start
+        v_obj, f_obj, T_o2l, T_o2r = seq_reader.neutralized_obj_params(
+            frame_idxs=frame_idxs)  # (T, V, 3) (F, 3), (T, 4, 4), (T, 4, 4) GT
+        v_obj = v_obj[0]  # (V, 3)
+        T_o2h = T_o2l if side == LEFT else T_o2r  # (T, 4, 4)
 
-        vo_cam = seq_reader.obj_verts(None, space='ego')  # (N, V, 3)
-        vh = seq_reader.hand_verts(None, side=side, space='ego')  # (N, V, 3)
+        vo_cam = seq_reader.obj_verts_subset(frame_idxs, space='ego')  # (T, V, 3)
+        vh = seq_reader.hand_verts_subset(frame_idxs, side=side, space='ego')  # (T, V, 3)
 
         # Read images from tar file
         images = []
@@ -139,16 +161,17 @@ class ArcticStable:
 
         gt_person_parameters = []
         # roi, affine_trans = self.get_roi(vid_info)
-        for frame_idx in frame_idxs:
-            img = seq_reader.render_image(frame_idx)
-            img = cv2.resize(img, self.image_size)
+        for i, frame_idx in enumerate(frame_idxs):
+            img = seq_reader.render_image(frame_idx, size=self.image_size)
             img = Image.fromarray(img[:, :, ::-1])
 
             mask, lbox, rbox, obox = seq_reader.get_boxes_and_mask(frame_idx, use_disk=True)
+            # Copy: boxes are owned by the (cached) seq_reader
+            obox = obox.copy()
             obox[2:] += obox[:2]
             obox = obox * self.box_factor
 
-            hbox = lbox if side == LEFT else rbox
+            hbox = (lbox if side == LEFT else rbox).copy()
             hbox[2:] += hbox[:2]
             hbox = hbox * self.box_factor
 
@@ -169,7 +192,7 @@ class ArcticStable:
                 'left_hand' if side == LEFT else 'right_hand': 1, }
             obox = apply_bbox_transform(obox, affine_trans)
             obj_info = dict(
-                verts3d=vo_cam[frame_idx],  # This should be GT
+                verts3d=vo_cam[i],  # This should be GT
                 faces=f_obj,
                 path="NONE",
                 canverts3d=v_obj,  # This should be initial
@@ -177,7 +200,7 @@ class ArcticStable:
 
             hbox = apply_bbox_transform(hbox, affine_trans)
             hand_info = dict(
-                verts3d=vh[frame_idx],
+                verts3d=vh[i],
                 faces=self.left_faces if side == LEFT else self.right_faces,
                 label="left_hand" if side == LEFT else 'right_hand',
                 bbox=hbox.astype(np.float32)
@@ -209,17 +232,17 @@ class ArcticStable:
             collated_hand_info['label'] = collated_hand_info['label'][0]
             collated_hand_infos.append(collated_hand_info)
 
-        T_h2e = seq_reader.pose_hand2ego(side)
+        T_h2e = seq_reader.pose_hand2ego(side, frame_idxs=frame_idxs)  # (T, 4, 4)
         R_o2h_prior, t_o2h_prior = self.get_T_o2h_priors(side, cat)  # learnt priors
         T_o2h_prior = torch.eye(4).repeat(R_o2h_prior.shape[0], 1, 1)
         T_o2h_prior[:, :3, :3] = R_o2h_prior
         T_o2h_prior[:, :3, 3] = t_o2h_prior.view(1, 3).repeat(R_o2h_prior.shape[0], 1)
-        T_h2e_prior = T_h2e[[start]].matmul(T_o2h_prior)  # Yana uses first frame
+        T_h2e_prior = T_h2e[[0]].matmul(T_o2h_prior)  # Yana uses first frame
         R_o2e_prior = T_h2e_prior[:, :3, :3].permute(0, 2 ,1)  # (num_inits, 3, 3)
         t_o2e_prior = T_h2e_prior[:, :3, 3]  # (num_inits, 3, 3)
 
         # GT obj-to-ego, for debug use
-        T_o2e = T_h2e[frame_idxs].matmul(T_o2h)
+        T_o2e = T_h2e.matmul(T_o2h)
         gt_R_o2e = T_o2e[:, :3, :3].permute(0, 2, 1)
         gt_t_o2e = T_o2e[:, :3, 3]
         # debug 
@@ -260,10 +283,10 @@ class ArcticStable:
         """
         device = 'cpu'
 
-        T_h2e = seq_reader.pose_hand2ego(side)  # (N, 4, 4)
+        T_h2e = seq_reader.pose_hand2ego(side, frame_idxs=[f])  # (1, 4, 4)
         rot_h2e = T_h2e[:, :3, :3]
         # gt_pose_pca = seq_reader.pose_mano(side, is_pca=True)
-        gt_pose = seq_reader.pose_mano(side, is_pca=False)[[f]]
+        gt_pose = seq_reader.pose_mano(side, is_pca=False, frame_idxs=[f])
         gt_hand_betas = torch.from_numpy(seq_reader.mano_params[side]['shape']).view(1, 10)
         mano_layer_side = seq_reader.l_mano_layer if side == LEFT else seq_reader.r_mano_layer
         gt_pose_pca = recover_pca_pose(gt_pose, mano_layer_side).view(1, 45)
@@ -272,9 +295,9 @@ class ArcticStable:
         verts = verts.view(1, 778, 3).to(device)
         faces = seq_reader.fl if side == LEFT else seq_reader.fr
         faces = torch.as_tensor(faces, device=device).view(1, 1538, 3)
-        rotations = rot_h2e[f].view(1, 3, 3).to(device)
+        rotations = rot_h2e[0].view(1, 3, 3).to(device)
         rotations = rotations.permute(0, 2, 1)  # in HOMan it's V @ R
-        translations = T_h2e[f, :3, 3].view(1, 1, 3).to(device)
+        translations = T_h2e[0, :3, 3].view(1, 1, 3).to(device)
         mano_pose = gt_pose.view(1, 45).to(device)
         mano_rot = mano_pose.new_zeros(1, 3)
         mano_trans = mano_pose.new_zeros(1, 3)
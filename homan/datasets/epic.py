@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import cv2
 import re
 import numpy as np
 import torch
@@ -11,7 +10,7 @@ from typing import Union
 from pathlib import Path
 import bisect
 
-from homan.datasets import collate, epichoa, tarutils
+from homan.datasets import collate, epichoa, jpegutils, tarutils
 from homan.datasets.chunkvids import chunk_vid_index
 from homan.tracking import trackhoa as trackhoadf
 from homan.utils import bbox as bboxutils
@@ -411,7 +410,7 @@ class Epic:
             for annot_idx, (annot_key,
                             annot) in enumerate(tqdm(annot_df.iterrows())):
                 try:
-                    hoa_dets = epichoa.load_video_hoa(
+                    hoa_dets = epichoa.load_video_hoa_index(
                         annot.video_id,
                         hoa_root="local_data/datasets/epic/hoa")
                     frame_idxs, bboxes = trackhoadf.track_hoa_df(
@@ -419,7 +418,7 @@ class Epic:
                         video_id=annot.video_id,
                         start_frame=max(1, annot.start_frame - track_padding),
                         end_frame=(min(annot.stop_frame + track_padding,
-                                       hoa_dets.frame.max() - 1)),
+                                       hoa_dets.max_frame - 1)),
                         dt=frame_step / 60,
                     )
                     if len(frame_idxs) > min_frame_nb:
@@ -513,9 +512,8 @@ class Epic:
             folder = self.locator.locate(video_id, frame_idx)
             # img_path = self.frame_template.format("train", video_id[:3],
             #                                       video_id, frame_idx)
-            img = cv2.imread(self.image_fmt % (folder, video_id, frame_idx))
-            img = cv2.resize(img, self.image_size)
-            img = Image.fromarray(img[:, :, ::-1])
+            img = jpegutils.read_image(
+                self.image_fmt % (folder, video_id, frame_idx), self.image_size)
 
             img = handutils.transform_img(img, affine_trans, [res, res])
             images.append(img)
@@ -3,6 +3,7 @@
 
 from copy import deepcopy
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from functools import lru_cache
 
@@ -50,7 +51,6 @@ def framedet2dicts(det,
     return dicts
 
 
-@lru_cache(maxsize=128)
 def load_video_hoa(video_id, hoa_root):
     """
     Args:
@@ -70,3 +70,75 @@ def load_video_hoa(video_id, hoa_root):
         all_hoa_dicts.extend(hoa_dicts)
     dat = pd.DataFrame(all_hoa_dicts)
     return dat
+
+
+class HoaFrameIndex():
+    """ Hand-object detections of one video grouped by frame.
+
+    Detections are sorted by frame and stored in contiguous arrays, the
+    detections of frames[i] being rows offsets[i]:offsets[i + 1] (CSR
+    layout), so selecting a frame is a binary search and a slice instead of
+    a scan of the whole DataFrame.
+
+    Args:
+        hoa_dets (pd.DataFrame): output of load_video_hoa()
+    """
+    DET_TYPES = ("object", "hand")
+    SIDES = ("left", "right")
+
+    def __init__(self, hoa_dets):
+        order = np.argsort(hoa_dets.frame.values, kind="stable")
+        dets = hoa_dets.iloc[order]
+        frame_col = dets.frame.values.astype(np.int64)
+        self.frames, starts = np.unique(frame_col, return_index=True)
+        self.offsets = np.append(starts, len(frame_col)).astype(np.int64)
+        self.boxes = np.stack(
+            [dets.left, dets.top, dets.right, dets.bottom],
+            1).astype(np.float64).reshape(-1, 4)
+        self.scores = dets.score.values.astype(np.float64)
+        # -1 for missing values (objects have no side)
+        self.det_types = self._encode(dets, "det_type", self.DET_TYPES)
+        self.sides = self._encode(dets, "side", self.SIDES)
+
+    @staticmethod
+    def _encode(dets, column, values):
+        codes = np.full(len(dets), -1, dtype=np.int8)
+        if column in dets:
+            col = dets[column].values
+            for code, value in enumerate(values):
+                codes[col == value] = code
+        return codes
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def max_frame(self):
+        return int(self.frames[-1]) if len(self.frames) else -1
+
+    def frame_slice(self, frame_idx) -> slice:
+        """ Rows of frame_idx in the detection arrays (empty if none) """
+        loc = np.searchsorted(self.frames, frame_idx)
+        if loc == len(self.frames) or self.frames[loc] != frame_idx:
+            return slice(0, 0)
+        return slice(self.offsets[loc], self.offsets[loc + 1])
+
+    def get_boxes(self, frame_idx, det_type, side=None) -> np.ndarray:
+        """
+        Returns:
+            (det_nb, 4) xyxy boxes of frame_idx with given det_type
+            ("object"|"hand") and side ("left"|"right"|None for any)
+        """
+        rows = self.frame_slice(frame_idx)
+        keep = self.det_types[rows] == self.DET_TYPES.index(det_type)
+        if side is not None:
+            keep &= self.sides[rows] == self.SIDES.index(side)
+        return self.boxes[rows][keep]
+
+
+@lru_cache(maxsize=128)
+def load_video_hoa_index(video_id, hoa_root) -> HoaFrameIndex:
+    """ Frame-indexed detections of video_id, see load_video_hoa(). Only the
+    index is cached, not the intermediate DataFrame
+    """
+    return HoaFrameIndex(load_video_hoa(video_id, hoa_root))
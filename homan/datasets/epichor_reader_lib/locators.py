@@ -21,29 +21,52 @@ class PairLocator:
         cache_path='.cache/image_pair_index.pkl')
     path = locator.get_path(vid, frame)
     # path = <result_root>/P01_01_0003/frame_%10d.jpg
+
+    The index stores, per folder, its frame range and sorted frame list,
+    so lookups never touch the filesystem. If result_root changes, rebuild
+    it with:
+        python -m homan.datasets.epichor_reader_lib.locators --rebuild
     """
+    INDEX_VERSION = 2
+
     def __init__(self,
                  result_root,
                  cache_path,
-                 verbose=False):
+                 verbose=False,
+                 rebuild=False):
         self.result_root = Path(result_root)
         self.cache_path = to_absolute_path(cache_path)
-        self._load_index()
+        self._load_index(rebuild=rebuild)
         self.verbose = verbose
 
-    def _load_index(self):
+    def _load_index(self, rebuild=False):
         # cache_path = osp.join('.cache', 'pair_index.pkl')
-        if not osp.exists(self.cache_path):
-            os.makedirs(osp.dirname(self.cache_path), exist_ok=True)
-            print("First time run, generating index...")
-            _all_full_frames, _all_folders = self._build_index(
-                self.result_root)
-            with open(self.cache_path, 'wb') as fp:
-                pickle.dump((_all_full_frames, _all_folders), fp)
-            print("Index saved to", self.cache_path)
-
-        with open(self.cache_path, 'rb') as fp:
-            self._all_full_frames, self._all_folders = pickle.load(fp)
+        index = None
+        if not rebuild and osp.exists(self.cache_path):
+            with open(self.cache_path, 'rb') as fp:
+                index = pickle.load(fp)
+        if not isinstance(index, dict) or index.get('version') != self.INDEX_VERSION:
+            print("Generating index...")
+            index = self.rebuild_index()
+
+        self._all_full_frames = index['all_full_frames']
+        self._all_folders = index['all_folders']
+        self._folder_frames = index['folder_frames']
+
+    def rebuild_index(self) -> dict:
+        """ Scan result_root and (over)write the index at cache_path """
+        os.makedirs(osp.dirname(self.cache_path), exist_ok=True)
+        _all_full_frames, _all_folders, folder_frames = self._build_index(
+            self.result_root)
+        index = dict(
+            version=self.INDEX_VERSION,
+            all_full_frames=_all_full_frames,
+            all_folders=_all_folders,
+            folder_frames=folder_frames)
+        with open(self.cache_path, 'wb') as fp:
+            pickle.dump(index, fp)
+        print("Index saved to", self.cache_path)
+        return index
 
     def _build_index(self, result_root):
 
@@ -51,13 +74,12 @@ class PairLocator:
             pair_dir = os.listdir(root)
             dir_infos = []
             for d in tqdm.tqdm(pair_dir):
-                l = sorted(os.listdir(osp.join(root, d)))
-                mn, mx = l[0], l[-1]
-                mn = int(re.search('\d{10}', mn)[0])
-                mx = int(re.search('\d{10}', mx)[0])
-                dir_infos.append( (d, mn, mx) )
+                frames = sorted(
+                    int(re.search('\d{10}', x)[0])
+                    for x in os.listdir(osp.join(root, d)))
+                dir_infos.append( (d, np.int64(frames)) )
             def func(l):
-                x, _, _ = l
+                x, _ = l
                 a, b, c = x.split('_')
                 a = a[1:]
                 a = int(a)
@@ -67,21 +89,23 @@ class PairLocator:
             pair_infos = sorted(dir_infos, key=func)
             return pair_infos
 
-        pair_infos = generate_pair_infos(result_root)  # pair_infos[i] = ['P01_01_0003', '123', '345']
+        pair_infos = generate_pair_infos(result_root)  # pair_infos[i] = ['P01_01_0003', array([123, ..., 345])]
 
         _all_full_frames = []
         _all_folders = []
-        for folder, st, ed in pair_infos:
-            min_frame = int(st)
+        folder_frames = {}
+        for folder, frames in pair_infos:
+            min_frame = int(frames[0])
             index = self._hash(folder, min_frame)
             _all_full_frames.append(index)
             _all_folders.append(folder)
+            folder_frames[folder] = frames
 
         _all_full_frames = np.int64(_all_full_frames)
         sort_idx = np.argsort(_all_full_frames)
         _all_full_frames = _all_full_frames[sort_idx]
         _all_folders = np.asarray(_all_folders)[sort_idx]
-        return _all_full_frames, _all_folders
+        return _all_full_frames, _all_folders, folder_frames
 
     @staticmethod
     def _hash(vid: str, frame: int):
@@ -106,15 +130,25 @@ class PairLocator:
             if self.verbose:
                 print(f"folder for {vid} not found")
             return None
-        frames = map(
-            lambda x: int(re.search('[0-9]{10}', x).group(0)),
-            os.listdir(self.result_root/r))
-        if max(frames) < frame:
+        if self._folder_frames[r][-1] < frame:
             if self.verbose:
                 print(f"Not found in {r}")
             return None
         return r
 
+    def folder_frames(self, folder) -> np.ndarray:
+        """ Sorted frame numbers stored in folder """
+        return self._folder_frames[folder]
+
+    def contains(self, vid, frame) -> bool:
+        """ Whether (vid, frame) has a file, without filesystem access """
+        folder = self.locate(vid, frame)
+        if folder is None:
+            return False
+        frames = self._folder_frames[folder]
+        loc = bisect.bisect_left(frames, frame)
+        return loc < len(frames) and frames[loc] == frame
+
     def get_path(self, vid, frame):
         folder = self.locate(vid, frame)
         if folder is None:
@@ -127,10 +161,12 @@ class PairLocator:
 class ImageLocator(PairLocator):
     def __init__(self, 
                  result_root='/home/skynet/Zhifan/data/visor-dense/480p',
-                 cache_path='.cache/image_pair_index.pkl'):
+                 cache_path='.cache/image_pair_index.pkl',
+                 rebuild=False):
         super().__init__(
             result_root=result_root,
-            cache_path=cache_path)
+            cache_path=cache_path,
+            rebuild=rebuild)
 
     def get_path(self, vid, frame):
         folder = self.locate(vid, frame)
@@ -144,10 +180,12 @@ class ImageLocator(PairLocator):
 class UnfilteredMaskLocator(PairLocator):
     def __init__(self, 
                  result_root='/home/skynet/Zhifan/data/visor-dense/unfiltered_interpolations',
-                 cache_path='.cache/mask_pair_index.pkl'):
+                 cache_path='.cache/mask_pair_index.pkl',
+                 rebuild=False):
         super().__init__(
             result_root=result_root,
-            cache_path=cache_path)
+            cache_path=cache_path,
+            rebuild=rebuild)
 
     def get_path(self, vid, frame):
         folder = self.locate(vid, frame)
@@ -159,6 +197,13 @@ class UnfilteredMaskLocator(PairLocator):
 
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild the image and mask locator indices')
+    if parser.parse_args().rebuild:
+        ImageLocator(rebuild=True)
+        UnfilteredMaskLocator(rebuild=True)
     """
     class LocatorExt(PairLocator):
 
@@ -8,6 +8,7 @@ from libzhifan import io
 from PIL import Image
 
 # from lib.locators import ImageLocator, UnfilteredMaskLocator
+from homan.datasets import jpegutils
 from homan.datasets.epichor_reader_lib.locators import ImageLocator, UnfilteredMaskLocator
 
 """ Interface
@@ -20,6 +21,13 @@ mask = reader.read_mask(vid, frame, keep_mask: None or List[str])
 _image_locator = ImageLocator()
 
 
+def mask_to_pil(mask: np.ndarray, palette) -> Image.Image:
+    """ Palette-mode PIL image of an id mask """
+    m = Image.fromarray(mask)
+    m.putpalette(palette)
+    return m
+
+
 class EpicImageReader:
 
     IMG_SIZE = (854, 480)
@@ -38,7 +46,7 @@ class EpicImageReader:
         img_path = self.image_format % (vid[:3], vid, frame)
         if not osp.exists(img_path):
             return None
-        return Image.open(img_path).resize(self.IMG_SIZE)
+        return jpegutils.open_image(img_path, self.IMG_SIZE).resize(self.IMG_SIZE)
 
 
 class Reader:
@@ -73,7 +81,7 @@ class Reader:
         fname = _image_locator.get_path(vid, frame)
         if fname is None:
             return None
-        return Image.open(fname).resize(self.IMG_SIZE)
+        return jpegutils.open_image(fname, self.IMG_SIZE).resize(self.IMG_SIZE)
 
     def read_mask(self, vid, frame, return_mapping=False):
         """
@@ -88,6 +96,32 @@ class Reader:
     def read_mask_pil(self, vid, frame) -> Image.Image:
         return self.mask_reader.read_mask_pil(vid, frame)
 
+    def read_frame(self, vid, frame, target_size=None
+                   ) -> Tuple[Image.Image, Image.Image, dict]:
+        """ Decode image and mask of a frame exactly once.
+
+        The image is returned at its decoded resolution (no resize),
+        callers are expected to fold any rescaling into their own
+        transform so the decoded buffer is only resampled once.
+
+        Args:
+            target_size: (W, H), if given the JPEG is decoded at the
+                smallest libjpeg scale that still covers it.
+
+        Returns:
+            img: Image.Image (RGB) or None
+            mask: Image.Image (P mode, palette applied) or None
+            mapping: {category: int_id} or None
+        """
+        fname = _image_locator.get_path(vid, frame)
+        img = None if fname is None else \
+            jpegutils.open_image(fname, target_size).convert('RGB')
+        mask, mapping = self.mask_reader.read_mask(
+            vid, frame, return_mapping=True)
+        if mask is None:
+            return img, None, None
+        return img, mask_to_pil(mask, self.mask_reader.palette), mapping
+
     def read_blend(self, vid, frame, alpha=0.5) -> Image.Image:
         """
         Returns: list of Image or Image
@@ -133,8 +167,8 @@ class FilteredMaskReader:
 
         if return_mapping:
             mapping = self.mapping[vid]
-            avail_ids = np.unique(mask)  # this include bg
-            mapping = {k: v for k, v in mapping.items() if v in avail_ids}
+            avail = np.bincount(mask.ravel(), minlength=256) > 0  # this include bg
+            mapping = {k: v for k, v in mapping.items() if avail[v]}
             return mask, mapping
 
         return mask
@@ -143,9 +177,7 @@ class FilteredMaskReader:
         m = self.read_mask(vid, frame)
         if m is None:
             return None
-        m = Image.fromarray(m)
-        m.putpalette(self.palette)
-        return m
+        return mask_to_pil(m, self.palette)
 
 
 class UnfilteredMaskReader:
@@ -158,20 +190,20 @@ class UnfilteredMaskReader:
         self.unfiltered_locator = UnfilteredMaskLocator(
             result_root=self.result_root)
         self.mapping = pd.read_csv(self.data_root/"meta_infos/unfiltered_color_mappings.csv")
+        # {interpolation folder: {Object_name: new_index}}, built once
+        self.folder_mappings = {
+            folder: dict(zip(df['Object_name'], df['new_index'].astype(int)))
+            for folder, df in self.mapping.groupby('interpolation')
+        }
 
     def read_mask(self, vid, frame, return_mapping=False) -> np.ndarray:
-        mask_path = self.unfiltered_locator.get_path(vid, frame)
-        if mask_path is None:
-            return None if not return_mapping else (None, None)
-        if not osp.exists(mask_path):
+        if not self.unfiltered_locator.contains(vid, frame):
             return None if not return_mapping else (None, None)
+        mask_path = self.unfiltered_locator.get_path(vid, frame)
         mask = np.asarray(Image.open(mask_path)).astype(np.uint8)
         if return_mapping:
             folder = self.unfiltered_locator.locate(vid, frame)
-            df = self.mapping[self.mapping['interpolation'] == folder]
-            mapping = {
-                v['Object_name']: v['new_index']
-                for i, v in df.iterrows()}
+            mapping = dict(self.folder_mappings.get(folder, {}))
             return mask, mapping
 
         return mask
@@ -180,37 +212,29 @@ class UnfilteredMaskReader:
         m = self.read_mask(vid, frame)
         if m is None:
             return None
-        m = Image.fromarray(m)
-        m.putpalette(self.palette)
-        return m
+        return mask_to_pil(m, self.palette)
 
 
 def read_mask_with_keep(reader: Reader, 
                         vid, frame, 
                         keep: List[str],
                         return_pil=False):
-    """ This might be expensive operation 
+    """ Zero out every id not in `keep`, with a single lookup-table remap
 
     Returns: (mask, mapping)
     """
     mask, mapping = reader.read_mask(vid, frame, return_mapping=True)
     if mask is None:
         return None, None
-    avail_ids = np.unique(mask)
     keep_ids = [mapping[k] for k in keep if k in mapping]
     keep_mapping = {k: v for k, v in mapping.items() if v in keep_ids}
 
-    for int_id in avail_ids:
-        if int_id == 0:
-            continue
-        if int_id in keep_ids:
-            mask[mask == int_id] = int_id
-        else:
-            mask[mask == int_id] = 0
-    
+    lut = np.zeros(256, dtype=np.uint8)
+    lut[keep_ids] = keep_ids
+    mask = lut[mask]
+
     if return_pil:
-        mask = Image.fromarray(mask)
-        mask.putpalette(reader.mask_reader.palette)
+        mask = mask_to_pil(mask, reader.mask_reader.palette)
     return mask, keep_mapping
 
 
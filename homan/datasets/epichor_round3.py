@@ -14,7 +14,6 @@ from pytorch3d.transforms import rotation_6d_to_matrix
 import os
 import os.path as osp
 import pandas as pd
-from PIL import Image
 import trimesh
 from libyana.lib3d import kcrop
 from libyana.transformutils import handutils
@@ -72,6 +71,17 @@ def apply_bbox_transform(bbox, affine_trans):
     return new_bbox
 
 
+def resized_affine(affine_trans, src_size, dst_size):
+    """ Compose a resize from src_size to dst_size (both WH) in front of
+    affine_trans, so that a single transform_img() on the source image
+    gives the same crop as resize() followed by transform_img().
+    """
+    scale = np.diag([
+        dst_size[0] / src_size[0], dst_size[1] / src_size[1], 1.
+    ]).astype(np.float32)
+    return affine_trans.dot(scale)
+
+
 def load_models():
     OBJ_ROOT = "/home/barry/Zhifan/epic_hor_method/weights/obj_models/epichor_export/"
     model_names = {'bottle', 'bowl', 'plate', 'can', 'cup', 'mug', 'glass', 'pan', 'saucepan'}
@@ -194,12 +204,10 @@ class EPICHOR_ROUND3:
         seq_cameras = []
         # for frame_id in frame_ids:
         for frame in frame_idxs:
-            img = self.reader.read_image(vid, frame)
-            # img = cv2.imread(self.image_fmt % (folder, video_id, frame_idx))
-            # img = cv2.resize(img, self.image_size)
-            # img = Image.fromarray(img[:, :, ::-1])
-            img = self.reader.read_image_pil(vid, frame)  # No need to do BGR->RGB (?)
-            img = img.resize(self.image_size)
+            # Decode image and mask once, the resize to self.image_size is
+            # folded into the ROI affine so each buffer is resampled once.
+            img, mask_pil, mapping = self.reader.read_frame(
+                vid, frame, target_size=self.image_size)
 
             hand_box = self.hoa_hbox[mp4_name][frame]
             obj_box = self.oboxes_cache[mp4_name][frame]
@@ -210,21 +218,20 @@ class EPICHOR_ROUND3:
             obj_bbox = obj_box * obj_box_scale
 
             roi, affine_trans = self.get_roi(hand_box, obj_bbox)
-            img = handutils.transform_img(img, affine_trans, [res, res])
+            img = handutils.transform_img(
+                img, resized_affine(affine_trans, img.size, self.image_size),
+                [res, res])
             images.append(img)
 
             # Occlusion ignore will be added later in the method code
-            mask_pil = self.reader.read_mask_pil(vid, frame)
-            _, mapping = self.reader.read_mask(vid, frame, return_mapping=True)
-            mask_pil = mask_pil.resize(self.image_size, Image.NEAREST)
-            mask_pil = handutils.transform_img(mask_pil, affine_trans, [res, res])
+            mask_pil = handutils.transform_img(
+                mask_pil,
+                resized_affine(affine_trans, mask_pil.size, self.image_size),
+                [res, res])
             mask = np.asarray(mask_pil)
-            # mask = mask.astype(np.int32)
 
-            mask_hand = np.zeros_like(mask)
-            mask_hand[mask == mapping[long_side]] = 1
-            mask_obj = np.zeros_like(mask)
-            mask_obj[mask == mapping[hos_name]] = 1
+            mask_hand = (mask == mapping[long_side]).astype(mask.dtype)
+            mask_obj = (mask == mapping[hos_name]).astype(mask.dtype)
             masks_hand.append(mask_hand)
             masks_obj.append(mask_obj)
 
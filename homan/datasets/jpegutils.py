@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Reduced-resolution JPEG decoding.
+
+libjpeg can decode directly at 1/2, 1/4 or 1/8 scale in the DCT domain,
+which is several times cheaper (in time and memory) than decoding at full
+resolution and downsizing afterwards. The helpers here pick the smallest
+such scale that still covers the requested target size, so the final
+resize/crop only ever downsamples.
+"""
+from PIL import Image
+
+
+def draft(img: Image.Image, target_size) -> Image.Image:
+    """ Request DCT-domain downscaling on a not-yet-loaded PIL image.
+    No-op for non-JPEG images or when target_size is None.
+    """
+    if target_size is not None and img.format == 'JPEG':
+        img.draft('RGB', tuple(int(v) for v in target_size))
+    return img
+
+
+def open_image(path, target_size=None) -> Image.Image:
+    """ Open an image decoded at the smallest JPEG scale >= target_size.
+    The returned image is NOT resized to target_size.
+    """
+    return draft(Image.open(path), target_size)
+
+
+def read_image(path, target_size, resample=Image.BILINEAR) -> Image.Image:
+    """ Equivalent of cv2.resize(cv2.imread(path), target_size) in RGB,
+    but decoding at reduced resolution first.
+    """
+    img = open_image(path, target_size).convert('RGB')
+    if img.size != tuple(target_size):
+        img = img.resize(tuple(target_size), resample)
+    return img
@@ -2,31 +2,107 @@
 # -*- coding: utf-8 -*-
 
 import os
+import pickle
 import tarfile
+from collections import OrderedDict
 
 import cv2
 import numpy as np
 
+INDEX_SUFFIX = ".index.pkl"
+
 
 class TarReader():
-    def __init__(self):
-        self.last_tar_path = None
-        self.tarf = None
+    """ Random access to frames stored in (uncompressed) EPIC tar archives.
+
+    Each tar gets a member index {name: (offset_data, size)} built once with
+    tarfile and saved beside the archive as <tar>.index.pkl. Frames are then
+    read with a single seek + read on a cached file handle, no header scan.
+
+    Args:
+        max_open: number of tar file handles kept open (LRU)
+    """
+    def __init__(self, max_open=8):
+        self.max_open = max_open
+        self._handles = OrderedDict()
+        self._indices = {}
 
     def read_tar_frame(self, frame_path):
         base_tar_path, filename = tar_from_frame_path(frame_path)
+        np_dec = self.read_member(base_tar_path, filename)
+        return cv2.imdecode(np_dec, cv2.IMREAD_COLOR)
+
+    def read_member(self, tar_path, filename) -> np.ndarray:
+        """ Raw bytes of member `filename` as a uint8 array """
+        offset, size = self.get_index(tar_path)[_member_key(filename)]
+        handle = self._get_handle(tar_path)
+        handle.seek(offset)
+        return np.frombuffer(handle.read(size), dtype=np.uint8)
+
+    def get_index(self, tar_path) -> dict:
+        if tar_path not in self._indices:
+            self._indices[tar_path] = load_tar_index(tar_path)
+        return self._indices[tar_path]
+
+    def _get_handle(self, tar_path):
+        if tar_path in self._handles:
+            self._handles.move_to_end(tar_path)
+            return self._handles[tar_path]
+        handle = open(tar_path, "rb")
+        self._handles[tar_path] = handle
+        while len(self._handles) > self.max_open:
+            _, old_handle = self._handles.popitem(last=False)
+            old_handle.close()
+        return handle
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+
+    def __getstate__(self):
+        # File handles are per-process, reopen lazily after pickling
+        state = self.__dict__.copy()
+        state["_handles"] = OrderedDict()
+        return state
+
+
+def _member_key(name):
+    return name[2:] if name.startswith("./") else name
+
 
-        # Lazy loading of tar file
-        if base_tar_path != self.last_tar_path:
-            load_tarf = tarfile.open(base_tar_path)
-            self.tarf = load_tarf
-        tarf = self.tarf
+def build_tar_index(tar_path) -> dict:
+    """ {member_name: (offset_data, size)} for all regular files in tar_path """
+    index = {}
+    with tarfile.open(tar_path) as tarf:
+        for member in tarf:
+            if member.isfile():
+                index[_member_key(member.name)] = (member.offset_data,
+                                                   member.size)
+    return index
 
-        self.last_tar_path = base_tar_path
 
-        # Read image
-        img = cv2_imread_tar(tarf, './' + filename)
-        return img
+def load_tar_index(tar_path, index_path=None) -> dict:
+    """ Load the member index of tar_path, building and saving it if missing
+    or older than the archive. If the archive folder is read-only the index
+    is only kept in memory.
+    """
+    if index_path is None:
+        index_path = tar_path + INDEX_SUFFIX
+    tar_stat = os.stat(tar_path)
+    stamp = (tar_stat.st_size, tar_stat.st_mtime)
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as p_f:
+            saved = pickle.load(p_f)
+        if saved["stamp"] == stamp:
+            return saved["index"]
+    index = build_tar_index(tar_path)
+    try:
+        with open(index_path, "wb") as p_f:
+            pickle.dump({"stamp": stamp, "index": index}, p_f)
+    except OSError:
+        pass
+    return index
 
 
 def tar_from_frame_path(frame_path):
@@ -79,4 +79,32 @@ class VisorMaskExtractor:
             full_mask=masks,
             square_bbox=square_bbox,
             crop_mask=crop_masks[0].cpu().numpy(),
-        )]
\ No newline at end of file
+        )]
+
+    def masks_from_bboxes_batch(self,
+                                images,
+                                boxes_wh,
+                                pred_classes=None,
+                                class_idx=-1,
+                                input_format="RGB",
+                                rend_size=REND_SIZE,
+                                image_size=640):
+        """ Same interface as MaskExtractor.masks_from_bboxes_batch(),
+        images[i] reads the masks of frame i.
+        """
+        if pred_classes is None:
+            pred_classes = [None] * len(images)
+        all_annotations = []
+        for frame_idx, (im, frame_boxes, frame_classes) in enumerate(
+                zip(images, boxes_wh, pred_classes)):
+            self._idx = frame_idx
+            if frame_classes is None:
+                frame_classes = [class_idx] * len(frame_boxes)
+            all_annotations.append([
+                self.masks_from_bboxes(im, [box],
+                                       class_idx=int(box_class),
+                                       rend_size=rend_size,
+                                       image_size=image_size)[0]
+                for box, box_class in zip(frame_boxes, frame_classes)
+            ])
+        return all_annotations
@@ -28,6 +28,58 @@ from libyana.conversions import npt
 from libyana.lib3d import trans3d
 from libyana.verify.checkshape import check_shape
 
+# Approximate GPU memory used by neural_renderer for each rendered sample,
+# per rasterized pixel (face index, barycentric weights, depth, rgb, alpha
+# and sampling buffers) and per face (face vertices, textures, lighting)
+RENDER_BYTES_PER_PIXEL = 64
+RENDER_BYTES_PER_FACE = 256
+RENDER_MEM_BUDGET = 2 * 1024**3
+# Per-frame pose parameters which can be optimized on keyframes only
+KEYFRAME_KEYS = [
+    "translations_object", "rotations_object", "translations_hand",
+    "rotations_hand", "mano_pca_pose"
+]
+
+
+def get_render_chunk_size(renderer, face_nb, mem_budget=RENDER_MEM_BUDGET):
+    """ Number of samples rendered at once by renderer within mem_budget """
+    pixel_nb = renderer.image_size**2
+    if renderer.anti_aliasing:
+        # Rasterized at twice the resolution, then downsampled
+        pixel_nb = pixel_nb * 4
+    sample_bytes = (pixel_nb * RENDER_BYTES_PER_PIXEL +
+                    face_nb * RENDER_BYTES_PER_FACE)
+    return max(1, int(mem_budget // sample_bytes))
+
+
+def get_keyframe_weights(frame_nb, keyframe_idxs):
+    """
+    Returns:
+        weights (torch.Tensor): (frame_nb, keyframe_nb) linear interpolation
+            weights of each frame from its two surrounding keyframes
+    """
+    keyframe_idxs = sorted(keyframe_idxs)
+    weights = torch.zeros(frame_nb, len(keyframe_idxs))
+    for frame_idx in range(frame_nb):
+        next_key = np.searchsorted(keyframe_idxs, frame_idx)
+        if next_key == 0 or next_key == len(keyframe_idxs):
+            # Frames outside the keyframe range keep the closest keyframe
+            weights[frame_idx, min(next_key, len(keyframe_idxs) - 1)] = 1
+            continue
+        prev_idx, next_idx = keyframe_idxs[next_key - 1], keyframe_idxs[
+            next_key]
+        alpha = (frame_idx - prev_idx) / (next_idx - prev_idx)
+        weights[frame_idx, next_key - 1] = 1 - alpha
+        weights[frame_idx, next_key] = alpha
+    return weights
+
+
+def _batch_chunk(tensor, start, end):
+    """ Samples start:end of tensor, broadcasting a batch dimension of 1 """
+    if tensor.shape[0] == 1:
+        return tensor.expand(end - start, *tensor.shape[1:]).contiguous()
+    return tensor[start:end]
+
 
 class HOMan(nn.Module):
     def __init__(
@@ -64,12 +116,20 @@ class HOMan(nn.Module):
         inter_type="centroid",
         image_size=640,
         optimize_hand_pose=True,
+        render_mem_budget=None,
     ):
         """
         Hands are received in batch of [h_1_t_1, h_2_t_1, ..., h_1_t_2]
         (h_{hand_index}_t_{time_step})
+
+        Args:
+            render_mem_budget (int): bytes of GPU memory used by each chunk
+                of the visualization renders, RENDER_MEM_BUDGET if None
         """
         super().__init__()
+        if render_mem_budget is None:
+            render_mem_budget = RENDER_MEM_BUDGET
+        self.render_mem_budget = render_mem_budget
         # Initialize object pamaters
         translation_init = translations_object.detach().clone()
         self.translations_object = nn.Parameter(translation_init,
@@ -130,6 +190,9 @@ class HOMan(nn.Module):
                 self.register_buffer("int_scales_hand",
                                     torch.ones(1).float() * int_scale_init)
         self.register_buffer("verts_hand_og", verts_hand_og)
+        # Keyframe poses and interpolation weights, see set_keyframes()
+        self.keyframe_poses = None
+        self.register_buffer("keyframe_weights", None, persistent=False)
         self.register_buffer("ref_verts2d_hand", ref_verts2d_hand)
 
         init_scales = int_scale_init * torch.ones(1).float()
@@ -146,24 +209,28 @@ class HOMan(nn.Module):
 
         self.register_buffer("int_scale_hand_mean",
                              torch.Tensor([1.0]).float().cuda())
-        self.register_buffer("ref_mask_object",
-                             (target_masks_object > 0).float())
-        self.register_buffer("keep_mask_object",
-                             (target_masks_object >= 0).float())
-        self.register_buffer("ref_mask_hand", (target_masks_hand > 0).float())
-        self.register_buffer("keep_mask_hand",
-                             (target_masks_hand >= 0).float())
+        # Boolean masks, converted to float in the silhouette losses
+        self.register_buffer("ref_mask_object", target_masks_object > 0)
+        self.register_buffer("keep_mask_object", target_masks_object >= 0)
+        self.register_buffer("ref_mask_hand", target_masks_hand > 0)
+        self.register_buffer("keep_mask_hand", target_masks_hand >= 0)
         self.register_buffer("camintr_rois_object", camintr_rois_object)
         self.register_buffer("camintr_rois_hand", camintr_rois_hand)
-        self.register_buffer("faces_object", faces_object)
-        self.register_buffer(
-            "textures_object",
-            torch.ones(faces_object.shape[0], faces_object.shape[1], 1, 1, 1,
-                       3))
+        # Topology and constant colors are stored once and expanded over the
+        # batch on access (see faces_object and textures_object), they are
+        # not saved in the state dict. Assumes a single object mesh.
+        self.batch_size = faces_object.shape[0]
+        self.register_buffer("faces_object_shared",
+                             faces_object[:1].clone(),
+                             persistent=False)
+        self.register_buffer("textures_object_shared",
+                             torch.ones(1, faces_object.shape[1], 1, 1, 1, 3),
+                             persistent=False)
         self.register_buffer(
             "textures_hand",
-            torch.ones(faces_hand.shape[0], faces_hand.shape[1], 1, 1, 1, 3))
-        self.register_buffer("faces_hand", faces_hand)
+            torch.ones(faces_hand.shape[0], faces_hand.shape[1], 1, 1, 1, 3),
+            persistent=False)
+        self.register_buffer("faces_hand", faces_hand, persistent=False)
         self.cuda()
 
         # Setup renderer
@@ -213,24 +280,24 @@ class HOMan(nn.Module):
         faces, textures = get_faces_and_textures(ref_verts_list,
                                                  ref_faces_list,
                                                  color_names=pred_colors)
-        # Assumes only one object
+        # Assumes only one object, batch views of a single copy
         batch_size = verts_object.shape[0]
-        self.faces = faces.repeat(batch_size, 1, 1)
-        self.textures = textures.repeat(batch_size, 1, 1, 1, 1, 1)
+        self.faces = faces.expand(batch_size, -1, -1)
+        self.textures = textures.expand(batch_size, -1, -1, -1, -1, -1)
         faces_gt, textures_gt = get_faces_and_textures(ref_verts_list,
                                                        ref_faces_list,
                                                        color_names=gt_colors)
-        self.textures_gt = textures_gt.repeat(batch_size, 1, 1, 1, 1, 1)
-        self.faces_gt = faces_gt.repeat(batch_size, 1, 1)
+        self.textures_gt = textures_gt.expand(batch_size, -1, -1, -1, -1, -1)
+        self.faces_gt = faces_gt.expand(batch_size, -1, -1)
 
         faces_with_gt, textures_with_gt = get_faces_and_textures(
             ref_verts_list + ref_verts_list,
             ref_faces_list + ref_faces_list,
             color_names=pred_colors + gt_colors)
 
-        self.textures_with_gt = textures_with_gt.repeat(
-            batch_size, 1, 1, 1, 1, 1)
-        self.faces_with_gt = faces_with_gt.repeat(batch_size, 1, 1)
+        self.textures_with_gt = textures_with_gt.expand(
+            batch_size, -1, -1, -1, -1, -1)
+        self.faces_with_gt = faces_with_gt.expand(batch_size, -1, -1)
         self.losses = Losses(
             renderer=self.renderer,
             ref_mask_object=self.ref_mask_object,
@@ -250,6 +317,87 @@ class HOMan(nn.Module):
         self.verts_hand_init = verts_hand_init.detach().clone()
         self.verts_object_init = verts_object_init.detach().clone()
 
+    @property
+    def faces_object(self):
+        """ (batch_size, face_nb, 3) view of the shared object faces """
+        return self.faces_object_shared.expand(self.batch_size, -1, -1)
+
+    @property
+    def textures_object(self):
+        return self.textures_object_shared.expand(self.batch_size, -1, -1,
+                                                  -1, -1, -1)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.__dict__.setdefault("render_mem_budget", RENDER_MEM_BUDGET)
+        self.__dict__["_modules"].setdefault("keyframe_poses", None)
+        self.__dict__["_buffers"].setdefault("keyframe_weights", None)
+        # Models pickled with per-frame copies of the object topology
+        buffers = self.__dict__["_buffers"]
+        if "faces_object" in buffers:
+            faces_object = buffers.pop("faces_object")
+            self.batch_size = faces_object.shape[0]
+            buffers.pop("textures_object", None)
+            self.register_buffer("faces_object_shared",
+                                 faces_object[:1].clone(),
+                                 persistent=False)
+            self.register_buffer("textures_object_shared",
+                                 faces_object.new_ones(
+                                     1, faces_object.shape[1], 1, 1, 1,
+                                     3).float(),
+                                 persistent=False)
+
+    def set_keyframes(self, keyframe_idxs):
+        """
+        Optimizes the pose parameters of keyframe_idxs only, the poses of
+        the other frames being linearly interpolated between keyframes (6D
+        rotations are re-orthonormalized by rot6d_to_matrix). The current
+        poses of the keyframes are used as initialization.
+        """
+        frame_nb = self.translations_object.shape[0]
+        self.register_buffer("keyframe_weights",
+                             get_keyframe_weights(
+                                 frame_nb,
+                                 keyframe_idxs).to(self.camintr.device),
+                             persistent=False)
+        keyframe_idxs = sorted(keyframe_idxs)
+        params = dict(self.named_parameters(recurse=False))
+        keyframe_poses = {}
+        for key in KEYFRAME_KEYS:
+            if key not in params:
+                continue
+            param = params[key]
+            param.requires_grad = False
+            frame_poses = param.view(frame_nb, -1, *param.shape[1:])
+            keyframe_poses[key] = nn.Parameter(
+                frame_poses[keyframe_idxs].detach().clone())
+        self.keyframe_poses = nn.ParameterDict(keyframe_poses)
+
+    def bake_keyframes(self):
+        """ Writes the interpolated poses to the per-frame parameters and
+        leaves the keyframe mode
+        """
+        if self.keyframe_poses is None:
+            return
+        with torch.no_grad():
+            for key in self.keyframe_poses:
+                param = getattr(self, key)
+                param.copy_(self.get_pose(key))
+                param.requires_grad = True
+        self.keyframe_poses = None
+        self.keyframe_weights = None
+
+    def get_pose(self, key):
+        """ Per-frame pose parameter key, interpolated from the keyframes in
+        keyframe mode
+        """
+        if self.keyframe_poses is None or key not in self.keyframe_poses:
+            return getattr(self, key)
+        keyframe_pose = self.keyframe_poses[key]
+        frame_poses = torch.einsum("fk,k...->f...", self.keyframe_weights,
+                                   keyframe_pose)
+        return frame_poses.reshape(-1, *keyframe_pose.shape[2:])
+
     def assign_human_masks(self, masks_human=None, min_overlap=0.5):
         """
         Uses a greedy matching algorithm to assign masks to human instances. The
@@ -310,11 +458,11 @@ class HOMan(nn.Module):
         return human_masks.cuda()
 
     def get_verts_object(self):
-        rotations_object = rot6d_to_matrix(self.obj_rot_mult *
-                                           self.rotations_object)
+        rotations_object = rot6d_to_matrix(
+            self.obj_rot_mult * self.get_pose("rotations_object"))
         obj_verts = compute_transformation_persp(
             meshes=self.verts_object_og,
-            translations=self.translations_object,
+            translations=self.get_pose("translations_object"),
             rotations=rotations_object,
             intrinsic_scales=self.int_scales_object.abs(),
         )
@@ -323,7 +471,8 @@ class HOMan(nn.Module):
     def get_joints_hand(self):
         all_hand_joints = []
         for hand_idx, side in enumerate(self.hand_sides):
-            mano_pca_pose = self.mano_pca_pose[hand_idx::self.hand_nb]
+            mano_pca_pose = self.get_pose(
+                "mano_pca_pose")[hand_idx::self.hand_nb]
             mano_rot = self.mano_rot[hand_idx::self.hand_nb]
             mano_res = self.mano_model.forward_pca(
                 mano_pca_pose,
@@ -344,10 +493,10 @@ class HOMan(nn.Module):
         all_hand_joints = torch.stack(all_hand_joints).transpose(
             0, 1).contiguous().view(-1, 21, 3)
         joints_hand_og = all_hand_joints + self.mano_trans.unsqueeze(1)
-        rotations_hand = rot6d_to_matrix(self.rotations_hand)
+        rotations_hand = rot6d_to_matrix(self.get_pose("rotations_hand"))
         return compute_transformation_persp(
             meshes=joints_hand_og,
-            translations=self.translations_hand,
+            translations=self.get_pose("translations_hand"),
             rotations=rotations_hand,
             intrinsic_scales=self.int_scales_hand,
         )
@@ -356,7 +505,8 @@ class HOMan(nn.Module):
         if self.optimize_mano:
             all_hand_verts = []
             for hand_idx, side in enumerate(self.hand_sides):
-                mano_pca_pose = self.mano_pca_pose[hand_idx::self.hand_nb]
+                mano_pca_pose = self.get_pose(
+                    "mano_pca_pose")[hand_idx::self.hand_nb]
                 mano_rot = self.mano_rot[hand_idx::self.hand_nb]
                 mano_res = self.mano_model.forward_pca(
                     mano_pca_pose,
@@ -374,7 +524,7 @@ class HOMan(nn.Module):
             scale = self.int_scales_hand.detach()
         else:
             scale = self.int_scales_hand
-        rotations_hand = rot6d_to_matrix(self.rotations_hand)
+        rotations_hand = rot6d_to_matrix(self.get_pose("rotations_hand"))
         if self.hand_proj_mode == "ortho":
             return compute_transformation_ortho(
                 meshes=verts_hand_og,
@@ -386,7 +536,7 @@ class HOMan(nn.Module):
         elif self.hand_proj_mode == "persp":
             return compute_transformation_persp(
                 meshes=verts_hand_og,
-                translations=self.translations_hand,
+                translations=self.get_pose("translations_hand"),
                 rotations=rotations_hand,
                 intrinsic_scales=scale,
             )
@@ -398,32 +548,54 @@ class HOMan(nn.Module):
     def compute_ordinal_depth_loss(self):
         verts_object, _ = self.get_verts_object()
         verts_hand, _ = self.get_verts_hand()
+        batch_size = verts_object.shape[0]
 
-        silhouettes = []
-        depths = []
-
-        _, depths_o, silhouettes_o = self.renderer.render(
-            verts_object, self.faces_object, self.textures_object)
-        silhouettes_o = (silhouettes_o == 1).bool()
-        silhouettes.append(silhouettes_o)
-        depths.append(depths_o)
-
-        hand_masks = []
-        for hand_idx, faces, textures in zip(range(self.hand_nb),
-                                             self.faces_hand,
-                                             self.textures_hand):
-            hand_verts = verts_hand[hand_idx::self.hand_nb]
-            repeat_nb = hand_verts.shape[0]
-            faces_hand = faces.unsqueeze(0).repeat(repeat_nb, 1, 1)
-            textures_hand = textures.unsqueeze(0).repeat(
-                repeat_nb, 1, 1, 1, 1, 1)
-            _, depths_p, silhouettes_p = self.renderer.render(
-                hand_verts, faces_hand, textures_hand)
-            silhouettes_p = (silhouettes_p == 1).bool()
-            # imagify.viz_imgrow(cols, "tmp_hands.png")
-            silhouettes.append(silhouettes_p)
-            depths.append(depths_p)
-            hand_masks.append(self.masks_human[hand_idx::self.hand_nb])
+        # Render the object and each hand in a single rasterization pass by
+        # stacking the instances along the batch dimension, padding them to
+        # a common vertex and face count with unused vertices and
+        # degenerate faces (which cover no pixel)
+        inst_verts = [verts_object] + [
+            verts_hand[hand_idx::self.hand_nb]
+            for hand_idx in range(self.hand_nb)
+        ]
+        inst_faces = [self.faces_object] + [
+            faces.unsqueeze(0).expand(batch_size, -1, -1)
+            for faces in self.faces_hand[:self.hand_nb]
+        ]
+        inst_textures = [self.textures_object] + [
+            textures.unsqueeze(0).expand(batch_size, -1, -1, -1, -1, -1)
+            for textures in self.textures_hand[:self.hand_nb]
+        ]
+        vert_nb = max(verts.shape[1] for verts in inst_verts)
+        face_nb = max(faces.shape[1] for faces in inst_faces)
+        inst_verts = [
+            torch.nn.functional.pad(verts,
+                                    (0, 0, 0, vert_nb - verts.shape[1]))
+            for verts in inst_verts
+        ]
+        inst_faces = [
+            torch.nn.functional.pad(faces,
+                                    (0, 0, 0, face_nb - faces.shape[1]))
+            for faces in inst_faces
+        ]
+        inst_textures = [
+            torch.nn.functional.pad(
+                textures, (0, 0, 0, 0, 0, 0, 0, 0, 0,
+                           face_nb - textures.shape[1]))
+            for textures in inst_textures
+        ]
+        inst_nb = len(inst_verts)
+        camintr = self.renderer.K
+        if camintr.shape[0] > 1:
+            camintr = camintr.repeat(inst_nb, 1, 1)
+        _, depths, silhouettes = self.renderer.render(
+            torch.cat(inst_verts),
+            torch.cat(inst_faces),
+            torch.cat(inst_textures),
+            K=camintr)
+        # [(batch_size, height, width), ...] of len inst_nb
+        silhouettes = list((silhouettes == 1).chunk(inst_nb))
+        depths = list(depths.chunk(inst_nb))
 
         all_masks = [self.masks_object] + [
             self.masks_human[hand_idx::self.hand_nb]
@@ -517,10 +689,14 @@ class HOMan(nn.Module):
         else:
             return h_to_o, o_to_h
 
-    def forward(self, loss_weights=None):
+    def forward(self, loss_weights=None, frame_idxs=None):
         """
         If a loss weight is zero, that loss isn't computed (to avoid unnecessary
         compute).
+
+        Args:
+            frame_idxs (torch.Tensor): frames on which the object silhouette,
+                collision and contact losses are computed, all if None
         """
         loss_dict = {}
         metric_dict = {}
@@ -529,8 +705,18 @@ class HOMan(nn.Module):
         # coarse interaction loss simply in translation
         verts_hand, verts_hand_det = self.get_verts_hand()
         verts_hand_det_scale, _ = self.get_verts_hand(detach_scale=True)
+        faces_object = self.faces_object
+        verts_object_s = verts_object
+        verts_hand_det_scale_s = verts_hand_det_scale
+        if frame_idxs is not None:
+            hand_rows = (frame_idxs[:, None] * self.hand_nb + torch.arange(
+                self.hand_nb, device=frame_idxs.device)[None]).view(-1)
+            faces_object = faces_object[:len(frame_idxs)]
+            verts_object_s = verts_object[frame_idxs]
+            verts_hand_det_scale_s = verts_hand_det_scale[hand_rows]
         if loss_weights is None or loss_weights["lw_pca"] > 0:
-            loss_pca = lossutils.compute_pca_loss(self.mano_pca_pose)
+            loss_pca = lossutils.compute_pca_loss(
+                self.get_pose("mano_pca_pose"))
             loss_dict.update(loss_pca)
         if loss_weights is None or ((loss_weights["lw_smooth_hand"] > 0) or
                                     (loss_weights["lw_smooth_obj"] > 0)):
@@ -542,17 +728,17 @@ class HOMan(nn.Module):
         if loss_weights is None or loss_weights["lw_collision"] > 0:
             # Pushes hand out of object, gradient not flowing through object !
             loss_coll = lossutils.compute_collision_loss(
-                verts_hand=verts_hand_det_scale,
-                verts_object=verts_object.detach(),
-                faces_object=self.faces_object,
+                verts_hand=verts_hand_det_scale_s,
+                verts_object=verts_object_s.detach(),
+                faces_object=faces_object,
                 faces_hand=self.faces_hand)
             loss_dict.update(loss_coll)
 
         if loss_weights is None or loss_weights["lw_contact"] > 0:
             loss_contact, _ = lossutils.compute_contact_loss(
-                verts_hand_b=verts_hand_det_scale,
-                verts_object_b=verts_object,
-                faces_object=self.faces_object,
+                verts_hand_b=verts_hand_det_scale_s,
+                verts_object_b=verts_object_s,
+                faces_object=faces_object,
                 faces_hand=self.faces_hand)
             loss_dict.update(loss_contact)
         if loss_weights is None or loss_weights["lw_v2d_hand"] > 0:
@@ -570,7 +756,9 @@ class HOMan(nn.Module):
             metric_dict.update(metric_verts2d)
         if loss_weights is None or loss_weights["lw_sil_obj"] > 0:
             sil_loss_dict, sil_metric_dict = self.losses.compute_sil_loss_object(
-                verts=verts_object, faces=self.faces_object)
+                verts=verts_object_s,
+                faces=faces_object,
+                frame_idxs=frame_idxs)
             loss_dict.update(sil_loss_dict)
             metric_dict.update(sil_metric_dict)
 
@@ -603,38 +791,65 @@ class HOMan(nn.Module):
                     intrinsic_mean=self.int_scale_hand_mean,
                 )
         if loss_weights is None or loss_weights["lw_depth"] > 0:
-            loss_dict.update(lossutils.compute_ordinal_depth_loss())
+            loss_dict.update(self.compute_ordinal_depth_loss())
         return loss_dict, metric_dict
 
-    def render_limem(self,
-                     renderer,
+    def compute_frame_losses(self, loss_weights=None):
+        """
+        Returns:
+            frame_losses (torch.Tensor): (batch_size, ) weighted object
+                silhouette and hand 2D vertex losses of each frame, the
+                per-frame terms of forward()
+        """
+        verts_object, _ = self.get_verts_object()
+        verts_hand, _ = self.get_verts_hand()
+        frame_losses = verts_object.new_zeros(self.batch_size)
+        if loss_weights is None or loss_weights["lw_sil_obj"] > 0:
+            lw_sil = 1 if loss_weights is None else loss_weights["lw_sil_obj"]
+            frame_losses += lw_sil * self.losses.compute_frame_sil_loss_object(
+                verts_object, self.faces_object)
+        if loss_weights is None or loss_weights["lw_v2d_hand"] > 0:
+            lw_v2d = 1 if loss_weights is None else loss_weights["lw_v2d_hand"]
+            loss_v2d = self.losses.compute_frame_verts2d_loss_hand(
+                verts_hand, image_size=self.image_size)
+            frame_losses += lw_v2d * loss_v2d.view(self.batch_size,
+                                                   self.hand_nb).mean(1)
+        return frame_losses
+
+    @staticmethod
+    def render_limem(renderer,
                      verts,
                      faces,
                      textures,
                      K,
-                     max_in_batch=5):
+                     max_in_batch=None,
+                     mem_budget=RENDER_MEM_BUDGET):
+        """
+        Renders verts in chunks, of max_in_batch samples if provided, else
+        sized by get_render_chunk_size() to fit in mem_budget.
+
+        faces and textures can have a batch dimension of 1, they are then
+        shared across all samples and only expanded for the current chunk.
+        """
         sample_nb = verts.shape[0]
         check_shape(verts, (-1, -1, 3))
-        check_shape(faces, (sample_nb, -1, 3))
-        check_shape(textures, (sample_nb, -1, 1, 1, 1, 3))
+        check_shape(faces, (-1, -1, 3))
+        check_shape(textures, (-1, faces.shape[1], 1, 1, 1, 3))
         check_shape(K, (sample_nb, 3, 3))
 
-        if max_in_batch is not None:
-            chunk_nb = (sample_nb + 1) // min(max_in_batch, sample_nb)
-        else:
-            chunk_nb = 1
-        verts_chunks = verts.chunk(chunk_nb, 0)
-        faces_chunks = faces.chunk(chunk_nb, 0)
-        textures_chunks = textures.chunk(chunk_nb, 0)
-        K_chunks = K.chunk(chunk_nb, 0)
+        if max_in_batch is None:
+            max_in_batch = get_render_chunk_size(renderer,
+                                                 faces.shape[1],
+                                                 mem_budget=mem_budget)
         all_images = []
         all_masks = []
-        for vert, face, tex, camintr in zip(verts_chunks, faces_chunks,
-                                            textures_chunks, K_chunks):
-            chunk_images, _, chunk_masks = renderer.render(vertices=vert,
-                                                           faces=face,
-                                                           textures=tex,
-                                                           K=camintr)
+        for start in range(0, sample_nb, max_in_batch):
+            end = min(start + max_in_batch, sample_nb)
+            chunk_images, _, chunk_masks = renderer.render(
+                vertices=verts[start:end],
+                faces=_batch_chunk(faces, start, end),
+                textures=_batch_chunk(textures, start, end),
+                K=K[start:end])
             all_images.append(
                 np.clip(npt.numpify(chunk_images).transpose(0, 2, 3, 1), 0, 1))
             all_masks.append(npt.numpify(chunk_masks).astype(bool))
@@ -642,22 +857,52 @@ class HOMan(nn.Module):
         all_masks = np.concatenate(all_masks)
         return all_images, all_masks
 
-    def render(self, renderer, rotate=False, viz_len=10, max_in_batch=None):
-        verts_object = self.get_verts_object()[0]
-        verts_hands = self.get_verts_hand()[0]
-        verts_hands = [
+    def get_render_inputs(self,
+                          verts_hand_gt=None,
+                          verts_object_gt=None,
+                          gt_only=False,
+                          init=False):
+        """
+        Vertices, faces and textures drawn by render (no ground truth),
+        render_gt (gt_only) and render_with_gt
+
+        Returns:
+            verts_combined (torch.Tensor): (batch_size, vert_nb, 3)
+            faces (torch.Tensor): (batch_size, face_nb, 3)
+            textures (torch.Tensor): (batch_size, face_nb, 1, 1, 1, 3)
+        """
+        if gt_only:
+            verts_combined = combine_verts([verts_object_gt, verts_hand_gt])
+            return verts_combined, self.faces, self.textures_gt
+        if init:
+            verts_object = self.verts_object_init
+            verts_hands = self.verts_hand_init
+        else:
+            verts_object = self.get_verts_object()[0]
+            verts_hands = self.get_verts_hand()[0]
+        verts_list = [verts_object] + [
             verts_hands[hand_idx::self.hand_nb]
             for hand_idx in range(self.hand_nb)
         ]
-        verts_combined = combine_verts([verts_object] + verts_hands)
+        if verts_hand_gt is None:
+            return combine_verts(verts_list), self.faces, self.textures
+        verts_list = verts_list + [verts_object_gt] + [
+            verts for verts in verts_hand_gt
+        ]
+        return (combine_verts(verts_list), self.faces_with_gt,
+                self.textures_with_gt)
+
+    def render(self, renderer, rotate=False, viz_len=10, max_in_batch=None):
+        verts_combined, faces, textures = self.get_render_inputs()
         if rotate:
             verts_combined = trans3d.rot_points(verts_combined)
         images, masks = self.render_limem(renderer,
                                           verts_combined[:viz_len],
-                                          self.faces[:viz_len],
-                                          self.textures[:viz_len],
+                                          faces[:1],
+                                          textures[:1],
                                           K=renderer.K[:viz_len],
-                                          max_in_batch=max_in_batch)
+                                          max_in_batch=max_in_batch,
+                                          mem_budget=self.render_mem_budget)
         return images, masks
 
     def render_gt(self,
@@ -667,16 +912,19 @@ class HOMan(nn.Module):
                   rotate=False,
                   viz_len=10,
                   max_in_batch=None):
-        verts_list = [verts_object_gt, verts_hand_gt]
-        verts_combined = combine_verts(verts_list)
+        verts_combined, faces, textures = self.get_render_inputs(
+            verts_hand_gt=verts_hand_gt,
+            verts_object_gt=verts_object_gt,
+            gt_only=True)
         if rotate:
             verts_combined = trans3d.rot_points(verts_combined)
         images, masks = self.render_limem(renderer,
                                           verts_combined[:viz_len],
-                                          self.faces[:viz_len],
-                                          self.textures_gt[:viz_len],
+                                          faces[:1],
+                                          textures[:1],
                                           K=renderer.K[:viz_len],
-                                          max_in_batch=max_in_batch)
+                                          max_in_batch=max_in_batch,
+                                          mem_budget=self.render_mem_budget)
         return images, masks
 
     def render_with_gt(self,
@@ -687,28 +935,19 @@ class HOMan(nn.Module):
                        viz_len=10,
                        init=False,
                        max_in_batch=None):
-        if init:
-            verts_object_pred = self.verts_object_init
-            verts_hands = self.verts_hand_init
-        else:
-            verts_object_pred = self.get_verts_object()[0]
-            verts_hands = self.get_verts_hand()[0]
-        verts_hands_pred = [
-            verts_hands[hand_idx::self.hand_nb]
-            for hand_idx in range(self.hand_nb)
-        ]
-        verts_hands_gt = [verts for verts in verts_hand_gt]
-        verts_list = [verts_object_pred
-                      ] + verts_hands_pred + [verts_object_gt] + verts_hands_gt
-        verts_combined = combine_verts(verts_list)
+        verts_combined, faces, textures = self.get_render_inputs(
+            verts_hand_gt=verts_hand_gt,
+            verts_object_gt=verts_object_gt,
+            init=init)
         if rotate:
             verts_combined = trans3d.rot_points(verts_combined)
         images, masks = self.render_limem(renderer,
                                           verts_combined[:viz_len],
-                                          self.faces_with_gt[:viz_len],
-                                          self.textures_with_gt[:viz_len],
+                                          faces[:1],
+                                          textures[:1],
                                           K=renderer.K[:viz_len],
-                                          max_in_batch=max_in_batch)
+                                          max_in_batch=max_in_batch,
+                                          mem_budget=self.render_mem_budget)
         return images, masks
 
     def save_obj(self, fname):
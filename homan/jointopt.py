@@ -15,9 +15,55 @@ from tqdm.auto import tqdm
 from libyana.conversions import npt
 from libyana.vidutils import np2vid
 
+from homan.activeset import FrameActiveSet
 from homan.homan import HOMan
+from homan.prepare import warmstart
 from homan.visualize import visualize_hand_object
 
+# Hand pose parameters, frozen in stages mimicking optimize_hand_pose=False
+HAND_POSE_PARAMS = ["translations_hand", "rotations_hand", "int_scales_hand"]
+
+
+def get_stages(stages, num_iterations, loss_weights, lr):
+    """
+    Fills the stage defaults from the optimize_hand_object() arguments
+
+    Args:
+        stages (list): [{"num_iterations": int, "loss_weights": dict of
+            overriden loss weights, "lr": float, "frozen": list of frozen
+            parameter names}, ...], single stage if None
+    """
+    if stages is None:
+        stages = [{}]
+    stage_start = 0
+    full_stages = []
+    for stage in stages:
+        full_stage = {
+            "start": stage_start,
+            "num_iterations": stage.get("num_iterations", num_iterations),
+            "loss_weights": dict(loss_weights, **stage.get("loss_weights",
+                                                           {})),
+            "lr": stage.get("lr", lr),
+            "frozen": stage.get("frozen", []),
+        }
+        stage_start += full_stage["num_iterations"]
+        full_stages.append(full_stage)
+    return full_stages
+
+
+def set_stage(stage, optimizer, trainable_parameters):
+    """ Updates the learning rates and frozen parameters for stage, keeping
+    the optimizer state of the other parameters
+    """
+    for group in optimizer.param_groups:
+        group["lr"] = stage["lr"] * group["lr_mult"]
+    for key, val in trainable_parameters.items():
+        # Keyframe parameters are frozen as their per-frame parameters
+        frozen = key.split(".")[-1] in stage["frozen"]
+        val.requires_grad = not frozen
+        if frozen:
+            val.grad = None
+
 
 def optimize_hand_object(
     person_parameters,
@@ -41,11 +87,38 @@ def optimize_hand_object(
     viz_len=7,
     image_size=640,
     optimize_hand_pose=True,  # introduced for arctic gt hand
+    warm_start=None,
+    boundary=None,
+    keyframe_step=None,
+    sample_frame_nb=None,
+    active_set_check_every=None,
+    active_set_tol=1e-3,
+    active_set_recheck_every=5,
+    stages=None,
 ):
     """
     Arguments:
         fps (int): frames per second for video visualization
         viz_len (int): number of frames to show
+        warm_start (dict): poses of already fitted frames, output of
+            warmstart.WarmStartCache.get()
+        boundary (dict): poses of frames shared with a previously fitted
+            window (same format as warm_start), kept close to them with
+            weight loss_weights["lw_boundary"]
+        keyframe_step (int): if provided, only the poses of one frame every
+            keyframe_step (and of the last frame) are optimized, the other
+            frames are interpolated
+        sample_frame_nb (int): if provided, number of frames randomly
+            sampled at each step on which the object silhouette, collision
+            and contact losses are computed
+        active_set_check_every (int): if provided, frames whose silhouette
+            and 2D vertex losses changed by less than active_set_tol
+            (relative) over active_set_check_every steps are frozen, and
+            reactivated every active_set_recheck_every checks (see
+            activeset.FrameActiveSet)
+        stages (list): successive optimization stages run on the same model
+            and optimizer (see get_stages), overriding num_iterations, lr
+            and loss_weights. Single stage if None
     """
     if viz_folder is not None:
         os.makedirs(viz_folder, exist_ok=True)
@@ -128,6 +201,22 @@ def optimize_hand_object(
     # Resume from state_dict if provided
     if state_dict is not None:
         model.load_state_dict(state_dict, strict=False)
+    if warm_start is not None:
+        warmstart.apply_warm_start(model, warm_start)
+    frame_nb = len(object_parameters)
+    if keyframe_step:
+        keyframe_idxs = sorted(
+            set(range(0, frame_nb, keyframe_step)) | {frame_nb - 1})
+        model.set_keyframes(keyframe_idxs)
+    active_set = None
+    if active_set_check_every:
+        if keyframe_step:
+            raise ValueError(
+                "Frame active sets are not supported with keyframes")
+        active_set = FrameActiveSet(frame_nb,
+                                    check_every=active_set_check_every,
+                                    tol=active_set_tol,
+                                    recheck_every=active_set_recheck_every)
     rigid_parameters = [
         val for key, val in model.named_parameters()
         if "mano" not in key and "rotation" not in key
@@ -138,27 +227,42 @@ def optimize_hand_object(
         val for key, val in model.named_parameters()
         if ("rotation" in key) and ("mano" not in key)
     ]
+    mano_parameters = [
+        val for key, val in model.named_parameters()
+        if key.endswith("mano_pca_pose") or key == "mano_betas"
+    ]
     optimizer = torch.optim.Adam([{
         "params": rigid_parameters,
-        "lr": lr
+        "lr": lr,
+        "lr_mult": 1
     }, {
-        "params": [
-            model.mano_pca_pose,
-            model.mano_betas,
-        ],
-        "lr":
-        lr * 10
+        "params": mano_parameters,
+        "lr": lr * 10,
+        "lr_mult": 10
     }, {
         "params": rotation_parameters,
-        "lr": lr * 10
+        "lr": lr * 10,
+        "lr_mult": 10
     }])
     # optimizer = torch.optim.Adam(parameters, lr=lr)
-    loop = tqdm(range(num_iterations))
+    trainable_parameters = {
+        key: val
+        for key, val in model.named_parameters() if val.requires_grad
+    }
+    stages = get_stages(stages, num_iterations, loss_weights, lr)
+    stage_starts = {
+        stage["start"]: stage
+        for stage in stages if stage["num_iterations"]
+    }
+    loop = tqdm(range(sum(stage["num_iterations"] for stage in stages)))
     loss_evolution = defaultdict(list)
 
     imgs = OrderedDict()
     optim_imgs = []
     for step in loop:
+        if step in stage_starts:
+            set_stage(stage_starts[step], optimizer, trainable_parameters)
+            loss_weights = stage_starts[step]["loss_weights"]
         if viz_folder is not None and step % viz_step == 0:
             with torch.no_grad():
                 frontal, top_down = visualize_hand_object(model,
@@ -179,7 +283,27 @@ def optimize_hand_object(
             optim_imgs.append(front_top)
             print(f"Saved rendered image to {front_top_path}.")
         optimizer.zero_grad()
-        loss_dict, metric_dict = model(loss_weights=loss_weights)
+        frame_idxs = None
+        if active_set is not None:
+            active_set.update(step, model, loss_weights=loss_weights)
+            if not active_set.active.any():
+                # All frames converged, wait for the next reactivation
+                continue
+            if not active_set.active.all():
+                frame_idxs = active_set.active_idxs()
+        if sample_frame_nb:
+            if frame_idxs is None:
+                frame_idxs = torch.arange(frame_nb)
+            if sample_frame_nb < len(frame_idxs):
+                frame_idxs = frame_idxs[torch.randperm(
+                    len(frame_idxs))[:sample_frame_nb].sort()[0]]
+        if frame_idxs is not None:
+            frame_idxs = frame_idxs.cuda()
+        loss_dict, metric_dict = model(loss_weights=loss_weights,
+                                       frame_idxs=frame_idxs)
+        if boundary is not None:
+            loss_dict["loss_boundary"] = warmstart.compute_warm_start_loss(
+                model, boundary)
         loss_dict_weighted = {
             k: loss_dict[k] * loss_weights[k.replace("loss", "lw")]
             for k in loss_dict
@@ -192,7 +316,15 @@ def optimize_hand_object(
         loss_evolution["loss"].append(loss.item())
         loop.set_description(f"Loss {loss.item():.4f}")
         loss.backward()
-        optimizer.step()
+        if active_set is not None:
+            frozen = active_set.freeze(model)
+            optimizer.step()
+            active_set.restore(frozen)
+        else:
+            optimizer.step()
+    for val in trainable_parameters.values():
+        val.requires_grad = True
+    model.bake_keyframes()
     if viz_folder is not None:
         optim_imgs = [optim_imgs[0] for _ in range(30)
                       ] + optim_imgs + [optim_imgs[-1] for _ in range(50)]
@@ -203,3 +335,140 @@ def optimize_hand_object(
         # np2vid.make_video(optim_imgs, video_path, fps=fps)
         np2vid.make_video(optim_imgs, video_path.replace(".webm", ".mp4"), fps=fps)
     return model, dict(loss_evolution), imgs
+
+
+def get_windows(frame_nb, window_size, window_overlap):
+    """
+    Returns:
+        windows (list): (start, end) frame ranges of window_size frames
+            covering frame_nb frames, consecutive windows sharing
+            window_overlap frames
+    """
+    if frame_nb <= window_size:
+        return [(0, frame_nb)]
+    if not 0 <= window_overlap < window_size:
+        raise ValueError(f"window_overlap {window_overlap} should be in "
+                         f"[0, window_size {window_size}[")
+    stride = window_size - window_overlap
+    starts = list(range(0, frame_nb - window_size, stride))
+    starts.append(frame_nb - window_size)
+    return [(start, start + window_size) for start in starts]
+
+
+def _slice_frames(vals, start, end, frame_nb):
+    # Per-frame inputs are sliced, shared ones (e.g. a single object mesh)
+    # are kept
+    if vals is None or len(vals) != frame_nb:
+        return vals
+    return vals[start:end]
+
+
+def _blend_frame_states(prev_state, next_state, alpha):
+    return {
+        key: (1 - alpha) * prev_state[key] + alpha * next_state[key]
+        if key != "hand_sides" else next_state[key]
+        for key in next_state
+    }
+
+
+def optimize_hand_object_windowed(person_parameters,
+                                  object_parameters,
+                                  objvertices=None,
+                                  objfaces=None,
+                                  images=None,
+                                  camintr=None,
+                                  loss_weights=None,
+                                  window_size=32,
+                                  window_overlap=8,
+                                  lw_boundary=1000,
+                                  warm_start=None,
+                                  **kwargs):
+    """
+    Runs optimize_hand_object() on overlapping windows of window_size
+    frames, so that the optimization memory does not depend on the sequence
+    length. Each window starts from the poses fitted by the previous one on
+    their shared frames, which are softly constrained to these poses
+    (lw_boundary). The fitted poses of shared frames are then cross-faded
+    from the previous window to the next one.
+
+    Arguments:
+        window_size (int): frames optimized jointly
+        window_overlap (int): frames shared by consecutive windows
+        warm_start (dict): poses of already fitted frames of the whole
+            sequence, output of warmstart.WarmStartCache.get()
+        kwargs: optimize_hand_object() arguments
+    Returns:
+        model (HOMan): model of the whole sequence with the stitched poses
+        loss_evolution (dict): losses of the successive windows
+        imgs (dict): empty, no intermediate visualization is rendered
+    """
+    frame_nb = len(object_parameters)
+    hand_nb = len(person_parameters[0]["hand_side"])
+    window_loss_weights = dict(loss_weights, lw_boundary=lw_boundary)
+    kwargs["viz_folder"] = None
+
+    init_states = {}
+    if warm_start is not None:
+        init_states = warmstart.unstack_frame_states(warm_start)
+    fitted_states = {}
+    loss_evolution = defaultdict(list)
+    for start, end in get_windows(frame_nb, window_size, window_overlap):
+        shared_idxs = [idx for idx in range(start, end) if idx in fitted_states]
+        init_idxs = [
+            idx for idx in range(start, end)
+            if idx in fitted_states or idx in init_states
+        ]
+        window_warm_start = None
+        if init_idxs:
+            window_warm_start = warmstart.stack_frame_states(
+                [fitted_states.get(idx, init_states.get(idx))
+                 for idx in init_idxs], [idx - start for idx in init_idxs],
+                hand_nb)
+        boundary = None
+        if shared_idxs:
+            boundary = warmstart.stack_frame_states(
+                [fitted_states[idx] for idx in shared_idxs],
+                [idx - start for idx in shared_idxs], hand_nb)
+        model, window_losses, _ = optimize_hand_object(
+            person_parameters[start:end],
+            object_parameters[start:end],
+            objvertices=_slice_frames(objvertices, start, end, frame_nb),
+            objfaces=_slice_frames(objfaces, start, end, frame_nb),
+            images=_slice_frames(images, start, end, frame_nb),
+            camintr=_slice_frames(camintr, start, end, frame_nb),
+            loss_weights=window_loss_weights,
+            warm_start=window_warm_start,
+            boundary=boundary,
+            **kwargs)
+        for key, vals in window_losses.items():
+            loss_evolution[key].extend(vals)
+        window_states = warmstart.get_frame_states(model)
+        # Free the window before building the next one
+        del model
+        for idx, frame_state in zip(range(start, end), window_states):
+            if idx in fitted_states:
+                alpha = (shared_idxs.index(idx) + 1) / (len(shared_idxs) + 1)
+                frame_state = _blend_frame_states(fitted_states[idx],
+                                                  frame_state, alpha)
+            fitted_states[idx] = frame_state
+
+    # Gather the stitched poses without optimizing
+    kwargs["num_iterations"] = 0
+    kwargs["stages"] = None
+    # The stitched poses of all frames are kept as is, not re-interpolated
+    kwargs["keyframe_step"] = None
+    kwargs["sample_frame_nb"] = None
+    kwargs["active_set_check_every"] = None
+    model, _, imgs = optimize_hand_object(
+        person_parameters,
+        object_parameters,
+        objvertices=objvertices,
+        objfaces=objfaces,
+        images=images,
+        camintr=camintr,
+        loss_weights=loss_weights,
+        warm_start=warmstart.stack_frame_states(
+            [fitted_states[idx] for idx in range(frame_nb)],
+            list(range(frame_nb)), hand_nb),
+        **kwargs)
+    return model, dict(loss_evolution), imgs
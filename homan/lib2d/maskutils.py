@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+
+import numpy as np
 import torch
 
 from detectron2.structures import BitMasks
@@ -12,6 +14,87 @@ from libyana.lib3d import kcrop
 from homan.utils.bbox import bbox_wh_to_xy, make_bbox_square, bbox_xy_to_wh
 from homan.constants import REND_SIZE
 
+# Tri-state target masks are stored as int8 with these values, and only
+# converted to float inside the losses
+MASK_OCCLUDED = -1
+MASK_BACKGROUND = 0
+MASK_FOREGROUND = 1
+
+
+def pack_bits(mask):
+    """
+    Args:
+        mask (np.ndarray): boolean mask of any shape
+    Returns:
+        (np.ndarray): uint8 array with 8 mask pixels per byte
+    """
+    return np.packbits(np.asarray(mask, dtype=bool), axis=None)
+
+
+def unpack_bits(packed, shape):
+    """ Inverse of pack_bits() """
+    size = int(np.prod(shape))
+    return np.unpackbits(packed, count=size).astype(bool).reshape(shape)
+
+
+def crop_and_resize(masks, boxes, mask_size=REND_SIZE):
+    """
+    Crops masks[i] in boxes[i] for all masks with a single ROIAlign call,
+    as BitMasks.crop_and_resize
+
+    Args:
+        masks (torch.Tensor): [N, H, W] boolean masks
+        boxes (torch.Tensor): [N, 4] xyxy boxes
+    Returns:
+        torch.Tensor: [N, mask_size, mask_size] boolean masks
+    """
+    if len(masks) == 0:
+        return masks.new_zeros((0, mask_size, mask_size), dtype=torch.bool)
+    return BitMasks(masks).crop_and_resize(boxes.to(masks.device), mask_size)
+
+
+def add_occlusions_batch(masks, occluder_masks, mask_bboxes):
+    """
+    Occlusion-aware target masks for all frames of a clip, all occluders
+    are cropped at once and combined per frame with tensor ops.
+
+    Args:
+        masks (list[np.ndarray]): B object masks [(REND_SIZE, REND_SIZE), ...]
+        occluder_masks (list[torch.Tensor]): B [K_b, IMAGE_SIZE, IMAGE_SIZE]
+            occluders of each mask
+        mask_bboxes (list[np.ndarray]): B square xy_wh bboxes [(4,), ...]
+    Returns:
+        list[np.ndarray]: int8 [(REND_SIZE, REND_SIZE), ...] masks with
+            MASK_OCCLUDED, MASK_BACKGROUND and MASK_FOREGROUND values
+    """
+    device = occluder_masks[0].device
+    occluder_nbs = torch.tensor([len(occl) for occl in occluder_masks],
+                                device=device)
+    bboxes = bbox_wh_to_xy(
+        torch.Tensor(np.stack([np.asarray(bbox)
+                               for bbox in mask_bboxes]))).to(device)
+    occlusions = crop_and_resize(
+        torch.cat(list(occluder_masks)),
+        bboxes.repeat_interleave(occluder_nbs, 0), REND_SIZE)
+    # Any occluder of each frame
+    frame_idxs = torch.arange(len(masks),
+                              device=device).repeat_interleave(occluder_nbs)
+    occluded = torch.zeros(len(masks),
+                           REND_SIZE,
+                           REND_SIZE,
+                           dtype=torch.int32,
+                           device=device).index_add_(0, frame_idxs,
+                                                     occlusions.int()) > 0
+
+    masks = torch.as_tensor(np.stack([np.asarray(mask) for mask in masks]),
+                            device=device) > 0
+    with_occlusions = masks.to(torch.int8)
+    # Remove occlusions
+    with_occlusions[occluded] = MASK_OCCLUDED
+    # Draw back original object mask in case it was removed by occlusions
+    with_occlusions[masks] = MASK_FOREGROUND
+    return list(npt.numpify(with_occlusions))
+
 
 def add_occlusions(masks, occluder_mask, mask_bboxes):
     """
@@ -21,61 +104,86 @@ def add_occlusions(masks, occluder_mask, mask_bboxes):
         occluder_mask (torch.Tensor): [B, IMAGE_SIZE, IMAGE_SIZE] occluder where B
             dim aggregates different one-hot encodings of occluder
             masks
+    Returns:
+        list[np.ndarray]: int8 [(REND_SIZE, REND_SIZE), ...] masks with
+            MASK_OCCLUDED, MASK_BACKGROUND and MASK_FOREGROUND values
     """
-    occluded_masks = []
-    for mask, mask_bbox in zip(masks, mask_bboxes):
-        bbox_mask = bbox_wh_to_xy(torch.Tensor(mask_bbox).unsqueeze(0)).to(
-            occluder_mask.device)
-        occlusions = BitMasks(occluder_mask).crop_and_resize(
-            bbox_mask.repeat(occluder_mask.shape[0], 1), REND_SIZE)
-        # Remove occlusions
-        with_occlusions = occluder_mask.new(mask).float()
-        with_occlusions[occlusions.sum(0) > 0] = -1
-
-        # Draw back original object mask in case it was removed by occlusions
-        with_occlusions[mask] = 1
-        occluded_masks.append(npt.numpify(with_occlusions))
-    return occluded_masks
+    return add_occlusions_batch(masks, [occluder_mask] * len(masks),
+                                mask_bboxes)
 
 
-def add_target_hand_occlusions(person_parameters,
-                               object_parameters,
-                               K,
-                               square_expand=0,
-                               sample_folder=None,
-                               debug=True):
+def add_target_hand_occlusions_batch(all_person_parameters,
+                                     all_object_parameters,
+                                     Ks,
+                                     square_expand=0,
+                                     sample_folder=None,
+                                     debug=True):
     """
+    add_target_hand_occlusions() for all frames of a clip, with one crop
+    for all hand masks and one for all object masks.
+
     Args:
-        person_parameters (dict): {"bboxes": square xyxy bboxes, "masks", [B, IMAGE_SIZE, IMAGE_SIZE]}
-        object_parameters (dict): {masks", [B, IMAGE_SIZE, IMAGE_SIZE]}
+        all_person_parameters (list[dict]): per frame person_parameters
+        all_object_parameters (list[dict]): per frame object_parameters
+        Ks (list[np.ndarray]): per frame (3, 3) intrinsics
     """
-    person_masks = BitMasks(person_parameters['masks'])
+    hand_nbs = [params["bboxes"].shape[0] for params in all_person_parameters]
 
     # Expand box and bring back to model
-    tight_boxes = person_parameters["bboxes"]
-    batch_size = tight_boxes.shape[0]
+    tight_boxes = torch.cat(
+        [params["bboxes"] for params in all_person_parameters])
     person_boxes = bbox_wh_to_xy(
         make_bbox_square(bbox_xy_to_wh(tight_boxes),
                          bbox_expansion=square_expand))
     person_boxes = tight_boxes.new(person_boxes)
-    target_masks = person_masks.crop_and_resize(person_boxes,
-                                                REND_SIZE).float()
-    object_masks = BitMasks(object_parameters['full_mask'].repeat(
-        batch_size, 1, 1)).crop_and_resize(person_boxes, REND_SIZE)
-    target_masks[object_masks > 0] = -1
+    person_masks = torch.cat(
+        [params["masks"] for params in all_person_parameters])
+    target_masks = crop_and_resize(person_masks, person_boxes,
+                                   REND_SIZE).to(torch.int8)
+    object_masks = torch.cat([
+        obj_params['full_mask'].repeat(hand_nb, 1, 1) for obj_params, hand_nb
+        in zip(all_object_parameters, hand_nbs)
+    ])
+    object_masks = crop_and_resize(object_masks, person_boxes, REND_SIZE)
+    target_masks[object_masks > 0] = MASK_OCCLUDED
     # Compute corresponding K_roi
-    K_roi = kcrop.get_K_crop_resize(
-        person_boxes.new(K).unsqueeze(0).repeat(batch_size, 1, 1),
-        person_boxes, [
-            REND_SIZE,
-        ] * batch_size)
+    K_rep = np.concatenate([
+        np.tile(npt.numpify(K)[None], (hand_nb, 1, 1))
+        for K, hand_nb in zip(Ks, hand_nbs)
+    ])
+    K_roi = kcrop.get_K_crop_resize(person_boxes.new(K_rep), person_boxes, [
+        REND_SIZE,
+    ] * len(person_boxes))
+    # Bring crop K to NC rendering space
+    K_roi[:, :2] = K_roi[:, :2] / REND_SIZE
+
+    for params, frame_target_masks, frame_K_roi, frame_boxes in zip(
+            all_person_parameters, target_masks.split(hand_nbs),
+            K_roi.split(hand_nbs), person_boxes.split(hand_nbs)):
+        # Copies, so that pickling a frame does not save the whole clip
+        params['K_roi'] = frame_K_roi.clone()
+        params['target_masks'] = frame_target_masks.clone()
+        params['square_bboxes'] = frame_boxes.clone()
     if debug:
-        imagify.viz_imgrow(target_masks,
+        imagify.viz_imgrow(all_person_parameters[-1]['target_masks'].float(),
                            os.path.join(sample_folder, "tmpoccl.png"))
         print(f"Saving occlusion masks to {sample_folder}/tmpoccl.png")
-    # Bring crop K to NC rendering space
-    K_roi[:, :2] = K_roi[:, :2] / REND_SIZE
-    person_parameters['K_roi'] = K_roi
-    person_parameters['target_masks'] = target_masks
-    person_parameters['square_bboxes'] = person_boxes
-    return person_parameters
+    return all_person_parameters
+
+
+def add_target_hand_occlusions(person_parameters,
+                               object_parameters,
+                               K,
+                               square_expand=0,
+                               sample_folder=None,
+                               debug=True):
+    """
+    Args:
+        person_parameters (dict): {"bboxes": square xyxy bboxes, "masks", [B, IMAGE_SIZE, IMAGE_SIZE]}
+        object_parameters (dict): {masks", [B, IMAGE_SIZE, IMAGE_SIZE]}
+    """
+    return add_target_hand_occlusions_batch([person_parameters],
+                                            [object_parameters], [K],
+                                            square_expand=square_expand,
+                                            sample_folder=sample_folder,
+                                            debug=debug)[0]
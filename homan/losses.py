@@ -163,6 +163,14 @@ class Losses():
             "v2d_hand": verts2d_dist.item()
         }
 
+    def compute_frame_verts2d_loss_hand(self, verts, image_size=640):
+        """ (batch_size * hand_nb, ) 2D vertex loss of each hand """
+        camintr = self.camintr.unsqueeze(1).repeat(1, self.hand_nb, 1,
+                                                   1).view(-1, 3, 3)
+        pred_verts_proj = project.batch_proj2d(verts, camintr)
+        tar_verts = self.ref_verts2d_hand / image_size
+        return ((pred_verts_proj - tar_verts)**2).sum(-1).mean(-1)
+
     def compute_sil_loss_hand(self, verts, faces):
         loss_sil = torch.Tensor([0.0]).float().cuda()
         for i in range(len(verts)):
@@ -174,28 +182,56 @@ class Losses():
                 faces[i],
                 K=camintr.unsqueeze(0),
                 mode="silhouettes")
-            image = self.keep_mask_hand[i] * rend
-            l_m = torch.sum((image - self.ref_mask_hand[i])**
-                            2) / self.keep_mask_hand[i].sum()
+            keep_mask = self.keep_mask_hand[i].float()
+            image = keep_mask * rend
+            l_m = torch.sum((image - self.ref_mask_hand[i].float())**
+                            2) / keep_mask.sum()
             loss_sil += l_m
         return {"loss_sil_hand": loss_sil / len(verts)}
 
-    def compute_sil_loss_object(self, verts, faces):
+    def compute_sil_loss_object(self, verts, faces, frame_idxs=None):
+        """
+        Args:
+            frame_idxs (torch.Tensor): frames of verts and faces, all frames
+                if None
+        """
         loss_sil = torch.Tensor([0.0]).float().cuda()
         # Rendering happens in ROI
         camintr = self.camintr_rois_object
+        keep_mask = self.keep_mask_object
+        ref_mask = self.ref_mask_object
+        if frame_idxs is not None:
+            camintr = camintr[frame_idxs]
+            keep_mask = keep_mask[frame_idxs]
+            ref_mask = ref_mask[frame_idxs]
         rend = self.renderer(verts, faces, K=camintr, mode="silhouettes")
-        image = self.keep_mask_object * rend
-        l_m = torch.sum(
-            (image - self.ref_mask_object)**2) / self.keep_mask_object.sum()
+        keep_mask = keep_mask.float()
+        ref_mask = ref_mask.float()
+        image = keep_mask * rend
+        l_m = torch.sum((image - ref_mask)**2) / keep_mask.sum()
         loss_sil += l_m
-        ious = batch_mask_iou(image, self.ref_mask_object)
+        ious = batch_mask_iou(image, ref_mask)
+        loss_sil = loss_sil / len(verts)
+        if frame_idxs is not None:
+            # Same scale as the loss over all frames
+            loss_sil = loss_sil * len(frame_idxs) / len(self.ref_mask_object)
         return {
-            "loss_sil_obj": loss_sil / len(verts)
+            "loss_sil_obj": loss_sil
         }, {
             'iou_object': ious.mean().item()
         }
 
+    def compute_frame_sil_loss_object(self, verts, faces):
+        """ (batch_size, ) silhouette loss of each frame """
+        rend = self.renderer(verts,
+                             faces,
+                             K=self.camintr_rois_object,
+                             mode="silhouettes")
+        keep_mask = self.keep_mask_object.float()
+        image = keep_mask * rend
+        l_m = ((image - self.ref_mask_object.float())**2).sum((1, 2))
+        return l_m / keep_mask.sum((1, 2)).clamp(min=1)
+
     def compute_interaction_loss(self, verts_hand_b, verts_object_b):
         """
         Computes interaction loss.
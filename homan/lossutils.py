@@ -8,7 +8,6 @@ import torch
 from homan.interactions import contactloss, scenesdf
 
 import trimesh
-from libyana.visutils import imagify
 
 # MANO_CLOSED_FACES = np.array(
 #     trimesh.load("extra_data/mano/closed_fmano.obj", process=False).faces)
@@ -137,19 +136,14 @@ def compute_ordinal_depth_loss(masks, silhouettes, depths):
         silhouettes (list[torch.Tensor]): [(B, height, width), ...] of len obj_nb
         depths (list[torch.Tensor]): [(B, height, width), ...] of len obj_nb
     """
-    loss = torch.Tensor(0.0).float().cuda()
+    loss = depths[0].new_zeros(())
     num_pairs = 0
     # Create square mask to match square renders
     height = masks.shape[2]
     width = masks.shape[3]
+    masks = masks.bool()
     silhouettes = [silh[:, :height, :width] for silh in silhouettes]
     depths = [depth[:, :height, :width] for depth in depths]
-    # TODO comment
-    imagify.viz_imgrow([
-        masks[0].sum(0), silhouettes[0][0], masks[0][0], silhouettes[1][0],
-        masks[0][1], silhouettes[2][0]
-    ], "tmpdebugsilor.png")
-    imagify.viz_imgrow(depths[0], "tmpdebugdepths.png")
     for i in range(len(silhouettes)):
         for j in range(len(silhouettes)):
             has_pred = silhouettes[i] & silhouettes[j]
@@ -165,5 +159,6 @@ def compute_ordinal_depth_loss(masks, silhouettes, depths):
             dists = torch.clamp(depths[i] - depths[j], min=0.0, max=2.0)
             loss += torch.sum(
                 torch.log(1 + torch.exp(dists))[mask]) / mask.sum()
-    loss /= num_pairs
+    if num_pairs > 0:
+        loss = loss / num_pairs
     return {"loss_depth": loss}
@@ -9,7 +9,7 @@ import torch
 from detectron2.structures.masks import BitMasks
 
 from homan.constants import BODY_MOCAP_REGRESSOR_CKPT, BODY_MOCAP_SMPL_PATH, HAND_MOCAP_REGRESSOR_CKPT
-from homan.utils.nmr_renderer import OrthographicRenderer
+from homan.utils.nmr_renderer import get_renderer
 from homan.utils.bbox import bbox_xy_to_wh
 from homan.utils.camera import local_to_global_cam
 from handmocap.hand_mocap_api import HandMocap
@@ -34,16 +34,20 @@ def get_hand_detections(hand_detector, image):
 def process_handmocap_predictions(mocap_predictions,
                                   bboxes,
                                   image_size=640,
-                                  masks=None):
+                                  masks=None,
+                                  sort=True):
     """
     Rescales camera to follow HMR convention, and then computes the camera w.r.t. to
     image rather than local bounding box.
 
     Args:
-        mocap_predictions (list).
+        mocap_predictions (list): one prediction per box, possibly from
+            different frames
         bboxes (N x 4): Bounding boxes in xyxy format.
         image_size (int): Max dimension of image.
         masks (N x H x W): Bit mask of people.
+        sort (bool): sort hands from left to right, keep the input order
+            otherwise (e.g. when boxes come from several frames)
 
     Returns:
         dict {str: torch.cuda.FloatTensor}
@@ -53,9 +57,11 @@ def process_handmocap_predictions(mocap_predictions,
                 space (N x L x L).
             local_cams: Weak perspective camera relative to the bounding boxes (N x 3).
     """
-    max_dim = np.max(bbox_xy_to_wh(bboxes)[:, 2:], axis=1)
-    inds = np.argsort(
-        bboxes[:, 0])  # Sort from left to right to make debugging easy.
+    if sort:
+        inds = np.argsort(
+            bboxes[:, 0])  # Sort from left to right to make debugging easy.
+    else:
+        inds = np.arange(len(bboxes))
     if mocap_predictions is not None:
         verts = np.stack([p["pred_vertices_smpl"] for p in mocap_predictions])
         verts2d = np.stack(
@@ -70,12 +76,18 @@ def process_handmocap_predictions(mocap_predictions,
         # All faces are the same, so just need one copy.
         faces = np.expand_dims(mocap_predictions[0]["faces"].astype(np.int32),
                                0)
-        local_cams = []
-        for b, pred in zip(max_dim, mocap_predictions):
-            local_cam = pred["pred_camera"].copy()
-            local_cams.append(local_cam)
-        local_cams = np.stack(local_cams)
+        local_cams = np.stack(
+            [pred["pred_camera"] for pred in mocap_predictions])
         global_cams = local_to_global_cam(bboxes, local_cams, image_size)
+        # Per-prediction (1, D) MANO outputs -> (N, D)
+        hand_poses = np.concatenate(
+            [pred["pred_hand_pose"] for pred in mocap_predictions])
+        pca_poses = np.concatenate(
+            [pred["pred_pca_pose"] for pred in mocap_predictions])
+        hand_betas = np.concatenate(
+            [pred["pred_hand_betas"] for pred in mocap_predictions])
+        mano_trans = np.concatenate(
+            [npt.numpify(pred["mano_trans"]) for pred in mocap_predictions])
 
         person_parameters = {
             "bboxes": bboxes[inds].astype(np.float32),
@@ -85,16 +97,15 @@ def process_handmocap_predictions(mocap_predictions,
             "verts": verts[inds].astype(np.float32),
             "verts2d": verts2d[inds].astype(np.float32),
             "rotations": rotations[inds].astype(np.float32),
-            "mano_pose": pred["pred_hand_pose"][inds, 3:].astype(np.float32),
-            "mano_pca_pose": pred["pred_pca_pose"][inds].astype(np.float32),
-            "mano_rot": pred["pred_hand_pose"][inds, :3].astype(np.float32),
-            "mano_betas": pred["pred_hand_betas"][inds].astype(np.float32),
+            "mano_pose": hand_poses[inds, 3:].astype(np.float32),
+            "mano_pca_pose": pca_poses[inds].astype(np.float32),
+            "mano_rot": hand_poses[inds, :3].astype(np.float32),
+            "mano_betas": hand_betas[inds].astype(np.float32),
             # "rend": rends[inds].astype(np.float32),
-            "mano_trans":
-            npt.numpify(pred["mano_trans"][inds]).astype(np.float32),
+            "mano_trans": mano_trans[inds].astype(np.float32),
             "translations": translations[inds].astype(np.float32),
         }
-        person_parameters["hand_side"] = pred["hand_side"]
+        person_parameters["hand_side"] = mocap_predictions[-1]["hand_side"]
     else:
         person_parameters = {
             "bboxes": bboxes[inds].astype(np.float32),
@@ -113,6 +124,19 @@ def process_handmocap_predictions(mocap_predictions,
     return person_parameters
 
 
+def select_person_parameters(person_parameters, rows):
+    """ Keep the given rows of process_handmocap_predictions() outputs,
+    faces (shared by all hands) and labels are kept as is.
+    """
+    selected = {}
+    for key, val in person_parameters.items():
+        if isinstance(val, str) or key == "faces":
+            selected[key] = val
+        else:
+            selected[key] = val[rows]
+    return selected
+
+
 def process_mocap_predictions(mocap_predictions=None,
                               bboxes=None,
                               image_size=640,
@@ -180,7 +204,7 @@ def process_mocap_predictions(mocap_predictions=None,
 
 
 def visualize_orthographic(image, human_predictions):
-    ortho_renderer = OrthographicRenderer(image_size=max(image.shape))
+    ortho_renderer = get_renderer("ortho", image_size=max(image.shape))
     new_image = image.copy()
     verts = human_predictions["verts"]
     faces = human_predictions["faces"]
@@ -29,6 +29,8 @@ class MaskExtractor:
     def __init__(self,
                  pointrend_model_weights=POINTREND_MODEL_WEIGHTS,
                  pointrend_config=POINTREND_CONFIG):
+        # Identifies the predictor in evidencecache keys
+        self.weight_paths = (pointrend_model_weights, pointrend_config)
         self.cfg = get_cfg()
         self.predictor = get_pointrend_predictor(
             min_confidence=0,
@@ -68,12 +70,76 @@ class MaskExtractor:
         Returns:
             dict: {'square_boxes': (xywh)}
         """
-        boxes_xy = [bbox_wh_to_xy(box) for box in boxes_wh]
+        return self.masks_from_bboxes_batch([im], [boxes_wh],
+                                            pred_classes=[pred_classes],
+                                            class_idx=class_idx,
+                                            input_format=input_format,
+                                            rend_size=rend_size,
+                                            image_size=image_size)[0]
+
+    def masks_from_bboxes_batch(self,
+                                images,
+                                boxes_wh,
+                                pred_classes=None,
+                                class_idx=-1,
+                                input_format="RGB",
+                                rend_size=REND_SIZE,
+                                image_size=640,
+                                batch_size=8):
+        """
+        Masks for all boxes of several frames, the backbone runs once per
+        batch of batch_size frames.
+
+        Args:
+            images (list[np.ndarray]): frames
+            boxes_wh (list): for each frame, (box_nb, 4) xywh boxes
+            pred_classes (list): for each frame, (box_nb,) coco class indices
+                or None to use class_idx for all boxes of the frame
+        Returns:
+            list: for each frame, the masks_from_bboxes() annotations of
+                its boxes
+        """
+        if pred_classes is None:
+            pred_classes = [None] * len(images)
         model = self.predictor.model
+        all_annotations = [[] for _ in images]
+        frame_idxs = [
+            frame_idx for frame_idx, boxes in enumerate(boxes_wh)
+            if len(boxes) > 0
+        ]
+        for start in range(0, len(frame_idxs), batch_size):
+            batch_idxs = frame_idxs[start:start + batch_size]
+            inp_ims = []
+            instances = []
+            for frame_idx in batch_idxs:
+                inp_im, frame_instances = self._frame_inputs(
+                    images[frame_idx],
+                    boxes_wh[frame_idx],
+                    pred_classes[frame_idx],
+                    class_idx=class_idx,
+                    input_format=input_format)
+                inp_ims.append(inp_im)
+                instances.append(frame_instances)
+            inf_out = model.inference(inp_ims, instances)
+            for frame_idx, frame_out in zip(batch_idxs, inf_out):
+                all_annotations[frame_idx] = self._instance_annotations(
+                    frame_out["instances"],
+                    images[frame_idx],
+                    rend_size=rend_size,
+                    image_size=image_size)
+        return all_annotations
+
+    def _frame_inputs(self,
+                      im,
+                      boxes_wh,
+                      pred_classes,
+                      class_idx=-1,
+                      input_format="RGB"):
+        boxes_xy = [bbox_wh_to_xy(box) for box in boxes_wh]
 
         # Initialize boxes
         if not isinstance(boxes_xy, torch.Tensor):
-            boxes_xy = torch.Tensor(boxes_xy)
+            boxes_xy = torch.Tensor(np.stack(boxes_xy))
         if pred_classes is None:
             pred_classes = class_idx * torch.ones(len(boxes_xy)).long()
         else:
@@ -87,42 +153,43 @@ class MaskExtractor:
         trans_boxes = Boxes(self.aug.get_transform(im).apply_box(boxes_xy))
         inp_im = self.preprocess_img(im, input_format=input_format)
         _, height, width = inp_im["image"].shape
-        try:
-            instances = Instances(
-                image_size=(height, width),
-                pred_boxes=trans_boxes,
-                pred_classes=pred_classes,
-            )
-        except Exception:
-            import pdb
-            pdb.set_trace()
-
-        # Preprocess image
-        inf_out = model.inference([inp_im], [instances])
-
-        # Extract masks
-        instance = inf_out[0]["instances"]
+        instances = Instances(
+            image_size=(height, width),
+            pred_boxes=trans_boxes,
+            pred_classes=pred_classes,
+        )
+        return inp_im, instances
+
+    def _instance_annotations(self,
+                              instance,
+                              im,
+                              rend_size=REND_SIZE,
+                              image_size=640):
         masks = instance.pred_masks
-        inst_boxes = instance.pred_boxes.tensor
+        inst_boxes = instance.pred_boxes.tensor.cpu()
         try:
             scores = instance.scores
         except AttributeError:
             scores = masks.new_ones(masks.shape[0])
         pred_classes = instance.pred_classes
         bit_masks = BitMasks(masks.cpu())
-        keep_annotations = []
         full_boxes = torch.tensor([[0, 0, image_size, image_size]] *
                                   len(inst_boxes)).float()
         full_sized_masks = bit_masks.crop_and_resize(full_boxes, image_size)
 
-        for bbox_idx, box in enumerate(inst_boxes):
-            bbox = bbox_xy_to_wh(box.cpu())  # xy_wh
-            square_bbox = make_bbox_square(bbox, self.bbox_expansion)
-            square_boxes = torch.FloatTensor(
-                np.tile(bbox_wh_to_xy(square_bbox),
-                        (len(instances), 1)))  # xy_xy
-            crop_masks = bit_masks.crop_and_resize(square_boxes,
-                                                   rend_size).clone().detach()
+        # Crop each mask in its own square box, all boxes at once
+        bboxes = [bbox_xy_to_wh(box) for box in inst_boxes]  # xy_wh
+        square_bboxes = [
+            make_bbox_square(bbox, self.bbox_expansion) for bbox in bboxes
+        ]
+        square_boxes = torch.FloatTensor(
+            np.stack([bbox_wh_to_xy(bbox)
+                      for bbox in square_bboxes]))  # xy_xy
+        crop_masks = bit_masks.crop_and_resize(square_boxes,
+                                               rend_size).clone().detach()
+
+        keep_annotations = []
+        for bbox_idx, bbox in enumerate(bboxes):
             keep_annotations.append({
                 "bbox":
                 bbox,
@@ -133,9 +200,9 @@ class MaskExtractor:
                 "score":
                 scores[bbox_idx],
                 "square_bbox":
-                square_bbox,  # xy_wh
+                square_bboxes[bbox_idx],  # xy_wh
                 "crop_mask":
-                crop_masks[0].cpu().numpy(),
+                crop_masks[bbox_idx].cpu().numpy(),
             })
         return keep_annotations
 
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of the per-frame evidence returned by
+frameinfos.get_frame_infos() (hand regressions, masks, boxes, cameras).
+
+Entries are keyed by a hash of the input frames, the hand and object
+boxes, the camera intrinsics, the image size and the identity of the hand
+regressor and mask extractor (class, and path, size and modification time
+of their weights and configs, plus EVIDENCE_VERSION), so any fit driver
+fitting the same frames reuses them, whatever its optimization settings.
+
+Each entry is a folder with one .npy file per array, loaded memory-mapped
+(copy on write), and a small pickle with the nesting structure. Boolean
+masks are stored bit-packed.
+    <root>/<key[:2]>/<key>/
+        tree.pkl
+        0.npy, 1.npy, ...
+"""
+import hashlib
+import os
+import pickle
+import shutil
+
+import numpy as np
+import torch
+
+from homan.lib2d import maskutils
+from homan.prepare.frameinfos import get_frame_infos
+
+# Bump when get_frame_infos outputs change
+EVIDENCE_VERSION = 2
+
+
+class _ArrayRef:
+    def __init__(self, idx, device=None, bool_shape=None):
+        self.idx = idx
+        # None for numpy arrays, torch device for tensors
+        self.device = device
+        # Shape of bit-packed boolean arrays
+        self.bool_shape = bool_shape
+
+
+def _add_array(arr, arrays, device=None):
+    bool_shape = None
+    if arr.dtype == bool:
+        bool_shape = arr.shape
+        arr = maskutils.pack_bits(arr)
+    arrays.append(arr)
+    return _ArrayRef(len(arrays) - 1, device=device, bool_shape=bool_shape)
+
+
+def _pack(obj, arrays):
+    if isinstance(obj, torch.Tensor):
+        return _add_array(obj.detach().cpu().numpy(),
+                          arrays,
+                          device=str(obj.device))
+    if isinstance(obj, np.ndarray):
+        return _add_array(obj, arrays)
+    if isinstance(obj, dict):
+        return {key: _pack(val, arrays) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_pack(val, arrays) for val in obj)
+    return obj
+
+
+def _unpack(obj, arrays):
+    if isinstance(obj, _ArrayRef):
+        arr = arrays[obj.idx]
+        if obj.bool_shape is not None:
+            arr = maskutils.unpack_bits(arr, obj.bool_shape)
+        if obj.device is None:
+            return arr
+        return torch.from_numpy(arr).to(obj.device)
+    if isinstance(obj, dict):
+        return {key: _unpack(val, arrays) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_unpack(val, arrays) for val in obj)
+    return obj
+
+
+def _update_hash(hasher, obj):
+    if obj is None:
+        hasher.update(b"none")
+    elif isinstance(obj, torch.Tensor):
+        _update_hash(hasher, obj.detach().cpu().numpy())
+    elif isinstance(obj, np.ndarray):
+        hasher.update(f"{obj.dtype}{obj.shape}".encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            hasher.update(str(key).encode())
+            _update_hash(hasher, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(f"{len(obj)}".encode())
+        for val in obj:
+            _update_hash(hasher, val)
+    else:
+        hasher.update(repr(obj).encode())
+
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode="c")
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def file_identity(path):
+    """
+    (path, size, modification time) of a weight or config file, of all
+    files of a folder, or path itself if it is not a local file (e.g. a
+    detectron2:// model zoo url)
+    """
+    if os.path.isdir(path):
+        return [
+            file_identity(os.path.join(folder, file_name))
+            for folder, _, file_names in sorted(os.walk(path))
+            for file_name in sorted(file_names)
+        ]
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    return path
+
+
+def _model_identity(model):
+    if model is None:
+        return "none"
+    weight_paths = getattr(model, "weight_paths", ())
+    return [type(model).__name__] + [
+        file_identity(path) for path in weight_paths
+    ]
+
+
+class EvidenceCache():
+    """
+    Args:
+        root (str): cache folder, caching is disabled if None
+        weight_paths (list): weight and config files of extractors which
+            do not expose their own weight_paths (e.g. the hand regressor
+            checkpoint and SMPL folder), part of the keys
+    """
+    def __init__(self, root=None, weight_paths=()):
+        self.root = root
+        self.weight_ids = [file_identity(path) for path in weight_paths]
+
+    def key(self,
+            images_np,
+            hand_predictor=None,
+            mask_extractor=None,
+            hand_bboxes=None,
+            obj_bboxes=None,
+            camintr=None,
+            image_size=640,
+            key_extras=None):
+        """
+        Args:
+            key_extras: additional inputs of the extractors (e.g. the VISOR
+                masks read by VisorMaskExtractor)
+        """
+        hasher = hashlib.sha1()
+        _update_hash(hasher, [
+            EVIDENCE_VERSION,
+            _model_identity(hand_predictor),
+            _model_identity(mask_extractor), self.weight_ids, image_size
+        ])
+        _update_hash(hasher, [np.asarray(image) for image in images_np])
+        _update_hash(hasher, hand_bboxes)
+        _update_hash(hasher, np.asarray(obj_bboxes))
+        _update_hash(hasher, np.asarray(camintr))
+        _update_hash(hasher, key_extras)
+        return hasher.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def load(self, key):
+        """ Cached evidence for key, None if missing """
+        entry_path = self.entry_path(key)
+        tree_path = os.path.join(entry_path, "tree.pkl")
+        if not os.path.exists(tree_path):
+            return None
+        with open(tree_path, "rb") as p_f:
+            tree, array_nb = pickle.load(p_f)
+        arrays = [
+            _load_array(os.path.join(entry_path, f"{idx}.npy"))
+            for idx in range(array_nb)
+        ]
+        return _unpack(tree, arrays)
+
+    def save(self, key, evidence):
+        entry_path = self.entry_path(key)
+        tmp_path = f"{entry_path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        arrays = []
+        tree = _pack(evidence, arrays)
+        for idx, arr in enumerate(arrays):
+            np.save(os.path.join(tmp_path, f"{idx}.npy"), arr)
+        with open(os.path.join(tmp_path, "tree.pkl"), "wb") as p_f:
+            pickle.dump((tree, len(arrays)), p_f)
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # Saved concurrently by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def get_frame_infos(self,
+                        images_np,
+                        hand_predictor=None,
+                        mask_extractor=None,
+                        key_extras=None,
+                        **kwargs):
+        """ frameinfos.get_frame_infos(), served from the cache when the
+        same frames were already processed
+        """
+        if self.root is None:
+            return get_frame_infos(images_np, hand_predictor, mask_extractor,
+                                   **kwargs)
+        key = self.key(images_np,
+                       hand_predictor=hand_predictor,
+                       mask_extractor=mask_extractor,
+                       hand_bboxes=kwargs.get("hand_bboxes"),
+                       obj_bboxes=kwargs.get("obj_bboxes"),
+                       camintr=kwargs.get("camintr"),
+                       image_size=kwargs.get("image_size", 640),
+                       key_extras=key_extras)
+        evidence = self.load(key)
+        if evidence is None:
+            evidence = get_frame_infos(images_np, hand_predictor,
+                                       mask_extractor, **kwargs)
+            self.save(key, evidence)
+        return evidence
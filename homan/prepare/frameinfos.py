@@ -7,7 +7,7 @@ import numpy as np
 import torch
 
 from homan.lib2d import maskutils
-from homan.mocap import process_handmocap_predictions
+from homan.mocap import process_handmocap_predictions, select_person_parameters
 from homan.prepare.gtmasks import render_gt_masks
 from homan.utils.bbox import bbox_wh_to_xy, bbox_xy_to_wh
 from homan.viz.vizframeinfo import viz_frame_info
@@ -16,15 +16,25 @@ import os
 from libyana.verify import checkshape
 
 
-def process_hand_boxes(image, hand_boxes, hand_preds, mask_extractor,
-                       image_size):
+HAND_CLASS_IDX = 0
+OBJ_CLASS_IDX = -1
+
+
+def process_hand_boxes(image,
+                       hand_boxes,
+                       hand_preds,
+                       mask_extractor,
+                       image_size,
+                       hand_annots=None):
     if isinstance(hand_boxes, list):
         hand_boxes = np.stack(hand_boxes)
-    hand_annots = mask_extractor.masks_from_bboxes(image,
-                                                   hand_boxes,
-                                                   class_idx=0,
-                                                   pred_classes=None,
-                                                   image_size=image_size)
+    if hand_annots is None:
+        hand_annots = mask_extractor.masks_from_bboxes(
+            image,
+            hand_boxes,
+            class_idx=HAND_CLASS_IDX,
+            pred_classes=None,
+            image_size=image_size)
     full_masks = np.stack([annot["full_mask"] for annot in hand_annots])
     hand_parameters = process_handmocap_predictions(
         mocap_predictions=hand_preds,
@@ -34,6 +44,148 @@ def process_hand_boxes(image, hand_boxes, hand_preds, mask_extractor,
     return hand_parameters
 
 
+def frame_hand_boxes(hand_bboxes, side):
+    return [
+        boxes[side].clip(0, None) for boxes in hand_bboxes
+        if ((side in boxes) and (boxes[side] is not None))
+    ]
+
+
+def get_clip_masks(images_np,
+                   mask_extractor,
+                   hand_bboxes=None,
+                   obj_bboxes=None,
+                   image_size=640):
+    """
+    Hand and object masks of all frames with a single batched call to
+    mask_extractor.masks_from_bboxes_batch()
+
+    Returns:
+        list: for each frame, {"left_hand": [annot], "right_hand": [annot],
+            "objects": [annot]} (hand keys only for detected hands)
+    """
+    frame_boxes = []
+    frame_classes = []
+    frame_keys = []
+    for image_idx in range(len(images_np)):
+        image_hand_boxes = [{
+            key: boxes[image_idx]
+            for key, boxes in hand_bboxes.items() if boxes is not None
+        }]
+        boxes = []
+        keys = []
+        for side in ["left_hand", "right_hand"]:
+            side_boxes = frame_hand_boxes(image_hand_boxes, side)
+            boxes.extend(side_boxes)
+            keys.extend([side] * len(side_boxes))
+        classes = [HAND_CLASS_IDX] * len(boxes) + [OBJ_CLASS_IDX]
+        boxes.append(bbox_xy_to_wh(obj_bboxes[0, image_idx]))
+        keys.append("objects")
+        frame_boxes.append(np.stack(boxes))
+        frame_classes.append(classes)
+        frame_keys.append(keys)
+    all_annots = mask_extractor.masks_from_bboxes_batch(
+        images_np,
+        frame_boxes,
+        pred_classes=frame_classes,
+        image_size=image_size)
+    clip_masks = []
+    for keys, annots in zip(frame_keys, all_annots):
+        frame_masks = {}
+        for key, annot in zip(keys, annots):
+            frame_masks.setdefault(key, []).append(annot)
+        clip_masks.append(frame_masks)
+    return clip_masks
+
+
+def merge_person_parameters(all_parameters):
+    """ Concatenates the per-side hand parameters of a frame """
+    person_parameters = {}
+    for key in all_parameters[0].keys():
+        if isinstance(all_parameters[0][key], str):
+            # Process labels separately
+            person_parameters[key] = [param[key] for param in all_parameters]
+        else:
+            person_parameters[key] = torch.cat(
+                [param[key] for param in all_parameters])
+    return person_parameters
+
+
+def get_clip_person_parameters(images_np,
+                               clip_masks,
+                               hand_predictor=None,
+                               sample_folder=None,
+                               hand_bboxes=None,
+                               camintr=None,
+                               debug=True,
+                               image_size=640):
+    """
+    Hand regression for all frames, one HandMocap.regress() call per frame,
+    the predictions of each side are then post-processed (and moved to the
+    GPU) for the whole clip at once.
+
+    Arguments:
+        clip_masks (list): get_clip_masks() outputs
+        hand_bboxes (dict): see get_frame_infos()
+    Returns:
+        list: for each frame, person_parameters as in get_frame_info()
+    """
+    sides = ["left_hand", "right_hand"]
+    side_frames = {side: [] for side in sides}
+    side_boxes = {side: [] for side in sides}
+    side_preds = {side: [] for side in sides}
+    side_masks = {side: [] for side in sides}
+    for image_idx, image in enumerate(images_np):
+        image_hand_boxes = [{
+            key: boxes[image_idx]
+            for key, boxes in hand_bboxes.items() if boxes is not None
+        }]
+        if hand_predictor is not None:
+            # regress() crops, normalizes and fits the perspective camera of
+            # a single image internally, the forward passes are not batched
+            mocap_predictions = hand_predictor.regress(
+                image[..., ::-1],
+                image_hand_boxes,
+                add_margin=False,
+                # Save visualization of middle frame
+                debug=debug and (image_idx == len(images_np) // 2),
+                K=camintr[image_idx],
+                viz_path=os.path.join(sample_folder, "hands.png"))
+        for side in sides:
+            boxes = frame_hand_boxes(image_hand_boxes, side)
+            if len(boxes) == 0:
+                continue
+            side_frames[side].extend([image_idx] * len(boxes))
+            side_boxes[side].extend(boxes)
+            side_masks[side].extend(annot["full_mask"]
+                                    for annot in clip_masks[image_idx][side])
+            if hand_predictor is not None:
+                side_preds[side].extend(pred[side]
+                                        for pred in mocap_predictions)
+
+    all_parameters = [[] for _ in images_np]
+    for side in sides:
+        if len(side_boxes[side]) == 0:
+            continue
+        parameters = process_handmocap_predictions(
+            mocap_predictions=(side_preds[side]
+                               if hand_predictor is not None else None),
+            bboxes=bbox_wh_to_xy(np.stack(side_boxes[side])),
+            masks=np.stack(side_masks[side]),
+            image_size=image_size,
+            sort=False)
+        side_frames[side] = np.array(side_frames[side])
+        for image_idx, frame_parameters in enumerate(all_parameters):
+            rows = np.where(side_frames[side] == image_idx)[0]
+            if len(rows) > 0:
+                frame_parameters.append(
+                    select_person_parameters(parameters, rows))
+    return [
+        merge_person_parameters(frame_parameters)
+        for frame_parameters in all_parameters
+    ]
+
+
 def get_frame_infos(images_np,
                     hand_predictor=None,
                     mask_extractor=None,
@@ -59,6 +211,29 @@ def get_frame_infos(images_np,
     obj_mask_infos = []
     super2d_imgs = []
     with torch.no_grad():
+        clip_masks = get_clip_masks(images_np,
+                                    mask_extractor,
+                                    hand_bboxes=hand_bboxes,
+                                    obj_bboxes=obj_bboxes,
+                                    image_size=image_size)
+        clip_person_parameters = get_clip_person_parameters(
+            images_np,
+            clip_masks,
+            hand_predictor=hand_predictor,
+            sample_folder=sample_folder,
+            hand_bboxes=hand_bboxes,
+            camintr=camintr,
+            debug=debug,
+            image_size=image_size)
+        # Occlusion-aware object target masks for all frames at once
+        obj_infos = [frame_masks["objects"][0] for frame_masks in clip_masks]
+        target_masks = maskutils.add_occlusions_batch(
+            [obj_info["crop_mask"] for obj_info in obj_infos], [
+                get_hand_occlusions(frame_parameters)
+                for frame_parameters in clip_person_parameters
+            ], [obj_info["square_bbox"] for obj_info in obj_infos])
+        for obj_info, target_mask in zip(obj_infos, target_masks):
+            obj_info["target_crop_mask"] = target_mask
         for image_idx, image in enumerate(images_np):
             image_hand_boxes = {
                 key: boxes[image_idx]
@@ -76,6 +251,8 @@ def get_frame_infos(images_np,
                 # Save visualization of middle frame
                 debug=debug and (image_idx == len(images_np) // 2),
                 image_size=image_size,
+                mask_infos=clip_masks[image_idx],
+                person_parameters=clip_person_parameters[image_idx],
             )
             person_parameters.append(frame_info["person_parameters"])
             obj_mask_infos.append(frame_info["obj_mask_infos"])
@@ -89,31 +266,27 @@ def get_frame_infos(images_np,
     return person_parameters, obj_mask_infos, super2d_imgs
 
 
-def get_frame_info(image,
-                   hand_predictor=None,
-                   mask_extractor=None,
-                   sample_folder=None,
-                   hand_bboxes=None,
-                   obj_bboxes=None,
-                   camintr=None,
-                   debug=True,
-                   image_size=640):
-    """
-    Regress frame hand pose and hand+object masks
+def get_hand_occlusions(person_parameters):
+    """ [hand_nb, IMAGE_SIZE, IMAGE_SIZE] boolean hand occluders """
+    if (len(person_parameters) > 0) and ("rend" in person_parameters):
+        return ((person_parameters["rend"].sum([0, 1]).transpose(1, 0) +
+                 person_parameters["masks"]) > 0)
+    return person_parameters["masks"] > 0
 
-    Arguments:
-        image (np.ndarray): hand-object image
-        hand_bboxes (list): [{'left_hand': np.array(4,), 'right_hand': np.array(4,)}, ...] in xywh format
-        hand_predictor: Hand pose regressor
-        mask_extractor: Instance segmentor
-    Returns:
-        frame_infos (dict): Contains person parameters and mask information
-    """
-    person_parameters = {}
-    left_boxes = [
-        boxes['left_hand'].clip(0, None) for boxes in hand_bboxes
-        if (("left_hand" in boxes) and (boxes["left_hand"] is not None))
-    ]
+
+def regress_frame_hands(image,
+                        hand_predictor=None,
+                        mask_extractor=None,
+                        sample_folder=None,
+                        hand_bboxes=None,
+                        camintr=None,
+                        debug=True,
+                        image_size=640,
+                        mask_infos=None):
+    """ Hand parameters of a single frame, see get_frame_info() """
+    if mask_infos is None:
+        mask_infos = {}
+    left_boxes = frame_hand_boxes(hand_bboxes, "left_hand")
     if hand_predictor is not None:
         mocap_predictions = hand_predictor.regress(image[..., ::-1],
                                                    hand_bboxes,
@@ -133,51 +306,85 @@ def get_frame_info(image,
                                              hand_boxes=left_boxes,
                                              hand_preds=left_preds,
                                              mask_extractor=mask_extractor,
-                                             image_size=image_size)
+                                             image_size=image_size,
+                                             hand_annots=mask_infos.get(
+                                                 "left_hand"))
         all_parameters.append(left_parameters)
     if hand_predictor is not None:
         right_preds = [pred['right_hand'] for pred in mocap_predictions]
     else:
         right_preds = None
 
-    right_boxes = [
-        boxes['right_hand'].clip(0, None) for boxes in hand_bboxes
-        if (("right_hand" in boxes) and (boxes["right_hand"] is not None))
-    ]
+    right_boxes = frame_hand_boxes(hand_bboxes, "right_hand")
     if len(right_boxes) > 0:
         right_boxes = np.stack(right_boxes)
         right_parameters = process_hand_boxes(image,
                                               hand_boxes=right_boxes,
                                               hand_preds=right_preds,
                                               mask_extractor=mask_extractor,
-                                              image_size=image_size)
+                                              image_size=image_size,
+                                              hand_annots=mask_infos.get(
+                                                  "right_hand"))
         all_parameters.append(right_parameters)
 
-    for key in all_parameters[0].keys():
-        if isinstance(all_parameters[0][key], str):
-            # Process labels separately
-            person_parameters[key] = [param[key] for param in all_parameters]
-        else:
-            person_parameters[key] = torch.cat(
-                [param[key] for param in all_parameters])
+    return merge_person_parameters(all_parameters)
+
+
+def get_frame_info(image,
+                   hand_predictor=None,
+                   mask_extractor=None,
+                   sample_folder=None,
+                   hand_bboxes=None,
+                   obj_bboxes=None,
+                   camintr=None,
+                   debug=True,
+                   image_size=640,
+                   mask_infos=None,
+                   person_parameters=None):
+    """
+    Regress frame hand pose and hand+object masks
+
+    Arguments:
+        image (np.ndarray): hand-object image
+        hand_bboxes (list): [{'left_hand': np.array(4,), 'right_hand': np.array(4,)}, ...] in xywh format
+        hand_predictor: Hand pose regressor
+        mask_extractor: Instance segmentor
+        mask_infos (dict): precomputed masks of the frame, see get_clip_masks(),
+            extracted with mask_extractor if None
+        person_parameters (dict): precomputed hand parameters of the frame,
+            see get_clip_person_parameters(), regressed if None
+    Returns:
+        frame_infos (dict): Contains person parameters and mask information
+    """
+    if mask_infos is None:
+        mask_infos = {}
+    if person_parameters is None:
+        person_parameters = regress_frame_hands(
+            image,
+            hand_predictor,
+            mask_extractor,
+            sample_folder=sample_folder,
+            hand_bboxes=hand_bboxes,
+            camintr=camintr,
+            debug=debug,
+            image_size=image_size,
+            mask_infos=mask_infos)
     # Handling only 1 object
-    obj_mask_infos = mask_extractor.masks_from_bboxes(
-        image,
-        bbox_xy_to_wh(obj_bboxes),
-        pred_classes=None,
-        image_size=image_size)[0]
+    if "objects" in mask_infos:
+        obj_mask_infos = mask_infos["objects"][0]
+    else:
+        obj_mask_infos = mask_extractor.masks_from_bboxes(
+            image,
+            bbox_xy_to_wh(obj_bboxes),
+            pred_classes=None,
+            image_size=image_size)[0]
 
     # Masks with -1 for occluded parts, by merging rendered and segmentation masks
-    if (len(person_parameters) > 0) and ("rend" in person_parameters):
-        hand_occlusions = (
-            (person_parameters["rend"].sum([0, 1]).transpose(1, 0) +
-             person_parameters["masks"]) > 0)
-    else:
-        hand_occlusions = person_parameters["masks"] > 0
-    target_masks = maskutils.add_occlusions([obj_mask_infos["crop_mask"]],
-                                            hand_occlusions,
-                                            [obj_mask_infos["square_bbox"]])[0]
-    obj_mask_infos["target_crop_mask"] = target_masks
+    if "target_crop_mask" not in obj_mask_infos:
+        target_masks = maskutils.add_occlusions(
+            [obj_mask_infos["crop_mask"]], get_hand_occlusions(person_parameters),
+            [obj_mask_infos["square_bbox"]])[0]
+        obj_mask_infos["target_crop_mask"] = target_masks
     frame_infos = dict(
         person_parameters=person_parameters,
         obj_mask_infos=obj_mask_infos,
@@ -5,7 +5,7 @@ import torch
 import numpy as np
 
 from homan.utils.bbox import bbox_wh_to_xy, bbox_xy_to_wh, make_bbox_square
-import neural_renderer as nr
+from homan.utils.nmr_renderer import get_projection_renderer
 from detectron2.structures import BitMasks
 
 from libyana.visutils import imagify
@@ -21,14 +21,6 @@ def render_gt_masks(annots,
     K = annots['camera']['K']
     K = torch.Tensor(K).cuda()
     bs = K.shape[0]
-    R = torch.cuda.FloatTensor([[[1, 0, 0], [0, 1, 0], [0, 0,
-                                                        1]]]) # .repeat(bs, 1, 1)
-    trans = torch.Tensor([0, 0, 0]).cuda().unsqueeze(0) # .repeat(bs, 1, 1)
-    renderer = nr.renderer.Renderer(image_size=image_size,
-                                    K=K,
-                                    R=R,
-                                    t=trans,
-                                    orig_size=1)
     instance_idx = 0
     all_verts = []
     all_faces = []
@@ -72,8 +64,9 @@ def render_gt_masks(annots,
     # 2 * factor to be investigated !
     K_nc = K.clone()
     K_nc[:, :2] = 1 / image_size * K_nc[:, :2]
-    renderer.light_intensity_direction = 0
-    renderer.light_intensity_ambient = 1
+    renderer = get_projection_renderer(K_nc,
+                                       image_size=image_size,
+                                       style="flat")
     # renders, sil, depth = renderer(all_verts, all_faces, all_textures, K=K_nc)
     renders = [None for _ in range(len(all_verts))]
     for i in range(len(all_verts)):
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=broad-except,too-many-arguments
+"""
+Bounded prefetch pipeline for the fit drivers.
+
+Samples flow through two background stages while the main process runs
+pose search and joint optimization on the current sample:
+    1. dataset[sample_idx] + CPU preprocessing (prepare_sample), in
+        DataLoader worker processes. Tensors (the preprocessed images) come
+        back through shared memory, not through pickled copies.
+    2. evidence_fn (hand regression, mask extraction), in a thread of the
+        main process so that it can use the already loaded GPU models.
+At most `depth` samples are in flight ahead of the consumer.
+"""
+import math
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from homan.tracking import preprocess
+from homan.utils.bbox import bbox_xy_to_wh, make_bbox_square
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _identity(sample):
+    return sample
+
+
+def prepare_sample(annots,
+                   image_size,
+                   hand_expansion=0.1,
+                   obj_bbox_padding=5):
+    """
+    CPU preprocessing shared by the fit drivers.
+
+    Returns:
+        dict with
+            hand_bboxes: {left_hand: [None|frame_nb x 4], right_hand: ...} xywh, square
+            obj_bboxes: (1, frame_nb, 4) padded xyxy object boxes
+            camintr: (frame_nb, 3, 3)
+            camintr_nc: (frame_nb, 3, 3) normalized by image_size
+            images_np: (frame_nb, H, W, 3) uint8 torch.Tensor
+    """
+    hand_bboxes = {}
+    for label in ["left_hand", "right_hand"]:
+        hands = [hand for hand in annots["hands"] if hand["label"] == label]
+        if len(hands) > 0:
+            hand_bboxes[label] = make_bbox_square(
+                bbox_xy_to_wh(hands[0]['bbox']),
+                bbox_expansion=hand_expansion)
+        else:
+            hand_bboxes[label] = None
+
+    camintr = annots["camera"]["K"].copy()
+    camintr_nc = camintr.copy()
+    camintr_nc[:, :2] = camintr_nc[:, :2] / image_size
+
+    # Get object bboxes and add padding
+    obj_bboxes = np.array([annots["objects"][0]['bbox']])
+    obj_bboxes = obj_bboxes + np.array([
+        -obj_bbox_padding, -obj_bbox_padding, obj_bbox_padding,
+        obj_bbox_padding
+    ])
+
+    images_np = np.stack([
+        preprocess.get_image(image, image_size) for image in annots["images"]
+    ])
+    return dict(hand_bboxes=hand_bboxes,
+                obj_bboxes=obj_bboxes,
+                camintr=camintr,
+                camintr_nc=camintr_nc,
+                images_np=torch.from_numpy(images_np))
+
+
+class _PreparedSamples(torch.utils.data.Dataset):
+    def __init__(self, dataset, sample_idxs, image_size):
+        self.dataset = dataset
+        self.sample_idxs = list(sample_idxs)
+        self.image_size = image_size
+
+    def __len__(self):
+        return len(self.sample_idxs)
+
+    def __getitem__(self, idx):
+        sample_idx = self.sample_idxs[idx]
+        annots = self.dataset[sample_idx]
+        return sample_idx, annots, prepare_sample(annots, self.image_size)
+
+
+class SamplePrefetcher:
+    """
+    Iterates (sample_idx, annots, prep, evidence) over sample_idxs.
+
+    prep is the output of prepare_sample(), with prep["images_np"] turned
+    back into a list of (H, W, 3) arrays. evidence is the output of
+    evidence_fn(sample_idx, annots, prep), or None if evidence_fn is None.
+
+    With depth=0 everything runs synchronously in the calling thread, which
+    is the behaviour of the drivers without prefetching.
+
+    Args:
+        num_workers: DataLoader worker processes for stage 1. Use 0 if
+            dataset.__getitem__ touches CUDA, stage 1 then runs in the
+            prefetch thread (still overlapped with optimization).
+        depth: max number of samples prepared ahead of the consumer
+    """
+    def __init__(self,
+                 dataset,
+                 sample_idxs,
+                 image_size,
+                 evidence_fn=None,
+                 depth=0,
+                 num_workers=1):
+        self.samples = _PreparedSamples(dataset, sample_idxs, image_size)
+        self.evidence_fn = evidence_fn
+        self.depth = depth
+        self.num_workers = num_workers if depth > 0 else 0
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _iter_prepared(self):
+        if self.num_workers == 0:
+            for idx in range(len(self.samples)):
+                yield self.samples[idx]
+            return
+        loader = torch.utils.data.DataLoader(
+            self.samples,
+            batch_size=None,
+            shuffle=False,
+            num_workers=self.num_workers,
+            collate_fn=_identity,
+            prefetch_factor=max(1, math.ceil(self.depth / self.num_workers)))
+        yield from loader
+
+    def _process(self, sample):
+        sample_idx, annots, prep = sample
+        prep["images_np"] = list(prep["images_np"].numpy())
+        if self.evidence_fn is None:
+            evidence = None
+        else:
+            evidence = self.evidence_fn(sample_idx, annots, prep)
+        return sample_idx, annots, prep, evidence
+
+    def _put(self, out_queue, item):
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _producer(self, out_queue):
+        try:
+            for sample in self._iter_prepared():
+                if not self._put(out_queue, self._process(sample)):
+                    return
+        except Exception as exc:
+            self._put(out_queue, _Failure(exc))
+            return
+        self._put(out_queue, _END)
+
+    def __iter__(self):
+        if self.depth == 0:
+            for sample in self._iter_prepared():
+                yield self._process(sample)
+            return
+
+        self._stop.clear()
+        out_queue = queue.Queue(maxsize=self.depth)
+        producer = threading.Thread(target=self._producer,
+                                    args=(out_queue, ),
+                                    daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = out_queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            self._stop.set()
+            producer.join(timeout=5)
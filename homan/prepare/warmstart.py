@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Warm-start cache of optimized HOMan poses for chunked long-video fits.
+
+After a chunk is fitted, the per-frame object and hand parameters of the
+model are stored under (video_id, frame_idx). Later chunks sharing frames
+with already fitted ones start their pose search from the cached object
+rotations and their joint optimization from the cached poses, and can
+therefore use shorter optimization budgets.
+    <root>/<video_id>.pkl: {frame_idx: {"hand_sides": (...), key: array}}
+"""
+import os
+import pickle
+
+import numpy as np
+import torch
+
+from homan.utils.geometry import rot6d_to_matrix
+
+# HOMan state with one row per frame
+OBJECT_KEYS = ["translations_object", "rotations_object"]
+# HOMan state with hand_nb rows per frame ([h_1_t_1, h_2_t_1, ..., h_1_t_2])
+HAND_KEYS = [
+    "translations_hand", "rotations_hand", "mano_pca_pose", "mano_rot",
+    "mano_trans", "mano_betas"
+]
+
+
+class WarmStartCache():
+    """
+    Args:
+        root (str): cache folder, warm starting is disabled if None
+    """
+    def __init__(self, root=None):
+        self.root = root
+        self._videos = {}
+
+    def video_path(self, video_id):
+        return os.path.join(self.root, f"{video_id}.pkl")
+
+    def _load_video(self, video_id):
+        if video_id not in self._videos:
+            video_path = self.video_path(video_id)
+            if os.path.exists(video_path):
+                with open(video_path, "rb") as p_f:
+                    self._videos[video_id] = pickle.load(p_f)
+            else:
+                self._videos[video_id] = {}
+        return self._videos[video_id]
+
+    def save(self, video_id, frame_idxs, model):
+        """ Stores the per-frame poses of a fitted HOMan model """
+        if self.root is None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        video_frames = self._load_video(video_id)
+        for frame_idx, frame_state in zip(frame_idxs,
+                                          get_frame_states(model)):
+            video_frames[int(frame_idx)] = frame_state
+        video_path = self.video_path(video_id)
+        tmp_path = f"{video_path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as p_f:
+            pickle.dump(video_frames, p_f)
+        os.replace(tmp_path, video_path)
+
+    def get(self, video_id, frame_idxs, hand_sides):
+        """
+        Cached poses of the frames of frame_idxs fitted with the same hands
+
+        Returns:
+            None if no frame is cached, else dict with
+                time_idxs (np.ndarray): positions in frame_idxs of the cached
+                    frames
+                hand_nb (int)
+                state (dict): {key: (cached_nb, ...) or
+                    (cached_nb * hand_nb, ...)} stacked HOMan state
+        """
+        if self.root is None:
+            return None
+        video_frames = self._load_video(video_id)
+        time_idxs = [
+            time_idx for time_idx, frame_idx in enumerate(frame_idxs)
+            if int(frame_idx) in video_frames and video_frames[int(
+                frame_idx)]["hand_sides"] == tuple(hand_sides)
+        ]
+        if not time_idxs:
+            return None
+        frame_states = [
+            video_frames[int(frame_idxs[time_idx])] for time_idx in time_idxs
+        ]
+        return stack_frame_states(frame_states, time_idxs, len(hand_sides))
+
+
+def get_frame_states(model):
+    """
+    Returns:
+        frame_states (list[dict]): for each frame of the HOMan model, its
+            hand sides and object and hand state arrays
+    """
+    state = model.state_dict()
+    hand_nb = model.hand_nb
+    frame_states = []
+    for time_idx in range(state[OBJECT_KEYS[0]].shape[0]):
+        frame_state = {"hand_sides": tuple(model.hand_sides)}
+        for key in OBJECT_KEYS:
+            frame_state[key] = state[key][time_idx].cpu().numpy()
+        for key in HAND_KEYS:
+            if key in state:
+                frame_state[key] = state[key][time_idx *
+                                              hand_nb:(time_idx + 1) *
+                                              hand_nb].cpu().numpy()
+        frame_states.append(frame_state)
+    return frame_states
+
+
+def stack_frame_states(frame_states, time_idxs, hand_nb):
+    """ Warm start (see WarmStartCache.get) of the frames at time_idxs """
+    keys = set.intersection(*[set(frame) for frame in frame_states])
+    keys.discard("hand_sides")
+    state = {
+        key: np.concatenate([
+            frame[key] if key in HAND_KEYS else frame[key][None]
+            for frame in frame_states
+        ])
+        for key in keys
+    }
+    return {
+        "time_idxs": np.array(time_idxs),
+        "hand_nb": hand_nb,
+        "state": state
+    }
+
+
+def unstack_frame_states(warm_start):
+    """ Inverse of stack_frame_states, {time_idx: frame_state} """
+    hand_nb = warm_start["hand_nb"]
+    frame_states = {}
+    for idx, time_idx in enumerate(warm_start["time_idxs"]):
+        frame_states[int(time_idx)] = {
+            key: vals[idx * hand_nb:(idx + 1) *
+                      hand_nb] if key in HAND_KEYS else vals[idx]
+            for key, vals in warm_start["state"].items()
+        }
+    return frame_states
+
+
+def get_rotations_init(warm_start):
+    """ Cached object rotations, (cached_nb, 3, 3) pose search candidates """
+    rotations = torch.from_numpy(warm_start["state"]["rotations_object"])
+    return rot6d_to_matrix(rotations.cuda())
+
+
+def _get_rows(warm_start, key):
+    time_idxs = torch.from_numpy(warm_start["time_idxs"])
+    if key not in HAND_KEYS:
+        return time_idxs
+    hand_nb = warm_start["hand_nb"]
+    return (time_idxs[:, None] * hand_nb + torch.arange(hand_nb)[None]).view(-1)
+
+
+def _get_model_state(model):
+    model_state = dict(model.named_parameters())
+    model_state.update(dict(model.named_buffers()))
+    return model_state
+
+
+def apply_warm_start(model, warm_start):
+    """ Overwrites the HOMan state of the cached frames in place """
+    model_state = _get_model_state(model)
+    with torch.no_grad():
+        for key, vals in warm_start["state"].items():
+            if key not in model_state:
+                continue
+            tensor = model_state[key]
+            rows = _get_rows(warm_start, key).to(tensor.device)
+            tensor[rows] = torch.as_tensor(vals).to(tensor)
+
+
+def compute_warm_start_loss(model, warm_start, keys=None):
+    """
+    Soft constraint keeping the optimized poses of the warm started frames
+    close to their warm start values
+
+    Args:
+        keys (list): constrained state keys, all pose keys if None
+    """
+    if keys is None:
+        keys = OBJECT_KEYS + ["translations_hand", "rotations_hand"]
+    model_state = _get_model_state(model)
+    losses = []
+    for key in keys:
+        if key not in warm_start["state"] or key not in model_state:
+            continue
+        # Interpolated poses in keyframe mode
+        tensor = model.get_pose(key)
+        rows = _get_rows(warm_start, key).to(tensor.device)
+        target = torch.as_tensor(warm_start["state"][key]).to(tensor)
+        losses.append(((tensor[rows] - target)**2).mean())
+    return torch.stack(losses).sum()
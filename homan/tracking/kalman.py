@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched kinematic Kalman filter and Rauch-Tung-Striebel smoother.
+
+The motpy and filterpy models used for tracking are block diagonal: every
+measured coordinate (box center, box size, ...) evolves independently with
+a state [value, value', value'', ...] of length order + 1 and is observed
+through its first entry. All coordinates of all tracks are therefore
+filtered at once as a batch of independent small filters, looping only
+over time.
+"""
+import numpy as np
+
+
+def kinematic_transition(order, dt):
+    """ (order + 1, order + 1) state transition of a kinematic model """
+    block = np.array([[1, dt, (dt**2) / 2], [0, 1, dt], [0, 0, 1]])
+    return block[:order + 1, :order + 1]
+
+
+def white_noise(order, dt, var):
+    """ Discrete white noise process covariance, as filterpy's
+    Q_discrete_white_noise (and var itself for order 0)
+    """
+    if order == 0:
+        return np.full((1, 1), var, dtype=np.float64)
+    if order == 1:
+        noise = [[.25 * dt**4, .5 * dt**3], [.5 * dt**3, dt**2]]
+    else:
+        noise = [[.25 * dt**4, .5 * dt**3, .5 * dt**2],
+                 [.5 * dt**3, dt**2, dt], [.5 * dt**2, dt, 1]]
+    return np.array(noise) * var
+
+
+def _broadcast_cov(cov, batch_size, state_dim):
+    cov = np.asarray(cov, dtype=np.float64)
+    if cov.ndim < 2:
+        cov = cov[..., None, None] * np.eye(state_dim)
+    return np.broadcast_to(cov, (batch_size, state_dim, state_dim)).copy()
+
+
+def batch_filter(measurements, trans, proc_cov, meas_var, x_init=None,
+                 cov_init=1.):
+    """
+    Forward Kalman filter (predict then update at every step) over a batch
+    of independent coordinates observed through the first state entry.
+
+    Args:
+        measurements (np.ndarray): (time, batch_size), NaN where missing
+        trans (np.ndarray): (state_dim, state_dim) state transition
+        proc_cov: process noise, (state_dim, state_dim) or
+            (batch_size, state_dim, state_dim) or scalar (times identity)
+        meas_var: measurement variance, scalar or (batch_size,)
+        x_init (np.ndarray): (batch_size, state_dim), zeros if None
+        cov_init: initial covariance, same conventions as proc_cov
+    Returns:
+        means (np.ndarray): (time, batch_size, state_dim) filtered states
+        covs (np.ndarray): (time, batch_size, state_dim, state_dim)
+    """
+    measurements = np.asarray(measurements, dtype=np.float64)
+    time_nb, batch_size = measurements.shape
+    state_dim = trans.shape[0]
+    proc_cov = _broadcast_cov(proc_cov, batch_size, state_dim)
+    meas_var = np.broadcast_to(np.asarray(meas_var, dtype=np.float64),
+                               (batch_size, ))
+    if x_init is None:
+        state = np.zeros((batch_size, state_dim))
+    else:
+        state = np.array(x_init, dtype=np.float64)
+    cov = _broadcast_cov(cov_init, batch_size, state_dim)
+    eye = np.eye(state_dim)
+
+    means = np.empty((time_nb, batch_size, state_dim))
+    covs = np.empty((time_nb, batch_size, state_dim, state_dim))
+    for step in range(time_nb):
+        # Predict
+        state = state.dot(trans.T)
+        cov = trans @ cov @ trans.T + proc_cov
+
+        # Update coordinates with a measurement at this step
+        meas = measurements[step]
+        valid = ~np.isnan(meas)
+        if valid.any():
+            innov_var = cov[valid, 0, 0] + meas_var[valid]
+            gain = cov[valid, :, 0] / innov_var[:, None]
+            state[valid] += gain * (meas[valid] - state[valid, 0])[:, None]
+            # Joseph form, as filterpy
+            i_kh = eye - gain[:, :, None] * eye[0][None, None, :]
+            cov[valid] = (i_kh @ cov[valid] @ i_kh.transpose(0, 2, 1) +
+                          meas_var[valid, None, None] *
+                          gain[:, :, None] * gain[:, None, :])
+        means[step] = state
+        covs[step] = cov
+    return means, covs
+
+
+def rts_smoother(means, covs, trans, proc_cov):
+    """
+    Rauch-Tung-Striebel smoothing of batch_filter() outputs.
+
+    Returns:
+        smoothed (np.ndarray): (time, batch_size, state_dim)
+        smoothed_covs (np.ndarray): (time, batch_size, state_dim, state_dim)
+    """
+    smoothed = means.copy()
+    smoothed_covs = covs.copy()
+    batch_size, state_dim = means.shape[1:]
+    proc_cov = _broadcast_cov(proc_cov, batch_size, state_dim)
+    for step in range(means.shape[0] - 2, -1, -1):
+        pred_cov = trans @ smoothed_covs[step] @ trans.T + proc_cov
+        gain = smoothed_covs[step] @ trans.T @ np.linalg.inv(pred_cov)
+        pred = smoothed[step].dot(trans.T)
+        smoothed[step] += np.einsum("bij,bj->bi", gain,
+                                    smoothed[step + 1] - pred)
+        smoothed_covs[step] += (gain @ (smoothed_covs[step + 1] - pred_cov)
+                                @ gain.transpose(0, 2, 1))
+    return smoothed, smoothed_covs
@@ -1,38 +1,83 @@
 # pylint: disable=broad-except,too-many-statements,too-many-branches,logging-fstring-interpolation,import-error
 import numpy as np
 
-from motpy.tracker import get_single_object_tracker
-from motpy.model import ModelPreset, Model
+from homan.tracking import kalman
 from homan.utils.bbox import bbox_wh_to_xy
 
 
-def track_boxes(boxes_to_track, dt=0.5, out_xyxy=True):
+def boxes_to_measurements(boxes_to_track):
+    """
+    Converts x_min, y_min, x_max, y_max to c_x, c_y, w, h (as motpy's
+    Model.box_to_z), missing boxes become NaN rows
+
+    Returns:
+        measurements (np.ndarray): [frame_nb, 4]
     """
+    measurements = np.full((len(boxes_to_track), 4), np.nan)
+    for frame_idx, box in enumerate(boxes_to_track):
+        if box is not None:
+            box = np.asarray(box, dtype=np.float64)
+            measurements[frame_idx, :2] = (box[:2] + box[2:]) / 2
+            measurements[frame_idx, 2:] = box[2:] - box[:2]
+    return measurements
+
+
+def track_boxes_batch(boxes_seqs,
+                      dt=0.5,
+                      out_xyxy=True,
+                      q_var_pos=70.,
+                      q_var_size=10.,
+                      r_var=1.,
+                      p_cov_p0=1000.):
+    """
+    Smooths several box sequences of the same length at once with the
+    static position and size model of motpy (order_pos=0, order_size=0).
+
     Arguments:
-        boxes_to_track (list): [(x_min, y_min, x_max, y_max), ..., None, ...] 
+        boxes_seqs (list): seq_nb lists of [(x_min, y_min, x_max, y_max), ..., None, ...]
     Returns:
-        smoothed_boxes (np.ndarray): [frame_nb, 4] where each row encoder box
-            in (x_min, y_min, x_max, y_max) format
+        smoothed_boxes (np.ndarray): [seq_nb, frame_nb, 4]
     """
-    track_model = Model(dt=dt,
-                        order_pos=0,
-                        dim_pos=2,
-                        order_size=0,
-                        dim_size=2)
-
-    # Converts x_min, y_min, x_max, y_max to c_x, c_x', c_y, c_y', w, h
-    processed_boxes = [
-        (track_model.box_to_z(box).tolist() if box is not None else None)
-        for box in boxes_to_track
-    ]
-    tracker = get_single_object_tracker(track_model)
-    # Fix beginning artefact
-    tracker.batch_filter(processed_boxes)
-    mu, cov, _, _ = tracker.batch_filter(processed_boxes)
-    smoothed_state, _, _, _ = tracker.rts_smoother(mu, cov)
-
-    smoothed_boxes = np.stack(
-        [track_model.x_to_box(smooth[:, 0]) for smooth in smoothed_state])
+    measurements = np.concatenate(
+        [boxes_to_measurements(boxes) for boxes in boxes_seqs], 1)
+    seq_nb = len(boxes_seqs)
+    trans = kalman.kinematic_transition(0, dt)
+    proc_var = np.tile([q_var_pos, q_var_pos, q_var_size, q_var_size],
+                       seq_nb)
+    proc_cov = kalman.white_noise(0, dt, 1) * proc_var[:, None, None]
+
+    # Fix beginning artefact: filter twice, starting the second pass from
+    # the final state of the first one
+    means, covs = kalman.batch_filter(measurements,
+                                      trans,
+                                      proc_cov,
+                                      r_var,
+                                      cov_init=p_cov_p0)
+    means, covs = kalman.batch_filter(measurements,
+                                      trans,
+                                      proc_cov,
+                                      r_var,
+                                      x_init=means[-1],
+                                      cov_init=covs[-1])
+    smoothed, _ = kalman.rts_smoother(means, covs, trans, proc_cov)
+
+    # [frame_nb, seq_nb * 4] c_x, c_y, w, h -> [seq_nb, frame_nb, 4]
+    smoothed = smoothed[:, :, 0].reshape(-1, seq_nb, 4).transpose(1, 0, 2)
+    smoothed_boxes = np.concatenate([
+        smoothed[..., :2] - smoothed[..., 2:] / 2,
+        smoothed[..., :2] + smoothed[..., 2:] / 2
+    ], -1)
     if out_xyxy:
         smoothed_boxes = bbox_wh_to_xy(smoothed_boxes)
     return smoothed_boxes
+
+
+def track_boxes(boxes_to_track, dt=0.5, out_xyxy=True):
+    """
+    Arguments:
+        boxes_to_track (list): [(x_min, y_min, x_max, y_max), ..., None, ...]
+    Returns:
+        smoothed_boxes (np.ndarray): [frame_nb, 4] where each row encoder box
+            in (x_min, y_min, x_max, y_max) format
+    """
+    return track_boxes_batch([boxes_to_track], dt=dt, out_xyxy=out_xyxy)[0]
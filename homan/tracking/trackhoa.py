@@ -31,6 +31,11 @@ def track_hoa_df(
     video_id=None,
     verbose=True,
 ):
+    """
+    Args:
+        hoa_dets: pd.DataFrame from epichoa.load_video_hoa() or the
+            epichoa.HoaFrameIndex built from it (reused across calls)
+    """
     # Initialize track lists and tracker
     obj_tracker = MultiObjectTracker(dt=dt)
     tracked_obj = []
@@ -42,12 +47,13 @@ def track_hoa_df(
     tracked_lh = []
     tracked_rh = []
 
+    if not isinstance(hoa_dets, gethoa.HoaFrameIndex):
+        hoa_dets = gethoa.HoaFrameIndex(hoa_dets)
+
     # Last non-empty df
     for frame_idx in tqdm(range(start_frame, end_frame)):
-        hoa_df = hoa_dets[hoa_dets.frame == frame_idx]
-        obj_df = hoa_df[hoa_df.det_type == "object"]
         obj_dets = [
-            Detection(gethoa.row2box(row)) for _, row in obj_df.iterrows()
+            Detection(box) for box in hoa_dets.get_boxes(frame_idx, "object")
         ]
         obj_tracker.step(detections=obj_dets)
         tracked_obj.extend(
@@ -57,13 +63,13 @@ def track_hoa_df(
                 video_id=video_id,
                 det_type="object",
             ))
-        lh_df = hoa_df[(hoa_df.det_type == "hand") & (hoa_df.side == "left")]
-        rh_df = hoa_df[(hoa_df.det_type == "hand") & (hoa_df.side == "right")]
         lh_dets = [
-            Detection(gethoa.row2box(row)) for _, row in lh_df.iterrows()
+            Detection(box)
+            for box in hoa_dets.get_boxes(frame_idx, "hand", side="left")
         ]
         rh_dets = [
-            Detection(gethoa.row2box(row)) for _, row in rh_df.iterrows()
+            Detection(box)
+            for box in hoa_dets.get_boxes(frame_idx, "hand", side="right")
         ]
         lh_tracker.step(detections=lh_dets)
         rh_tracker.step(detections=rh_dets)
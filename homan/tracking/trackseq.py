@@ -78,13 +78,16 @@ def track_sequence(images,
         axis.imshow(image)
         axis.axis("off")
 
-    # Perform tracking
+    # Perform tracking in forward and backward time directions, for all
+    # items at once
+    boxes_seqs = []
     for item in setup:
-        # Perform tracking in forward and backward time directions
-        detected_boxes_wh = detected_boxes[item]
-        boxes_fwd = trackboxes.track_boxes(detected_boxes_wh, out_xyxy=True)
-        boxes_bwd = trackboxes.track_boxes(detected_boxes_wh[::-1],
-                                           out_xyxy=True)[::-1]
+        boxes_seqs.append(detected_boxes[item])
+        boxes_seqs.append(detected_boxes[item][::-1])
+    all_boxes = trackboxes.track_boxes_batch(boxes_seqs, out_xyxy=True)
+    for item_idx, item in enumerate(setup):
+        boxes_fwd = all_boxes[2 * item_idx]
+        boxes_bwd = all_boxes[2 * item_idx + 1][::-1]
 
         # Average predictions in both directions to get more
         # robust tracks
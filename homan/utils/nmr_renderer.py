@@ -1,4 +1,6 @@
 # Copyright (c) Facebook, Inc. and its affiliates.
+import threading
+
 import cv2
 import neural_renderer as nr
 import numpy as np
@@ -22,6 +24,81 @@ colors = {
     "grey": [204 / 255, 204 / 255, 204 / 255],
 }
 
+# Lighting of the pooled "projection" renderers, applied once at creation
+RENDER_STYLES = {
+    # HOMan.renderer and visualizations
+    "homan": {
+        "light_direction": [1, 0.5, 1],
+        "light_intensity_direction": 0.3,
+        "light_intensity_ambient": 0.5,
+        "background_color": [1.0, 1.0, 1.0],
+    },
+    # Flat instance colors for ground truth masks
+    "flat": {
+        "light_intensity_direction": 0,
+        "light_intensity_ambient": 1,
+    },
+}
+
+# Renderers are reconfigured at every call, keep one pool per thread (the
+# sample prefetcher renders in a background thread)
+_POOL = threading.local()
+
+
+def _get_pool():
+    if not hasattr(_POOL, "renderers"):
+        _POOL.renderers = {}
+    return _POOL.renderers
+
+
+def get_renderer(proj="persp", image_size=256, texture_size=1):
+    """
+    Shared OrthographicRenderer (proj="ortho") or PerspectiveRenderer
+    (proj="persp"), created on first use for each image size
+    """
+    key = (proj, image_size, texture_size)
+    pool = _get_pool()
+    if key not in pool:
+        if proj == "ortho":
+            renderer_cls = OrthographicRenderer
+        elif proj == "persp":
+            renderer_cls = PerspectiveRenderer
+        else:
+            raise ValueError(f"proj {proj} not in [ortho|persp]")
+        pool[key] = renderer_cls(image_size=image_size,
+                                 texture_size=texture_size)
+    return pool[key]
+
+
+def get_projection_renderer(K, R=None, t=None, image_size=640,
+                            style="homan"):
+    """
+    Shared neural_renderer Renderer in projection mode (orig_size=1, so K
+    is normalized by the image size), one per image size and style. The
+    camera K, R (identity if None) and t (zeros if None) is set at every
+    call, the rasterization buffers are reused.
+
+    Args:
+        K (torch.Tensor): (batch_size, 3, 3) or (1, 3, 3) intrinsics
+        style (str): lighting, key of RENDER_STYLES
+    """
+    key = ("projection", image_size, style, K.device)
+    pool = _get_pool()
+    if key not in pool:
+        renderer = nr.renderer.Renderer(image_size=image_size,
+                                        K=K,
+                                        R=torch.eye(3).unsqueeze(0).to(K),
+                                        t=torch.zeros(1, 3).to(K),
+                                        orig_size=1)
+        for attr, val in RENDER_STYLES[style].items():
+            setattr(renderer, attr, val)
+        pool[key] = (renderer, renderer.R, renderer.t)
+    renderer, default_R, default_t = pool[key]
+    renderer.K = K
+    renderer.R = default_R if R is None else R
+    renderer.t = default_t if t is None else t
+    return renderer
+
 
 class OrthographicRenderer(object):
     def __init__(self, image_size=256, texture_size=1):
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import bisect
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 
 
@@ -25,25 +28,105 @@ def get_frame_by_idx(video_path, frame, cap=None, invert_channels=True):
     return image, cap
 
 
-def get_frames_by_idxs(video_path, frames, invert_channels=True, strict=False):
-    images = []
+def group_frame_runs(frames, max_gap=100):
+    """
+    Split requested frames into runs decoded by a single seek each.
+
+    Arguments:
+        frames (list[int]): requested frame indices, any order, duplicates allowed
+        max_gap (int): frames further apart than max_gap start a new run (seek),
+            closer ones are reached by grabbing the frames in between
+    Returns:
+        runs (list[list[int]]): sorted unique frame indices per run
+    """
+    runs = []
+    for frame in sorted(set(frames)):
+        if runs and frame - runs[-1][-1] <= max_gap:
+            runs[-1].append(frame)
+        else:
+            runs.append([frame])
+    return runs
+
+
+def _decode_runs(video_path, runs, cap=None):
+    """
+    Decode forward through each run, seeking only at run starts and after a
+    failed grab/read, where the next requested frame starts a new run.
+
+    Returns:
+        decoded (dict): {frame: BGR image}, frames that failed are missing
+        cap (cv2.VideoCapture)
+    """
+    if cap is None:
+        cap = cv2.VideoCapture(video_path)
+    decoded = {}
+    for run in runs:
+        position = None
+        for frame in run:
+            # grab() decodes without the retrieve/convert cost
+            while position is not None and position < frame:
+                position = position + 1 if cap.grab() else None
+            if position != frame:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+                position = frame
+            ret, image_read = cap.read()
+            if not ret:
+                position = None
+                continue
+            position += 1
+            decoded[frame] = image_read
+    return decoded, cap
+
+
+def get_frames_by_idxs(video_path,
+                       frames,
+                       invert_channels=True,
+                       strict=False,
+                       max_gap=100,
+                       num_threads=1):
+    """
+    Read frames of a video, decoding contiguous runs sequentially.
+
+    Frames are sorted and grouped into runs (see group_frame_runs), a seek is
+    only issued at the start of each run. With num_threads > 1 runs are
+    decoded in a thread pool, each thread with its own cv2.VideoCapture.
+    Images are returned in the order of `frames`. If a frame can't be read,
+    even after seeking to it again, and strict is False, the closest
+    previously decoded frame is used.
+    """
     if not os.path.exists(video_path):
         raise ValueError(f"{video_path} not found")
     cap = cv2.VideoCapture(video_path)
     if cap is None:
         raise ValueError(f"Could not read {video_path} with cv2.VideoCapture")
     cv2_frame_nb = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    runs = group_frame_runs(frames, max_gap=max_gap)
+    if num_threads > 1 and len(runs) > 1:
+        def decode_run(run):
+            run_decoded, run_cap = _decode_runs(video_path, [run])
+            run_cap.release()
+            return run_decoded
+
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            results = list(pool.map(decode_run, runs))
+        decoded = {}
+        for result in results:
+            decoded.update(result)
+    else:
+        decoded, cap = _decode_runs(video_path, runs, cap=cap)
+
+    images = []
+    decoded_frames = sorted(decoded)
     for frame in frames:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
-        ret, image_read = cap.read()
-        if strict and (not ret):
+        if frame in decoded:
+            image = decoded[frame]
+        elif strict or not decoded_frames:
             raise ValueError(
                 f"Couldn't read frame {frame} of {video_path} with cv2_frame_nb {cv2_frame_nb}"
             )
-        elif (not ret):
-            pass
         else:
-            image = image_read
+            prev_idx = max(bisect.bisect_right(decoded_frames, frame) - 1, 0)
+            image = decoded[decoded_frames[prev_idx]]
 
         if invert_channels:
             image_new = image[:, :, ::-1].copy()
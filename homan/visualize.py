@@ -1,12 +1,11 @@
 import numpy as np
 import torch
 
-from homan.utils.nmr_renderer import OrthographicRenderer, PerspectiveRenderer
-import neural_renderer as nr
+from homan.utils.nmr_renderer import get_projection_renderer, get_renderer
 
 
 def visualize_perspective(image, predictions, K=None):
-    perspect_renderer = PerspectiveRenderer(image_size=max(image.shape))
+    perspect_renderer = get_renderer("persp", image_size=max(image.shape))
     new_image = image.copy()
     # 2 * factor to be investigated !
     verts = 2 * torch.Tensor(predictions["verts"]).cuda().unsqueeze(0)
@@ -25,7 +24,7 @@ def visualize_perspective(image, predictions, K=None):
 
 
 def visualize_orthographic(image, predictions):
-    ortho_renderer = OrthographicRenderer(image_size=max(image.shape))
+    ortho_renderer = get_renderer("ortho", image_size=max(image.shape))
     new_image = image.copy()
     verts = torch.Tensor(predictions["verts"]).cuda().unsqueeze(0)
     faces = torch.Tensor(predictions["faces"]).cuda().unsqueeze(0)
@@ -50,7 +49,7 @@ def visualize_hand_object(model,
                           init=False,
                           gt_only=False,
                           image_size=640,
-                          max_in_batch=2):
+                          max_in_batch=None):
     if gt_only:
         rends, masks = model.render_gt(
             model.renderer,
@@ -72,36 +71,9 @@ def visualize_hand_object(model,
                                             max_in_batch=max_in_batch)
     bs = rends.shape[0]
     # Rendered frontal image
-    new_images = []
-    for image, rend, mask in zip(images, rends, masks):
-        if image.max() > 1:
-            image = image / 255.0
-        h, w, c = image.shape
-        L = max(h, w)
-        new_image = np.pad(image.copy(), ((0, L - h), (0, L - w), (0, 0)))
-        new_image[mask] = rend[mask]
-        new_image = (new_image[:h, :w] * 255).astype(np.uint8)
-        new_images.append(new_image)
+    new_images = overlay_renders(images, rends, masks)
 
     # Rendered top-down image
-    theta = 1.3
-    x, y = np.cos(theta), np.sin(theta)
-    obj_verts, _ = model.get_verts_object()
-    mx, my, mz = obj_verts.mean(dim=(0, 1)).detach().cpu().numpy()
-
-    K = model.renderer.K
-    R2 = torch.cuda.FloatTensor([[[1, 0, 0], [0, x, -y], [0, y, x]]])
-    t2 = torch.cuda.FloatTensor([mx, my + dist, mz])
-    top_renderer = nr.renderer.Renderer(image_size=image_size,
-                                        K=K,
-                                        R=R2,
-                                        t=t2,
-                                        orig_size=1)
-    top_renderer.background_color = [1, 1, 1]
-    top_renderer.light_direction = [1, 0.5, 1]
-    top_renderer.light_intensity_direction = 0.3
-    top_renderer.light_intensity_ambient = 0.5
-    top_renderer.background_color = [1, 1, 1]
     if verts_hand_gt is None:
         top_down, _ = model.render(model.renderer,
                                    rotate=True,
@@ -125,4 +97,32 @@ def visualize_hand_object(model,
                                            init=init,
                                            max_in_batch=max_in_batch)
     top_down = (top_down * 255).astype(np.uint8)
-    return np.stack(new_images), top_down
+    return new_images, top_down
+
+
+def overlay_renders(images, rends, masks):
+    """ Pastes the rendered pixels on the (possibly non-square) images
+
+    Returns:
+        new_images (np.ndarray): (batch_size, H, W, 3) uint8
+    """
+    new_images = []
+    for image, rend, mask in zip(images, rends, masks):
+        if image.max() > 1:
+            image = image / 255.0
+        h, w, c = image.shape
+        L = max(h, w)
+        new_image = np.pad(image.copy(), ((0, L - h), (0, L - w), (0, 0)))
+        new_image[mask] = rend[mask]
+        new_image = (new_image[:h, :w] * 255).astype(np.uint8)
+        new_images.append(new_image)
+    return np.stack(new_images)
+
+
+def make_renderer(camintr, image_size=640):
+    """ Renderer with the camera conventions and lighting of HOMan.renderer
+
+    Args:
+        camintr (torch.Tensor): (batch_size, 3, 3) normalized intrinsics
+    """
+    return get_projection_renderer(camintr, image_size=image_size)
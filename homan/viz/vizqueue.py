@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# pylint: disable=broad-except,too-many-arguments
+"""
+End-of-sample visualizations of the fit drivers (final_points.png and the
+final_points videos), decoupled from the optimization loop.
+
+hand_object_job() gathers the few arrays the renders need (input frames,
+combined hand-object vertices of each view, one copy of the faces and
+textures, camera intrinsics) into a small picklable job. VizQueue then,
+depending on its mode,
+    now: renders and encodes the job in the calling process (as before)
+    async: saves the job and renders it in a spawned worker process
+    defer: saves the job only, to be replayed later with
+        python -m homan.viz.vizqueue <result_root>
+    skip: drops it
+Only one sample out of every `every` is visualized.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import multiprocessing
+import os
+import pickle
+import traceback
+
+import numpy as np
+import torch
+
+VIZ_MODES = ["now", "async", "defer", "skip"]
+JOB_NAME = "viz_job.pkl"
+
+
+def _render_inputs(model, viz_len=None, **kwargs):
+    verts, faces, textures = model.get_render_inputs(**kwargs)
+    return {
+        "verts": verts[:viz_len].detach().float().cpu().numpy(),
+        "faces": faces[0].cpu().numpy(),
+        "textures": textures[0].float().cpu().numpy(),
+        "camintr": model.renderer.K[:viz_len].detach().float().cpu().numpy(),
+    }
+
+
+def hand_object_job(model,
+                    images,
+                    sample_folder,
+                    viz_len=5,
+                    verts_hand_gt=None,
+                    verts_object_gt=None,
+                    video_exts=(".mp4", ),
+                    image_size=640):
+    """
+    Compact inputs of the final_points visualizations (prediction only, or
+    prediction, ground truth and initialization overlays if ground truth
+    vertices are provided)
+
+    Args:
+        images (list): frame_nb (H, W, 3) input images
+        viz_len (int): number of frames shown in final_points.png
+        video_exts (tuple): final_points video formats
+    """
+    with torch.no_grad():
+        renders = {"pred": _render_inputs(model)}
+        png_views = [("frontal_pred", "pred", "frontal"),
+                     ("topdown_pred", "pred", "topdown")]
+        if verts_hand_gt is None:
+            clip_rows = [[("input", "frontal", None),
+                          ("pred", "frontal", None)],
+                         [(None, "topdown", None),
+                          ("pred", "topdown", "Pred")]]
+        else:
+            gt_kwargs = dict(verts_hand_gt=verts_hand_gt,
+                             verts_object_gt=verts_object_gt)
+            renders["gt_only"] = _render_inputs(model,
+                                                gt_only=True,
+                                                **gt_kwargs)
+            renders["pred+gt"] = _render_inputs(model, **gt_kwargs)
+            renders["init+gt"] = _render_inputs(model,
+                                                viz_len=viz_len,
+                                                init=True,
+                                                **gt_kwargs)
+            png_views += [("frontal_pred+gt", "pred+gt", "frontal"),
+                          ("topdown_pred+gt", "pred+gt", "topdown"),
+                          ("frontal_init+gt", "init+gt", "frontal"),
+                          ("topdown_init+gt", "init+gt", "topdown")]
+            clip_rows = [[("input", "frontal", None),
+                          ("pred", "frontal", None),
+                          ("gt_only", "frontal", None)],
+                         [("pred+gt", "topdown", "Pred + GT"),
+                          ("pred", "topdown", "Pred"),
+                          ("gt_only", "topdown", "Ground Truth")]]
+    video_paths = [
+        os.path.join(sample_folder, f"final_points{ext}") for ext in video_exts
+    ]
+    return {
+        "images": np.stack([_as_uint8(image) for image in images]),
+        "image_size": image_size,
+        "viz_len": viz_len,
+        "renders": renders,
+        "png_views": png_views,
+        "png_path": os.path.join(sample_folder, "final_points.png"),
+        "clip_rows": clip_rows,
+        "video_paths": video_paths,
+    }
+
+
+def _as_uint8(image):
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = image.astype(np.uint8)
+    return image
+
+
+def render_views(images, render_inputs, image_size=640, max_in_batch=None):
+    """
+    Returns:
+        views (dict): {"frontal": (N, H, W, 3), "topdown": (N, L, L, 3)}
+            uint8 renders of the N frames of render_inputs
+    """
+    # pylint: disable=import-outside-toplevel
+    from libyana.lib3d import trans3d
+
+    from homan.homan import HOMan
+    from homan.visualize import make_renderer, overlay_renders
+
+    frame_nb = len(render_inputs["verts"])
+    verts = torch.from_numpy(render_inputs["verts"]).cuda()
+    # Shared by all frames
+    faces = torch.from_numpy(render_inputs["faces"]).cuda().unsqueeze(0)
+    textures = torch.from_numpy(render_inputs["textures"]).cuda().unsqueeze(0)
+    camintr = torch.from_numpy(render_inputs["camintr"]).cuda()
+    renderer = make_renderer(camintr, image_size=image_size)
+    with torch.no_grad():
+        rends, masks = HOMan.render_limem(renderer,
+                                          verts,
+                                          faces,
+                                          textures,
+                                          K=camintr,
+                                          max_in_batch=max_in_batch)
+        top_down, _ = HOMan.render_limem(renderer,
+                                         trans3d.rot_points(verts),
+                                         faces,
+                                         textures,
+                                         K=camintr,
+                                         max_in_batch=max_in_batch)
+    return {
+        "frontal": overlay_renders(images[:frame_nb], rends, masks),
+        "topdown": (top_down * 255).astype(np.uint8)
+    }
+
+
+def render_job(job):
+    """ Renders the views of job and writes final_points.png and videos """
+    # pylint: disable=import-outside-toplevel
+    from homan.eval import evalviz
+    from homan.viz import cliputils
+    from homan.viz.viz_gtpred_points import viz_gtpred_points
+
+    images = job["images"]
+    viz_len = job["viz_len"]
+    views = {
+        name: render_views(images, render_inputs, image_size=job["image_size"])
+        for name, render_inputs in job["renders"].items()
+    }
+    views["input"] = {"frontal": images}
+    viz_gtpred_points(images=images[:viz_len],
+                      pred_images={
+                          title: views[name][view][:viz_len]
+                          for title, name, view in job["png_views"]
+                      },
+                      save_path=job["png_path"])
+    clip_rows = []
+    for row in job["clip_rows"]:
+        cells = []
+        for name, view, text in row:
+            if name is None:
+                cell = np.zeros_like(views["pred"][view])
+            else:
+                cell = views[name][view]
+            if text is not None:
+                cell = cliputils.add_clip_text(cell, text)
+            cells.append(np.stack(cell))
+        clip_rows.append(np.concatenate(cells, 2))
+    clip = np.concatenate(clip_rows, 1)
+    for video_path in job["video_paths"]:
+        evalviz.make_video_np(clip, video_path, resize_factor=0.5)
+
+
+def render_job_file(job_path, remove=True):
+    with open(job_path, "rb") as p_f:
+        job = pickle.load(p_f)
+    render_job(job)
+    if remove:
+        os.remove(job_path)
+    return job_path
+
+
+def make_pool(num_workers):
+    # CUDA cannot be re-initialized in forked processes
+    return ProcessPoolExecutor(max_workers=num_workers,
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+class VizQueue():
+    """
+    Args:
+        mode (str): one of VIZ_MODES
+        every (int): visualize one sample out of every
+        num_workers (int): worker processes in async mode
+    """
+    def __init__(self, mode="now", every=1, num_workers=1):
+        if mode not in VIZ_MODES:
+            raise ValueError(f"mode {mode} not in {VIZ_MODES}")
+        self.mode = mode
+        self.every = max(1, every)
+        self.num_workers = num_workers
+        self._submitted = 0
+        self._pool = None
+        self._pending = []
+
+    def wants(self):
+        """ Whether the next submitted sample will be visualized, to avoid
+        gathering jobs which are dropped anyway
+        """
+        return self.mode != "skip" and self._submitted % self.every == 0
+
+    def submit(self, job, job_folder):
+        """
+        Args:
+            job (dict): output of hand_object_job(), or a callable returning
+                it (only called if the sample is visualized)
+            job_folder (str): where the job is saved in async and defer modes
+        """
+        wanted = self.wants()
+        self._submitted += 1
+        if not wanted:
+            return
+        if callable(job):
+            job = job()
+        if self.mode == "now":
+            render_job(job)
+            return
+
+        job_path = os.path.join(job_folder, JOB_NAME)
+        with open(job_path, "wb") as p_f:
+            pickle.dump(job, p_f)
+        if self.mode == "async":
+            self._wait(max_pending=2 * self.num_workers)
+            self._pending.append(self._get_pool().submit(
+                render_job_file, job_path))
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = make_pool(self.num_workers)
+        return self._pool
+
+    def _wait(self, max_pending=0):
+        while len(self._pending) > max_pending:
+            future = self._pending.pop(0)
+            try:
+                future.result()
+            except Exception:
+                traceback.print_exc()
+
+    def close(self):
+        """ Waits for the pending async jobs """
+        self._wait()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render visualization jobs deferred by the fit drivers")
+    parser.add_argument("result_root")
+    parser.add_argument("--num_workers", default=1, type=int)
+    parser.add_argument("--keep_jobs",
+                        action="store_true",
+                        help="Keep the job files after rendering")
+    args = parser.parse_args()
+    job_paths = sorted(
+        glob.glob(os.path.join(args.result_root, "**", JOB_NAME),
+                  recursive=True))
+    print(f"Rendering {len(job_paths)} visualization jobs")
+    with make_pool(args.num_workers) as pool:
+        futures = [
+            pool.submit(render_job_file, job_path, remove=not args.keep_jobs)
+            for job_path in job_paths
+        ]
+        for job_path, future in zip(job_paths, futures):
+            try:
+                future.result()
+            except Exception:
+                print(f"Failed rendering {job_path}")
+                traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
@@ -318,15 +318,12 @@ def main(args):
 
             # Populate person_parameters target_masks and K_roi given
             # object occlusions
-            for person_param, obj_param, cam in zip(person_parameters,
-                                                    object_parameters,
-                                                    camintr):
-                maskutils.add_target_hand_occlusions(
-                    person_param,
-                    obj_param,
-                    cam,
-                    debug=args.debug,
-                    sample_folder=sample_folder)
+            maskutils.add_target_hand_occlusions_batch(
+                person_parameters,
+                object_parameters,
+                camintr,
+                debug=args.debug,
+                sample_folder=sample_folder)
 
             indep_fit_res = {
                 "person_parameters": person_parameters,
@@ -120,6 +120,6 @@ def compute_hand_iou(homan: HOMan):
     # Rendering happens in ROI
     camintr = homan.camintr_rois_hand
     rend = homan.losses.renderer(v_hand, f_hand, K=camintr, mode="silhouettes")
-    image = homan.keep_mask_hand * rend
-    ious = batch_mask_iou(image, homan.ref_mask_hand)
+    image = homan.keep_mask_hand.float() * rend
+    ious = batch_mask_iou(image, homan.ref_mask_hand.float())
     return ious.mean().item()
\ No newline at end of file